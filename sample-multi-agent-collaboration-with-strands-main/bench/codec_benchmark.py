@@ -0,0 +1,102 @@
+"""Micro-benchmark for the DynamoDB codec on large conversations.
+
+Compares src/shared/ddb_codec.py with the path the orchestrator used before:
+the resource layer's TypeDeserializer followed by a recursive parse_decimals
+pass on reads, and a Decimal conversion before TypeSerializer on writes
+(the resource layer rejects floats).
+
+    python bench/codec_benchmark.py --turns 200 --repeat 20
+"""
+import argparse
+import json
+import time
+from decimal import Decimal
+from pathlib import Path
+import sys
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "src" / "shared"))
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer  # noqa: E402
+
+import ddb_codec  # noqa: E402
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def parse_decimals(data):
+    """The recursive pass tool_config used to run over every loaded orchestration."""
+    if isinstance(data, Decimal):
+        return int(data) if data % 1 == 0 else float(data)
+    elif isinstance(data, dict):
+        return {k: parse_decimals(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [parse_decimals(item) for item in data]
+    else:
+        return data
+
+
+def baseline_serialize(value):
+    return _serializer.serialize(json.loads(json.dumps(value), parse_float=Decimal))
+
+
+def baseline_deserialize(value):
+    return parse_decimals(_deserializer.deserialize(value))
+
+
+def conversation(turns):
+    """Alternating assistant tool calls and user tool results, the shape the orchestrator stores."""
+    messages = [{"role": "user", "content": [{"text": json.dumps({"orderId": "order-1", "items": ["burger", "fries"]})}]}]
+    for turn in range(turns):
+        tool_use_id = f"tooluse_{turn}"
+        messages.append({"role": "assistant", "content": [
+            {"text": "Sending the order to the kitchen. " * 4},
+            {"toolUse": {"toolUseId": tool_use_id, "name": "cook_burger", "input": {
+                "burgerOrder": "double cheeseburger, no onions",
+                "quantity": turn % 4 + 1,
+                "price": 12.5 + turn / 100,
+                "extras": [{"name": "bacon", "price": 1.25}, {"name": "pickles", "price": 0.0}],
+            }}},
+        ]})
+        messages.append({"role": "user", "content": [{"toolResult": {
+            "toolUseId": tool_use_id,
+            "content": [{"text": f"Task completed, details: burger {turn} ready"}],
+            "status": "success",
+        }}]})
+    return messages
+
+
+def measure(fn, values, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for value in values:
+            fn(value)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="tool call rounds in the conversation")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement, the best is reported")
+    args = parser.parse_args()
+
+    messages = conversation(args.turns)
+    encoded = [ddb_codec.serialize(message) for message in messages]
+    assert [baseline_deserialize(value) for value in encoded] == [ddb_codec.deserialize(value) for value in encoded]
+
+    print(f"conversation: {len(messages)} messages, {len(json.dumps(messages)) // 1024} KiB")
+    results = {
+        "serialize": (measure(baseline_serialize, messages, args.repeat),
+                      measure(ddb_codec.serialize, messages, args.repeat)),
+        "deserialize": (measure(baseline_deserialize, encoded, args.repeat),
+                        measure(ddb_codec.deserialize, encoded, args.repeat)),
+    }
+    for name, (baseline, codec) in results.items():
+        print(f"{name:<12} baseline {baseline:8.2f} ms  codec {codec:8.2f} ms  speedup {baseline / codec:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""A small evaluator for the DynamoDB expression syntax used by this project.
+
+Supports condition, key condition and update expressions over items held as
+plain python values (numbers as Decimal, string sets as python sets):
+
+- paths with #name placeholders, dots and list indexes
+- comparisons, BETWEEN, IN, AND / OR / NOT and parentheses
+- attribute_exists, attribute_not_exists, attribute_type, begins_with, contains, size
+- SET (with + / -, if_not_exists and list_append), REMOVE, ADD and DELETE
+"""
+import copy
+import re
+from decimal import Decimal
+
+MISSING = object()
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<op><>|<=|>=|=|<|>|\(|\)|,|\.|\[|\]|\+|-)
+  | (?P<value>:[A-Za-z0-9_]+)
+  | (?P<name>\#?[A-Za-z0-9_]+)
+""", re.VERBOSE)
+
+KEYWORDS = {"AND", "OR", "NOT", "BETWEEN", "IN", "SET", "REMOVE", "ADD", "DELETE"}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if match is None:
+            raise ExpressionError(f"Invalid expression near: {expression[position:]}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "space":
+            continue
+        if kind == "name" and text.upper() in KEYWORDS:
+            tokens.append(("keyword", text.upper()))
+        else:
+            tokens.append((kind, text))
+    return tokens
+
+
+class Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind, text=None):
+        token_kind, token_text = self.peek()
+        if token_kind == kind and (text is None or token_text == text):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind, text=None):
+        if not self.accept(kind, text):
+            raise ExpressionError(f"Expected {text or kind} but found {self.peek()[1]}")
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # paths and operands
+
+    def parse_path(self):
+        kind, text = self.next()
+        if kind != "name":
+            raise ExpressionError(f"Expected attribute name but found {text}")
+        path = [self.resolve_name(text)]
+        while True:
+            if self.accept("op", "."):
+                kind, text = self.next()
+                path.append(self.resolve_name(text))
+            elif self.accept("op", "["):
+                kind, text = self.next()
+                path.append(int(text))
+                self.expect("op", "]")
+            else:
+                return path
+
+    def resolve_name(self, text):
+        if text.startswith("#"):
+            if text not in self.names:
+                raise ExpressionError(f"Missing ExpressionAttributeNames entry {text}")
+            return self.names[text]
+        return text
+
+    def parse_operand(self):
+        kind, text = self.peek()
+        if kind == "value":
+            self.next()
+            if text not in self.values:
+                raise ExpressionError(f"Missing ExpressionAttributeValues entry {text}")
+            value = self.values[text]
+            return lambda item: value
+        if kind == "name" and self.peek(1) == ("op", "("):
+            return self.parse_function()
+        path = self.parse_path()
+        return lambda item: get_path(item, path)
+
+    def parse_function(self):
+        _, name = self.next()
+        self.expect("op", "(")
+        if name in ("attribute_exists", "attribute_not_exists"):
+            path = self.parse_path()
+            self.expect("op", ")")
+            if name == "attribute_exists":
+                return lambda item: get_path(item, path) is not MISSING
+            return lambda item: get_path(item, path) is MISSING
+
+        arguments = [self.parse_operand()]
+        while self.accept("op", ","):
+            arguments.append(self.parse_operand())
+        self.expect("op", ")")
+
+        if name == "begins_with":
+            return lambda item: begins_with(arguments[0](item), arguments[1](item))
+        if name == "contains":
+            return lambda item: contains(arguments[0](item), arguments[1](item))
+        if name == "size":
+            return lambda item: size(arguments[0](item))
+        if name == "attribute_type":
+            return lambda item: attribute_type(arguments[0](item)) == arguments[1](item)
+        if name == "if_not_exists":
+            def if_not_exists(item):
+                value = arguments[0](item)
+                return arguments[1](item) if value is MISSING else value
+            return if_not_exists
+        if name == "list_append":
+            return lambda item: list(arguments[0](item)) + list(arguments[1](item))
+        raise ExpressionError(f"Unsupported function {name}")
+
+    # conditions
+
+    def parse_condition(self):
+        left = self.parse_and()
+        while self.accept("keyword", "OR"):
+            right = self.parse_and()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.accept("keyword", "AND"):
+            right = self.parse_not()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def parse_not(self):
+        if self.accept("keyword", "NOT"):
+            inner = self.parse_not()
+            return lambda item: not inner(item)
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        if self.accept("op", "("):
+            inner = self.parse_condition()
+            self.expect("op", ")")
+            return inner
+
+        left = self.parse_operand()
+        kind, text = self.peek()
+        if kind == "op" and text in COMPARATORS:
+            self.next()
+            right = self.parse_operand()
+            compare = COMPARATORS[text]
+            return lambda item: compare(left(item), right(item))
+        if self.accept("keyword", "BETWEEN"):
+            low = self.parse_operand()
+            self.expect("keyword", "AND")
+            high = self.parse_operand()
+            return lambda item: compare_values(low(item), left(item), "<=") and compare_values(left(item), high(item), "<=")
+        if self.accept("keyword", "IN"):
+            self.expect("op", "(")
+            options = [self.parse_operand()]
+            while self.accept("op", ","):
+                options.append(self.parse_operand())
+            self.expect("op", ")")
+            return lambda item: any(equals(left(item), option(item)) for option in options)
+        # a bare function call such as attribute_exists(x)
+        return lambda item: left(item) is True
+
+    # updates
+
+    def parse_update(self):
+        actions = []
+        while not self.done():
+            kind, clause = self.next()
+            if kind != "keyword" or clause not in ("SET", "REMOVE", "ADD", "DELETE"):
+                raise ExpressionError(f"Unexpected {clause} in update expression")
+            while True:
+                path = self.parse_path()
+                if clause == "SET":
+                    self.expect("op", "=")
+                    actions.append(("SET", path, self.parse_set_value()))
+                elif clause == "REMOVE":
+                    actions.append(("REMOVE", path, None))
+                else:
+                    actions.append((clause, path, self.parse_operand()))
+                if not self.accept("op", ","):
+                    break
+        return actions
+
+    def parse_set_value(self):
+        left = self.parse_operand()
+        if self.accept("op", "+"):
+            right = self.parse_operand()
+            return lambda item: left(item) + right(item)
+        if self.accept("op", "-"):
+            right = self.parse_operand()
+            return lambda item: left(item) - right(item)
+        return left
+
+
+def get_path(item, path):
+    current = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(current, list) or part >= len(current):
+                return MISSING
+            current = current[part]
+        else:
+            if not isinstance(current, dict) or part not in current:
+                return MISSING
+            current = current[part]
+    return current
+
+
+def set_path(item, path, value):
+    current = item
+    for part in path[:-1]:
+        current = current[part] if isinstance(part, int) else current.get(part, MISSING)
+        if current is MISSING or not isinstance(current, (dict, list)):
+            raise ExpressionError("The document path provided in the update expression is invalid for update")
+    last = path[-1]
+    if isinstance(last, int) and last >= len(current):
+        current.append(value)
+    else:
+        current[last] = value
+
+
+def remove_path(item, path):
+    parent = get_path(item, path[:-1]) if len(path) > 1 else item
+    if parent is MISSING:
+        return
+    last = path[-1]
+    if isinstance(parent, dict):
+        parent.pop(last, None)
+    elif isinstance(parent, list) and last < len(parent):
+        parent.pop(last)
+
+
+def equals(left, right):
+    if left is MISSING or right is MISSING:
+        return False
+    return left == right
+
+
+def compare_values(left, right, operator):
+    if left is MISSING or right is MISSING or type(left) != type(right):
+        return False
+    return {
+        "<": left < right, "<=": left <= right,
+        ">": left > right, ">=": left >= right,
+    }[operator]
+
+
+COMPARATORS = {
+    "=": equals,
+    "<>": lambda left, right: left is not MISSING and right is not MISSING and left != right,
+    "<": lambda left, right: compare_values(left, right, "<"),
+    "<=": lambda left, right: compare_values(left, right, "<="),
+    ">": lambda left, right: compare_values(left, right, ">"),
+    ">=": lambda left, right: compare_values(left, right, ">="),
+}
+
+
+def begins_with(value, prefix):
+    return isinstance(value, (str, bytes)) and value.startswith(prefix)
+
+
+def contains(value, member):
+    if value is MISSING or member is MISSING:
+        return False
+    if isinstance(value, str):
+        return isinstance(member, str) and member in value
+    if isinstance(value, (set, list)):
+        return member in value
+    return False
+
+
+def size(value):
+    return Decimal(len(value)) if value is not MISSING else MISSING
+
+
+def attribute_type(value):
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, Decimal):
+        return "N"
+    if isinstance(value, (bytes, bytearray)):
+        return "B"
+    if value is None:
+        return "NULL"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, set):
+        sample = next(iter(value))
+        return "SS" if isinstance(sample, str) else "NS" if isinstance(sample, Decimal) else "BS"
+    return MISSING
+
+
+def compile_condition(expression, names=None, values=None):
+    parser = Parser(expression, names, values)
+    condition = parser.parse_condition()
+    if not parser.done():
+        raise ExpressionError(f"Unexpected {parser.peek()[1]} in condition expression")
+    return condition
+
+
+def apply_update(item, expression, names=None, values=None):
+    """Applies the update in place, returning the list of paths it touched."""
+    actions = Parser(expression, names, values).parse_update()
+    # every operand is evaluated against the item as it was before the update
+    original = copy.deepcopy(item)
+    updated_paths = []
+    for action, path, operand in actions:
+        if action == "SET":
+            set_path(item, path, operand(original))
+        elif action == "REMOVE":
+            remove_path(item, path)
+        elif action == "ADD":
+            value = operand(original)
+            current = get_path(item, path)
+            if current is MISSING:
+                set_path(item, path, copy.deepcopy(value))
+            elif isinstance(current, set):
+                current |= value
+            else:
+                set_path(item, path, current + value)
+        elif action == "DELETE":
+            current = get_path(item, path)
+            if isinstance(current, set):
+                current -= operand(original)
+                if not current:
+                    remove_path(item, path)
+        updated_paths.append(path)
+    return updated_paths
+
+
+def project_paths(item, paths):
+    """Builds the nested subset of item covering paths, as returned for UPDATED_NEW / UPDATED_OLD."""
+    projection = {}
+    for path in paths:
+        value = get_path(item, path)
+        if value is MISSING:
+            continue
+        current = projection
+        source = item
+        for part in path[:-1]:
+            source = source[part]
+            if isinstance(part, int):
+                # list elements are returned whole
+                break
+            current = current.setdefault(part, {})
+        else:
+            current[path[-1]] = copy.deepcopy(value)
+            continue
+        projection[path[0]] = copy.deepcopy(item[path[0]])
+    return projection
@@ -0,0 +1,554 @@
+"""In-memory stand-ins for the AWS clients used by the orchestrator and agents.
+
+install() swaps boto3.client / boto3.resource for factories returning these
+fakes, so the Lambda modules can be imported unchanged. The DynamoDB resource
+and low-level client share the same tables. Items and messages
+are round-tripped through the boto3 serializers so type errors (floats in
+DynamoDB items, non-JSON bodies) surface the same way they would against AWS.
+"""
+import base64
+import copy
+import hashlib
+import io
+import json
+import os
+import threading
+import uuid
+from collections import Counter
+
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from dynamodb_expressions import apply_update, compile_condition, project_paths
+
+MAX_ITEM_SIZE = 400 * 1024
+SCAN_PAGE_SIZE = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# A 1x1 transparent PNG, returned in place of Nova Canvas images.
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+
+
+def client_error(code, message, operation):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class CallCounter:
+    """Counts calls per (service, operation) across every fake client."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, service, operation):
+        with self.lock:
+            self.counts[(service, operation)] += 1
+
+    def total(self, service):
+        with self.lock:
+            return sum(count for (name, _), count in self.counts.items() if name == service)
+
+    def by_operation(self, service):
+        with self.lock:
+            return {operation: count for (name, operation), count in self.counts.items() if name == service}
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+def to_attribute_values(item):
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+
+def from_attribute_values(item):
+    return {key: _deserializer.deserialize(value) for key, value in item.items()}
+
+
+def normalise(item):
+    """Converts an item the way the resource layer would, rejecting floats and turning numbers into Decimal."""
+    return from_attribute_values(to_attribute_values(item))
+
+
+def item_size(item):
+    return len(json.dumps(to_attribute_values(item), default=str))
+
+
+# DynamoDB
+
+
+class FakeTable:
+    def __init__(self, name, partition_key, sort_key, counter):
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.counter = counter
+        self.items = {}
+        self.lock = threading.RLock()
+        # called with every item written, lets the harness watch for progress
+        self.listeners = []
+
+    def notify(self, item):
+        for listener in self.listeners:
+            listener(copy.deepcopy(item))
+
+    def key_of(self, item):
+        if self.partition_key not in item or (self.sort_key and self.sort_key not in item):
+            raise client_error("ValidationException", "The provided key element does not match the schema", "Key")
+        return (item[self.partition_key], item.get(self.sort_key) if self.sort_key else None)
+
+    def check_condition(self, item, condition, names, values, operation):
+        if condition is None:
+            return
+        if isinstance(condition, ConditionBase):
+            built = ConditionExpressionBuilder().build_expression(condition)
+            condition = built.condition_expression
+            names = {**(names or {}), **built.attribute_name_placeholders}
+            values = {**(values or {}), **built.attribute_value_placeholders}
+        if not compile_condition(condition, names, normalise(values or {}))(item or {}):
+            raise client_error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        self.counter.record("dynamodb", "PutItem")
+        item = normalise(Item)
+        if item_size(item) > MAX_ITEM_SIZE:
+            raise client_error("ValidationException", "Item size has exceeded the maximum allowed size", "PutItem")
+        key = self.key_of(item)
+        with self.lock:
+            existing = self.items.get(key)
+            self.check_condition(existing, ConditionExpression, ExpressionAttributeNames,
+                                 ExpressionAttributeValues, "PutItem")
+            self.items[key] = item
+        self.notify(item)
+        response = {}
+        if ReturnValues == "ALL_OLD" and existing is not None:
+            response["Attributes"] = copy.deepcopy(existing)
+        return response
+
+    def get_item(self, Key, ConsistentRead=False, **kwargs):
+        self.counter.record("dynamodb", "GetItem")
+        with self.lock:
+            item = self.items.get(self.key_of(normalise(Key)))
+            return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        self.counter.record("dynamodb", "DeleteItem")
+        key = self.key_of(normalise(Key))
+        with self.lock:
+            self.check_condition(self.items.get(key), ConditionExpression, ExpressionAttributeNames,
+                                 ExpressionAttributeValues, "DeleteItem")
+            existing = self.items.pop(key, None)
+        if ReturnValues == "ALL_OLD" and existing is not None:
+            return {"Attributes": copy.deepcopy(existing)}
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        self.counter.record("dynamodb", "UpdateItem")
+        key_item = normalise(Key)
+        key = self.key_of(key_item)
+        values = normalise(ExpressionAttributeValues or {})
+        with self.lock:
+            existing = self.items.get(key)
+            self.check_condition(existing, ConditionExpression, ExpressionAttributeNames,
+                                 ExpressionAttributeValues, "UpdateItem")
+            item = copy.deepcopy(existing) if existing is not None else dict(key_item)
+            try:
+                paths = apply_update(item, UpdateExpression, ExpressionAttributeNames, values)
+            except (ValueError, TypeError, KeyError) as e:
+                raise client_error("ValidationException", str(e), "UpdateItem")
+            item = normalise(item)
+            if item_size(item) > MAX_ITEM_SIZE:
+                raise client_error("ValidationException", "Item size has exceeded the maximum allowed size", "UpdateItem")
+            self.items[key] = item
+        self.notify(item)
+
+        response = {}
+        if ReturnValues == "ALL_NEW":
+            response["Attributes"] = copy.deepcopy(item)
+        elif ReturnValues == "ALL_OLD" and existing is not None:
+            response["Attributes"] = copy.deepcopy(existing)
+        elif ReturnValues == "UPDATED_NEW":
+            response["Attributes"] = project_paths(item, paths)
+        elif ReturnValues == "UPDATED_OLD" and existing is not None:
+            response["Attributes"] = project_paths(existing, paths)
+        return response
+
+    def sorted_keys(self):
+        return sorted(self.items, key=lambda key: (str(key[0]), key[1] if key[1] is not None else 0))
+
+    def paginate(self, keys, exclusive_start_key, limit, operation):
+        if exclusive_start_key is not None:
+            start = self.key_of(normalise(exclusive_start_key))
+            keys = keys[keys.index(start) + 1:] if start in keys else keys
+        page = keys[:limit]
+        response = {"Items": [copy.deepcopy(self.items[key]) for key in page], "Count": len(page)}
+        if len(keys) > limit:
+            last = self.items[page[-1]]
+            response["LastEvaluatedKey"] = {
+                name: last[name] for name in (self.partition_key, self.sort_key) if name
+            }
+        self.counter.record("dynamodb", operation)
+        return response
+
+    def scan(self, ExclusiveStartKey=None, Limit=None, **kwargs):
+        with self.lock:
+            return self.paginate(self.sorted_keys(), ExclusiveStartKey, Limit or SCAN_PAGE_SIZE, "Scan")
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey=None, Limit=None, ScanIndexForward=True,
+              ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        if isinstance(KeyConditionExpression, ConditionBase):
+            built = ConditionExpressionBuilder().build_expression(KeyConditionExpression, is_key_condition=True)
+            KeyConditionExpression = built.condition_expression
+            names = {**names, **built.attribute_name_placeholders}
+            values = {**values, **built.attribute_value_placeholders}
+        condition = compile_condition(KeyConditionExpression, names, normalise(values))
+        with self.lock:
+            keys = [key for key in self.sorted_keys() if condition(self.items[key])]
+            if not ScanIndexForward:
+                keys.reverse()
+            return self.paginate(keys, ExclusiveStartKey, Limit or SCAN_PAGE_SIZE, "Query")
+
+    def batch_writer(self, **kwargs):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    """Buffers writes and flushes them 25 at a time like the boto3 batch writer."""
+
+    def __init__(self, table):
+        self.table = table
+        self.buffer = []
+
+    def put_item(self, Item):
+        self.buffer.append(("put", normalise(Item)))
+        if len(self.buffer) >= 25:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.buffer.append(("delete", normalise(Key)))
+        if len(self.buffer) >= 25:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.table.counter.record("dynamodb", "BatchWriteItem")
+        with self.table.lock:
+            for action, item in self.buffer:
+                if action == "put":
+                    self.table.items[self.table.key_of(item)] = item
+                else:
+                    self.table.items.pop(self.table.key_of(item), None)
+        for action, item in self.buffer:
+            if action == "put":
+                self.table.notify(item)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class FakeDynamoDBResource:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise client_error("ResourceNotFoundException", f"Requested resource not found: {name}", "Table")
+        return self.tables[name]
+
+
+class FakeDynamoDBClient:
+    """Low-level client API over the fake tables, items in and out as attribute values."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def table(self, name):
+        return FakeDynamoDBResource(self.tables).Table(name)
+
+    @staticmethod
+    def decode(kwargs, *names):
+        for name in names:
+            if kwargs.get(name) is not None:
+                kwargs[name] = from_attribute_values(kwargs[name])
+        return kwargs
+
+    @staticmethod
+    def encode(response):
+        if "Item" in response:
+            response["Item"] = to_attribute_values(response["Item"])
+        if "Attributes" in response:
+            response["Attributes"] = to_attribute_values(response["Attributes"])
+        if "Items" in response:
+            response["Items"] = [to_attribute_values(item) for item in response["Items"]]
+        if "LastEvaluatedKey" in response:
+            response["LastEvaluatedKey"] = to_attribute_values(response["LastEvaluatedKey"])
+        return response
+
+    def put_item(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).put_item(
+            **self.decode(kwargs, "Item", "ExpressionAttributeValues")))
+
+    def get_item(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).get_item(**self.decode(kwargs, "Key")))
+
+    def delete_item(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).delete_item(
+            **self.decode(kwargs, "Key", "ExpressionAttributeValues")))
+
+    def update_item(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).update_item(
+            **self.decode(kwargs, "Key", "ExpressionAttributeValues")))
+
+    def scan(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).scan(**self.decode(kwargs, "ExclusiveStartKey")))
+
+    def query(self, TableName, **kwargs):
+        return self.encode(self.table(TableName).query(
+            **self.decode(kwargs, "ExclusiveStartKey", "ExpressionAttributeValues")))
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise client_error("ValidationException", "Too many items requested for the BatchWriteItem call", "BatchWriteItem")
+        for name, requests in RequestItems.items():
+            with self.table(name).batch_writer() as batch:
+                for request in requests:
+                    if "PutRequest" in request:
+                        batch.put_item(Item=from_attribute_values(request["PutRequest"]["Item"]))
+                    else:
+                        batch.delete_item(Key=from_attribute_values(request["DeleteRequest"]["Key"]))
+        return {"UnprocessedItems": {}}
+
+
+# SQS
+
+
+class FakeSQS:
+    def __init__(self, counter, on_message):
+        self.counter = counter
+        self.on_message = on_message
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.counter.record("sqs", "SendMessage")
+        message_id = str(uuid.uuid4())
+        self.on_message(QueueUrl, MessageBody, message_id)
+        return {"MessageId": message_id, "MD5OfMessageBody": hashlib.md5(MessageBody.encode()).hexdigest()}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self.counter.record("sqs", "SendMessageBatch")
+        if len(Entries) > 10:
+            raise client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "Too many entries", "SendMessageBatch")
+        successful = []
+        for entry in Entries:
+            message_id = str(uuid.uuid4())
+            self.on_message(QueueUrl, entry["MessageBody"], message_id)
+            successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+
+# EventBridge
+
+
+class FakeEventBridge:
+    def __init__(self, counter, on_event):
+        self.counter = counter
+        self.on_event = on_event
+
+    def put_events(self, Entries, **kwargs):
+        self.counter.record("events", "PutEvents")
+        if len(Entries) > 10:
+            raise client_error("ValidationException", "Too many entries", "PutEvents")
+        results = []
+        for entry in Entries:
+            event_id = str(uuid.uuid4())
+            self.on_event(entry, event_id)
+            results.append({"EventId": event_id})
+        return {"FailedEntryCount": 0, "Entries": results}
+
+
+# S3
+
+
+class FakeStreamingBody(io.BytesIO):
+    pass
+
+
+class FakeS3:
+    def __init__(self, counter):
+        self.counter = counter
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def read_body(body):
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+        return bytes(body)
+
+    def store(self, bucket, key, data):
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        with self.lock:
+            self.objects[(bucket, key)] = (data, etag)
+        return etag
+
+    def load(self, bucket, key, operation):
+        with self.lock:
+            if (bucket, key) not in self.objects:
+                raise client_error("NoSuchKey" if operation == "GetObject" else "404", "Not Found", operation)
+            return self.objects[(bucket, key)]
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        self.counter.record("s3", "PutObject")
+        return {"ETag": self.store(Bucket, Key, self.read_body(Body))}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self.counter.record("s3", "PutObject")
+        self.store(Bucket, Key, self.read_body(Fileobj))
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        self.counter.record("s3", "PutObject")
+        with open(Filename, "rb") as f:
+            self.store(Bucket, Key, f.read())
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.counter.record("s3", "GetObject")
+        data, etag = self.load(Bucket, Key, "GetObject")
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise client_error("304", "Not Modified", "GetObject")
+        return {"Body": FakeStreamingBody(data), "ETag": etag, "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.counter.record("s3", "HeadObject")
+        data, etag = self.load(Bucket, Key, "HeadObject")
+        return {"ETag": etag, "ContentLength": len(data)}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.counter.record("s3", "CopyObject")
+        data, _ = self.load(CopySource["Bucket"], CopySource["Key"], "CopyObject")
+        return {"CopyObjectResult": {"ETag": self.store(Bucket, Key, data)}}
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        self.counter.record("s3", "GetObject")
+        data, _ = self.load(Bucket, Key, "GetObject")
+        with open(Filename, "wb") as f:
+            f.write(data)
+
+
+# Bedrock
+
+
+class BedrockExceptions:
+    class ValidationException(ClientError):
+        pass
+
+    class ThrottlingException(ClientError):
+        pass
+
+
+class FakeBedrockRuntime:
+    """Bedrock runtime client that delegates converse calls to a scripted model."""
+
+    exceptions = BedrockExceptions
+
+    def __init__(self, counter, model):
+        self.counter = counter
+        self.model = model
+
+    def converse(self, **request):
+        self.counter.record("bedrock", "Converse")
+        return self.model.converse(request)
+
+    def converse_stream(self, **request):
+        self.counter.record("bedrock", "ConverseStream")
+        response = self.model.converse(request)
+        return {"stream": message_to_stream(response)}
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self.counter.record("bedrock", "InvokeModel")
+        self.model.invoke_model(modelId, json.loads(body))
+        payload = json.dumps({"images": [base64.b64encode(PLACEHOLDER_PNG).decode("ascii")]})
+        return {"body": FakeStreamingBody(payload.encode()), "contentType": "application/json"}
+
+
+def message_to_stream(response):
+    """Turns a converse response into the equivalent converse_stream events, tool input split in two chunks."""
+    message = response["output"]["message"]
+    events = [{"messageStart": {"role": message["role"]}}]
+    for index, block in enumerate(message["content"]):
+        if "text" in block:
+            events.append({"contentBlockDelta": {"contentBlockIndex": index, "delta": {"text": block["text"]}}})
+        elif "toolUse" in block:
+            tool_use = block["toolUse"]
+            events.append({"contentBlockStart": {"contentBlockIndex": index, "start": {
+                "toolUse": {"toolUseId": tool_use["toolUseId"], "name": tool_use["name"]}}}})
+            raw = json.dumps(tool_use["input"])
+            middle = len(raw) // 2
+            for chunk in (raw[:middle], raw[middle:]):
+                events.append({"contentBlockDelta": {"contentBlockIndex": index, "delta": {"toolUse": {"input": chunk}}}})
+        events.append({"contentBlockStop": {"contentBlockIndex": index}})
+    events.append({"messageStop": {"stopReason": response.get("stopReason", "end_turn")}})
+    events.append({"metadata": {"usage": response.get("usage", {}), "metrics": {"latencyMs": 0}}})
+    return events
+
+
+class FakeAWS:
+    """Holds every fake service and patches boto3 to hand them out."""
+
+    def __init__(self, model, tables, on_message, on_event):
+        self.counter = CallCounter()
+        self.tables = {
+            name: FakeTable(name, partition_key, sort_key, self.counter)
+            for name, (partition_key, sort_key) in tables.items()
+        }
+        self.dynamodb = FakeDynamoDBResource(self.tables)
+        self.dynamodb_client = FakeDynamoDBClient(self.tables)
+        self.sqs = FakeSQS(self.counter, on_message)
+        self.events = FakeEventBridge(self.counter, on_event)
+        self.s3 = FakeS3(self.counter)
+        self.bedrock = FakeBedrockRuntime(self.counter, model)
+        self.original = None
+
+    def client(self, service_name, *args, **kwargs):
+        clients = {
+            "sqs": self.sqs,
+            "events": self.events,
+            "s3": self.s3,
+            "bedrock-runtime": self.bedrock,
+            "dynamodb": self.dynamodb_client,
+        }
+        if service_name not in clients:
+            raise NotImplementedError(f"No local stand-in for {service_name}")
+        return clients[service_name]
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name != "dynamodb":
+            raise NotImplementedError(f"No local stand-in for {service_name} resource")
+        return self.dynamodb
+
+    def install(self):
+        self.original = (boto3.client, boto3.resource)
+        boto3.client = self.client
+        boto3.resource = self.resource
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+
+    def uninstall(self):
+        if self.original is not None:
+            boto3.client, boto3.resource = self.original
+            self.original = None
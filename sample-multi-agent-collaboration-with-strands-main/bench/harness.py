@@ -0,0 +1,526 @@
+"""Local end-to-end benchmark for the orchestration pipeline.
+
+Runs the real orchestrator handler and agent handlers against the in-memory
+AWS stand-ins in fake_aws.py. Bedrock converse calls replay a recording and
+the Strands agents are swapped for scripted agents that call the agent's own
+tools in the recorded order, so no network or AWS account is needed.
+
+    python bench/harness.py --orders 50 --concurrency 16 --model-latency-ms 800
+"""
+import argparse
+import asyncio
+import copy
+import inspect
+import io
+import itertools
+import json
+import os
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+import traceback
+import uuid
+import warnings
+from collections import Counter, defaultdict
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCH_DIR.parent / "src"
+sys.path.insert(0, str(BENCH_DIR))
+# deployed as a Lambda layer, see infra
+sys.path.insert(0, str(SRC_DIR / "shared"))
+sys.path.insert(0, str(SRC_DIR / "runtime"))
+
+from fake_aws import FakeAWS, client_error  # noqa: E402
+from kitchen import LAMBDAS, lambda_for_queue, load_lambda  # noqa: E402
+import tracing  # noqa: E402
+
+TABLES = {
+    "orchestration": ("orchestrationId", None),
+    "conversation": ("orchestrationId", "turn"),
+    "workflow-state": ("requestId", None),
+    "tool-config": ("toolId", None),
+    "response-cache": ("cacheKey", None),
+    "idempotency": ("idempotencyKey", None),
+    "capability": ("capabilityKey", None),
+    "bedrock-governor": ("bucketKey", None),
+}
+
+ENVIRONMENT = {
+    "ORCHESTRATION_TABLE": "orchestration",
+    "CONVERSATION_TABLE": "conversation",
+    "WORKFLOW_STATE_TABLE": "workflow-state",
+    "TOOL_CONFIG_TABLE": "tool-config",
+    "RESPONSE_CACHE_TABLE": "response-cache",
+    "IDEMPOTENCY_TABLE": "idempotency",
+    "CAPABILITY_TABLE": "capability",
+    "COMPLETION_BUS_NAME": "orchestration-bus",
+    "DELIVERY_BUCKET": "delivery-bucket",
+    "AGENT_BUCKET_NAME": "code-bucket",
+    "COMPLETION_PAYLOAD_BUCKET": "completion-payload-bucket",
+    "GENERIC_QUEUE_URL": "https://sqs.local/000000000000/generic-queue",
+    "BYPASS_TOOL_CONSENT": "true",
+    "ORCHESTRATOR_LARGE_MODEL": "large-model",
+    "ORCHESTRATOR_SMALL_MODEL": "small-model",
+    "BEDROCK_GOVERNOR": "dynamodb",
+    "BEDROCK_GOVERNOR_TABLE": "bedrock-governor",
+}
+
+MENU = ["cheeseburger", "bacon burger", "large fries", "small fries", "medium fries", "cola"]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class ScriptedModel:
+    """Replays the recorded orchestrator turns, picking the turn from the assistant messages already in the request.
+
+    Compaction collapses earlier stages in place without dropping messages, and
+    turns answered from the response cache carry toolUseIds this model never
+    handed out, so the turn is counted rather than looked up by id."""
+
+    def __init__(self, recording, model_latency, image_latency, small_model_latency=None, throttle_rate=0.0, seed=0):
+        self.turns = recording["orchestrator"]
+        self.model_latency = model_latency
+        self.small_model_latency = model_latency if small_model_latency is None else small_model_latency
+        self.image_latency = image_latency
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.round_trips = Counter()
+        self.orchestrator_models = Counter()
+        self.input_tokens = []
+
+    def maybe_throttle(self, operation):
+        with self.lock:
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.round_trips["throttled"] += 1
+        if throttled:
+            raise client_error("ThrottlingException", "Too many requests, please wait before trying again.", operation)
+
+    def converse(self, request):
+        self.maybe_throttle("Converse")
+        messages = request["messages"]
+        stage = sum(1 for message in messages if message["role"] == "assistant")
+        response = copy.deepcopy(self.turns[min(stage, len(self.turns) - 1)])
+        for block in response["output"]["message"]["content"]:
+            if "toolUse" in block:
+                block["toolUse"]["toolUseId"] = f"tooluse_{uuid.uuid4().hex[:22]}"
+        input_tokens = len(json.dumps(messages, default=str)) // 4
+        response.setdefault("usage", {}).setdefault("inputTokens", input_tokens)
+        small = request["modelId"] == ENVIRONMENT["ORCHESTRATOR_SMALL_MODEL"]
+        latency = self.small_model_latency if small else self.model_latency
+        response.setdefault("metrics", {"latencyMs": int(latency * 1000)})
+
+        time.sleep(latency)
+        with self.lock:
+            self.round_trips["orchestrator"] += 1
+            self.input_tokens.append(input_tokens)
+            self.orchestrator_models[request["modelId"]] += 1
+        return response
+
+    def invoke_model(self, model_id, body):
+        self.maybe_throttle("InvokeModel")
+        time.sleep(self.image_latency)
+        with self.lock:
+            self.round_trips["image"] += 1
+
+    def agent_round_trips(self, agent_name, count):
+        time.sleep(self.model_latency * count)
+        with self.lock:
+            self.round_trips[agent_name] += count
+
+
+def scripted_agent_class(agent_name, steps, model):
+    """Builds a stand-in for strands.Agent that runs the recorded tool calls for this agent."""
+
+    class ScriptedAgent:
+        def __init__(self, model=None, tools=None, system_prompt=None, **kwargs):
+            self.tools = {}
+            for tool in tools or []:
+                name = getattr(tool, "tool_name", None) or getattr(tool, "__name__", None)
+                self.tools[name] = tool
+
+        def __call__(self, prompt, **kwargs):
+            results = []
+            for step in steps:
+                # one model round trip per step, the calls in a step are issued together
+                with tracing.span("bedrock.converse_stream", model="scripted"):
+                    model.agent_round_trips(agent_name, 1)
+                for tool_name, tool_input in step:
+                    with tracing.span("tool", tool=tool_name):
+                        result = self.tools[tool_name](**tool_input)
+                        if inspect.isawaitable(result):
+                            result = asyncio.run(result)
+                    results.append(result)
+            with tracing.span("bedrock.converse_stream", model="scripted"):
+                model.agent_round_trips(agent_name, 1)
+            return "\n".join(str(result) for result in results)
+
+    return ScriptedAgent
+
+
+def order_id_of(message):
+    for block in message["content"]:
+        if "text" in block:
+            try:
+                return json.loads(block["text"]).get("orderId")
+            except (ValueError, AttributeError):
+                return None
+    return None
+
+
+class Pump:
+    """Stands in for SQS triggers and EventBridge rules, running each delivery on a worker thread.
+
+    Records reported in batchItemFailures, and events whose handler raised, are
+    delivered again after REDELIVERY_DELAY, up to MAX_DELIVERIES times in all,
+    as SQS and Lambda's async retries would."""
+
+    REDELIVERY_DELAY = 0.5
+    MAX_DELIVERIES = 3
+
+    def __init__(self, concurrency, queue_delay, duplicate_rate=0.0):
+        self.duplicate_rate = duplicate_rate
+        self.random = random.Random(0)
+        self.tasks = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.queue_delay = queue_delay
+        self.concurrency = concurrency
+        self.invocations = defaultdict(list)
+        self.errors = Counter()
+        self.first_errors = {}
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.stopped = threading.Event()
+
+    def submit(self, lambda_name, event, delay=None, delivery=1):
+        ready_at = time.perf_counter() + (self.queue_delay if delay is None else delay)
+        self.tasks.put((ready_at, next(self.counter), lambda_name, event, delivery))
+
+    def redeliver(self, lambda_name, event, delivery):
+        if delivery < self.MAX_DELIVERIES:
+            self.submit(lambda_name, event, self.REDELIVERY_DELAY, delivery + 1)
+
+    def deliver(self, lambda_name, event):
+        """Submits a delivery, sometimes twice to mimic at-least-once delivery."""
+        self.submit(lambda_name, event)
+        with self.lock:
+            duplicate = self.random.random() < self.duplicate_rate
+        if duplicate:
+            self.submit(lambda_name, copy.deepcopy(event))
+
+    def on_message(self, queue_url, body, message_id):
+        lambda_name = lambda_for_queue(queue_url)
+        self.deliver(lambda_name, {"Records": [{
+            "messageId": message_id,
+            "receiptHandle": message_id,
+            "body": body,
+            "eventSource": "aws:sqs",
+            "eventSourceARN": queue_url,
+        }]})
+
+    def on_event(self, entry, event_id):
+        self.deliver("orchestrator", {
+            "id": event_id,
+            "source": entry["Source"],
+            "detail-type": entry["DetailType"],
+            "detail": json.loads(entry["Detail"]),
+        })
+
+    def run_worker(self):
+        while not self.stopped.is_set():
+            try:
+                ready_at, _, lambda_name, event, delivery = self.tasks.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            wait = ready_at - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            try:
+                result = self.handlers[lambda_name](event, None)
+                failed = {failure["itemIdentifier"] for failure in (result or {}).get("batchItemFailures", [])}
+                if failed:
+                    key = f"{lambda_name}: batchItemFailures"
+                    with self.lock:
+                        self.errors[key] += len(failed)
+                        self.first_errors.setdefault(key, f"records {sorted(failed)} on delivery {delivery}")
+                    records = [record for record in event["Records"] if record["messageId"] in failed]
+                    self.redeliver(lambda_name, {**event, "Records": records}, delivery)
+            except Exception as e:
+                key = f"{lambda_name}: {type(e).__name__}"
+                with self.lock:
+                    self.errors[key] += 1
+                    self.first_errors.setdefault(key, traceback.format_exc())
+                self.redeliver(lambda_name, event, delivery)
+            finally:
+                with self.lock:
+                    self.invocations[lambda_name].append(time.perf_counter() - start)
+                self.tasks.task_done()
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.run_worker, daemon=True) for _ in range(self.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class Harness:
+    def __init__(self, recording, concurrency=16, model_latency=0.0, image_latency=0.0, queue_delay=0.0, streaming=False,
+                 response_cache="off", duplicate_rate=0.0, small_model_latency=None, routing=True, throttle_rate=0.0):
+        self.recording = recording
+        self.order_started = {}
+        self.order_finished = {}
+        self.done = threading.Condition()
+
+        os.environ.update(ENVIRONMENT)
+        os.environ["ORCHESTRATOR_STREAMING"] = "true" if streaming else "false"
+        os.environ["RESPONSE_CACHE"] = response_cache
+        os.environ["ORCHESTRATOR_ROUTING"] = "true" if routing else "false"
+        self.orders_by_orchestration = {}
+        self.model = ScriptedModel(recording, model_latency, image_latency, small_model_latency, throttle_rate)
+        self.pump = Pump(concurrency, queue_delay, duplicate_rate)
+        self.aws = FakeAWS(self.model, TABLES, self.pump.on_message, self.pump.on_event)
+        self.aws.tables[ENVIRONMENT["CONVERSATION_TABLE"]].listeners.append(self.on_conversation_write)
+        self.aws.install()
+        self.modules = {}
+        self.traces = tracing.LocalExporter()
+        tracing.set_exporter(self.traces)
+        self.load_lambdas()
+        self.seed_tools()
+
+    def load_lambdas(self):
+        # the Lambda modules print a lot, keep it out of the report
+        with redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for name, (directory, handler_name) in LAMBDAS.items():
+                module = load_lambda(name, directory)
+                if hasattr(module, "Agent"):
+                    steps = self.recording.get("agents", {}).get(name, [])
+                    module.Agent = scripted_agent_class(name, steps, self.model)
+                self.modules[name] = module
+                self.pump.handlers[name] = getattr(module, handler_name)
+
+    def seed_tools(self):
+        table = self.aws.dynamodb.Table(ENVIRONMENT["TOOL_CONFIG_TABLE"])
+        for tool in self.recording["tools"]:
+            table.put_item(Item={"toolId": tool["name"], "config": tool})
+        table.put_item(Item={"toolId": "__config_version__", "version": 1})
+
+    def on_conversation_write(self, item):
+        """Marks the order finished once an assistant turn without tool calls is saved."""
+        message = item["message"]
+        orchestration_id = item["orchestrationId"]
+        if item["turn"] == 0:
+            self.orders_by_orchestration[orchestration_id] = order_id_of(message)
+        elif message["role"] == "assistant" and not any("toolUse" in block for block in message["content"]):
+            self.on_order_complete(self.orders_by_orchestration.get(orchestration_id))
+
+    def on_order_complete(self, order_id):
+        with self.done:
+            if order_id in self.order_started and order_id not in self.order_finished:
+                self.order_finished[order_id] = time.perf_counter()
+                self.done.notify_all()
+
+    def place_order(self, order):
+        self.order_started[order["orderId"]] = time.perf_counter()
+        self.pump.submit("orchestrator", {
+            "source": "meal.request",
+            "detail-type": "Order-Placed",
+            "detail": order,
+        }, delay=0)
+
+    def run(self, orders, rate=0.0, timeout=600.0, verbose=False):
+        self.aws.counter.reset()
+        self.model.round_trips.clear()
+        self.model.orchestrator_models.clear()
+        output = sys.stdout if verbose else io.StringIO()
+        start = time.perf_counter()
+        with redirect_stdout(output):
+            self.pump.start()
+            try:
+                for index, order in enumerate(orders):
+                    self.place_order(order)
+                    if rate > 0 and index + 1 < len(orders):
+                        time.sleep(1 / rate)
+                with self.done:
+                    self.done.wait_for(lambda: len(self.order_finished) == len(orders), timeout=timeout)
+                # let trailing deliveries (front counter completion etc) drain
+                self.pump.tasks.join()
+            finally:
+                self.pump.stop()
+        elapsed = time.perf_counter() - start
+        return self.report(orders, elapsed)
+
+    def trace_report(self):
+        """Timeline of the slowest order and the latency histograms of every span name."""
+        slowest = max(self.order_finished, key=lambda o: self.order_finished[o] - self.order_started[o], default=None)
+        trace_id = self.traces.find_trace(order_id=slowest) if slowest is not None else None
+        timeline = self.traces.timeline(trace_id) if trace_id else "no completed order was traced"
+        return f"slowest order {slowest}\n{timeline}\n\nspan latency:\n{self.traces.histograms()}"
+
+    def report(self, orders, elapsed):
+        # reads its settings on import, after ENVIRONMENT is in place
+        import bedrock_governor
+        latencies = [
+            (self.order_finished[o["orderId"]] - self.order_started[o["orderId"]]) * 1000
+            for o in orders if o["orderId"] in self.order_finished
+        ]
+        count = len(orders)
+        counter = self.aws.counter
+        return {
+            "orders": count,
+            "completed": len(latencies),
+            "elapsed_s": round(elapsed, 3),
+            "orders_per_second": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "mean": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+            },
+            "per_order": {
+                "dynamodb_calls": round(counter.total("dynamodb") / count, 2),
+                "sqs_calls": round(counter.total("sqs") / count, 2),
+                "eventbridge_calls": round(counter.total("events") / count, 2),
+                "s3_calls": round(counter.total("s3") / count, 2),
+                "model_round_trips": round(sum(
+                    n for name, n in self.model.round_trips.items() if name not in ("image", "throttled")) / count, 2),
+                "orchestrator_round_trips": round(self.model.round_trips["orchestrator"] / count, 2),
+            },
+            "orchestrator_input_tokens": {
+                "mean": round(statistics.fmean(self.model.input_tokens), 1) if self.model.input_tokens else 0.0,
+                "max": max(self.model.input_tokens, default=0),
+            },
+            "calls": {
+                service: counter.by_operation(service)
+                for service in ("dynamodb", "sqs", "events", "s3", "bedrock")
+            },
+            "model_round_trips": dict(self.model.round_trips),
+            "orchestrator_models": dict(self.model.orchestrator_models),
+            "governor": bedrock_governor.governor_stats(),
+            "lambda_latency_ms": {
+                name: {
+                    "invocations": len(durations),
+                    "p50": round(percentile(durations, 50) * 1000, 2),
+                    "p95": round(percentile(durations, 95) * 1000, 2),
+                }
+                for name, durations in self.pump.invocations.items()
+            },
+            "errors": dict(self.pump.errors),
+        }
+
+
+def synthetic_orders(count, seed=0):
+    """Orders shaped like test-event.json's detail."""
+    generator = random.Random(seed)
+    return [{
+        "orderId": str(10000 + index),
+        "customerId": f"C-{generator.randint(1000, 9999)}",
+        "items": generator.sample(MENU, generator.randint(1, 3)),
+    } for index in range(count)]
+
+
+def print_report(report, first_errors):
+    latency = report["latency_ms"]
+    per_order = report["per_order"]
+    print(f"orders: {report['completed']}/{report['orders']} completed in {report['elapsed_s']}s "
+          f"({report['orders_per_second']} orders/s)")
+    print(f"end-to-end latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  mean {latency['mean']}")
+    print("per order: " + "  ".join(f"{key} {value}" for key, value in per_order.items()))
+    print("orchestrator turns by model: " + "  ".join(
+        f"{model} {n}" for model, n in sorted(report["orchestrator_models"].items())))
+    tokens = report["orchestrator_input_tokens"]
+    print(f"orchestrator input tokens per turn: mean {tokens['mean']}  max {tokens['max']}")
+    if report["governor"]:
+        print("bedrock governor:")
+        for model_id, stats in sorted(report["governor"].items()):
+            print(f"  {model_id:<22} " + "  ".join(
+                f"{key} {round(value, 2) if isinstance(value, float) else value}" for key, value in stats.items()))
+    print("lambda latency ms:")
+    for name, stats in sorted(report["lambda_latency_ms"].items()):
+        print(f"  {name:<22} n={stats['invocations']:<6} p50 {stats['p50']:<10} p95 {stats['p95']}")
+    print("calls:")
+    for service, operations in report["calls"].items():
+        if operations:
+            print(f"  {service:<9} " + "  ".join(f"{op} {n}" for op, n in sorted(operations.items())))
+    if report["errors"]:
+        print("errors:")
+        for key, count in report["errors"].items():
+            print(f"  {key} x{count}")
+            print("    " + first_errors[key].strip().replace("\n", "\n    "))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", default=str(BENCH_DIR / "recordings" / "default.json"))
+    parser.add_argument("--orders", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads, i.e. concurrent Lambda invocations")
+    parser.add_argument("--rate", type=float, default=0.0, help="orders placed per second, 0 places them all at once")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="simulated latency of each model round trip")
+    parser.add_argument("--small-model-latency-ms", type=float, default=None,
+                        help="simulated latency of an orchestrator turn routed to the small model, "
+                             "defaults to --model-latency-ms")
+    parser.add_argument("--no-routing", action="store_true", help="run every orchestrator turn on the large model")
+    parser.add_argument("--image-latency-ms", type=float, default=0.0, help="simulated latency of each Nova Canvas call")
+    parser.add_argument("--queue-delay-ms", type=float, default=0.0, help="simulated SQS/EventBridge delivery delay")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="share of SQS messages and events delivered twice")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of Bedrock calls answered with a ThrottlingException")
+    parser.add_argument("--streaming", action="store_true", help="run the orchestrator with ORCHESTRATOR_STREAMING=true")
+    parser.add_argument("--response-cache", choices=["off", "local", "dynamodb"], default="off",
+                        help="RESPONSE_CACHE mode for the orchestrator")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the Lambda output")
+    parser.add_argument("--trace", action="store_true",
+                        help="print the slowest order's trace timeline and the span latency histograms")
+    args = parser.parse_args(argv)
+
+    with open(args.recording) as f:
+        recording = json.load(f)
+
+    harness = Harness(
+        recording,
+        concurrency=args.concurrency,
+        model_latency=args.model_latency_ms / 1000,
+        image_latency=args.image_latency_ms / 1000,
+        queue_delay=args.queue_delay_ms / 1000,
+        streaming=args.streaming,
+        response_cache=args.response_cache,
+        duplicate_rate=args.duplicate_rate,
+        small_model_latency=None if args.small_model_latency_ms is None else args.small_model_latency_ms / 1000,
+        routing=not args.no_routing,
+        throttle_rate=args.throttle_rate,
+    )
+    report = harness.run(synthetic_orders(args.orders, args.seed), rate=args.rate,
+                         timeout=args.timeout, verbose=args.verbose)
+    print_report(report, harness.pump.first_errors)
+    if args.trace:
+        print()
+        print(harness.trace_report())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["completed"] == report["orders"] and not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
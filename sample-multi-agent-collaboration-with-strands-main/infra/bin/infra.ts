@@ -7,5 +7,9 @@ const app = new cdk.App();
 
 const orchestratorStack = new OrchestratorStack(app, 'OrchestratorStack');
 new AgentResourcesStack(app, "AgentsStack", {
-  completionEventBus: orchestratorStack.orchestrationEventBus
+  completionEventBus: orchestratorStack.orchestrationEventBus,
+  sharedLayer: orchestratorStack.sharedLayer,
+  idempotencyTable: orchestratorStack.idempotencyTable,
+  bedrockGovernorTable: orchestratorStack.bedrockGovernorTable,
+  completionPayloadBucket: orchestratorStack.completionPayloadBucket,
 })
\ No newline at end of file
@@ -2,16 +2,20 @@ import { Duration, RemovalPolicy, Stack, StackProps } from 'aws-cdk-lib';
 import * as sqs from 'aws-cdk-lib/aws-sqs';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import { Construct } from 'constructs';
-import { Table } from 'aws-cdk-lib/aws-dynamodb';
+import { ITable } from 'aws-cdk-lib/aws-dynamodb';
 import { EventBus } from 'aws-cdk-lib/aws-events';
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
 import { PolicyStatement, Effect } from 'aws-cdk-lib/aws-iam';
 import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
 import path = require('path');
-import { BlockPublicAccess, Bucket } from 'aws-cdk-lib/aws-s3';
+import { BlockPublicAccess, Bucket, IBucket } from 'aws-cdk-lib/aws-s3';
 
 interface AgentResourcesStackProps extends StackProps {
   readonly completionEventBus: EventBus;
+  readonly sharedLayer: PythonLayerVersion;
+  readonly idempotencyTable: ITable;
+  readonly bedrockGovernorTable: ITable;
+  readonly completionPayloadBucket: IBucket;
 }
 
 export class AgentResourcesStack extends Stack {
@@ -37,15 +41,23 @@ export class AgentResourcesStack extends Stack {
       });
       this.queues.push(queue);
 
+      const timeout = Duration.minutes(15);
       const func = new PythonFunction(this, `${agentName}Function`, {
         runtime: lambda.Runtime.PYTHON_3_11,
         entry: path.join(__dirname, `../../src/agents/${agentName}`),
+        layers: [props.sharedLayer],
         handler: 'handler',
         memorySize: 1024,
-        timeout: Duration.minutes(15),
+        timeout,
         environment: {
           COMPLETION_BUS_NAME: props.completionEventBus.eventBusName,
+          COMPLETION_PAYLOAD_BUCKET: props.completionPayloadBucket.bucketName,
           DELIVERY_BUCKET: delivery_bucket.bucketName,
+          IDEMPOTENCY_TABLE: props.idempotencyTable.tableName,
+          // claims block duplicates a little longer than the invocation holding them can run
+          IDEMPOTENCY_IN_PROGRESS_TIMEOUT: String(timeout.toSeconds() + 10),
+          BEDROCK_GOVERNOR: 'dynamodb',
+          BEDROCK_GOVERNOR_TABLE: props.bedrockGovernorTable.tableName,
         },
         initialPolicy: [
           new PolicyStatement({
@@ -56,8 +68,12 @@ export class AgentResourcesStack extends Stack {
         ],
       });
       props.completionEventBus.grantPutEventsTo(func);
-      func.addEventSource(new SqsEventSource(queue));
+      props.completionPayloadBucket.grantPut(func);
+      func.addEventSource(new SqsEventSource(queue, { reportBatchItemFailures: true }));
       delivery_bucket.grantReadWrite(func);
+      props.idempotencyTable.grantReadWriteData(func);
+      props.bedrockGovernorTable.grantReadWriteData(func);
+      this.functions.push(func);
     });
   }
 }
@@ -2,8 +2,8 @@ import * as cdk from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
-import { PolicyStatement, Effect } from 'aws-cdk-lib/aws-iam';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
+import { PolicyStatement, Effect, IRole } from 'aws-cdk-lib/aws-iam';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as events from 'aws-cdk-lib/aws-events';
 import path = require('path');
@@ -15,6 +15,11 @@ import { BlockPublicAccess, Bucket } from 'aws-cdk-lib/aws-s3';
 export class OrchestratorStack extends cdk.Stack {
   public readonly orchestrationTable: dynamodb.Table;
   public readonly orchestrationEventBus: cdk.aws_events.EventBus;
+  public readonly sharedLayer: PythonLayerVersion;
+  public readonly idempotencyTable: dynamodb.Table;
+  public readonly bedrockGovernorTable: dynamodb.Table;
+  public readonly completionPayloadBucket: Bucket;
+  public readonly orchestratorRole: IRole;
   constructor(scope: Construct, id: string, props?: cdk.StackProps) {
     super(scope, id, props);
 
@@ -24,11 +29,25 @@ export class OrchestratorStack extends cdk.Stack {
       blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
     });
 
+    // Completion details too large for an EventBridge event, see src/shared/completion.py
+    this.completionPayloadBucket = new Bucket(this, 'CompletionPayloadBucket', {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      blockPublicAccess: BlockPublicAccess.BLOCK_ALL,
+      lifecycleRules: [{ expiration: cdk.Duration.days(7) }],
+    });
+
     this.orchestrationTable = new dynamodb.Table(this, 'OrchestrationTable', {
       partitionKey: { name: 'orchestrationId', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
     });
 
+    const conversationTable = new dynamodb.Table(this, 'ConversationTable', {
+      partitionKey: { name: 'orchestrationId', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'turn', type: dynamodb.AttributeType.NUMBER },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+    });
+
     const workflowStateTable = new dynamodb.Table(this, 'WorkflowStateTable', {
       partitionKey: { name: 'requestId', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
@@ -39,26 +58,71 @@ export class OrchestratorStack extends cdk.Stack {
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
     });
 
+    // Capabilities the fabricator has built or is building, see fabricator/capability_registry.py.
+    // No TTL, an expired fabrication lock still holds the waiters its takeover has to answer.
+    const capabilityTable = new dynamodb.Table(this, 'CapabilityTable', {
+      partitionKey: { name: 'capabilityKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+    });
+
+    this.idempotencyTable = new dynamodb.Table(this, 'IdempotencyTable', {
+      partitionKey: { name: 'idempotencyKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+    });
+
+    // Bedrock request and token counters shared by every function, see src/shared/bedrock_governor.py
+    this.bedrockGovernorTable = new dynamodb.Table(this, 'BedrockGovernorTable', {
+      partitionKey: { name: 'bucketKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+    });
+
+    // Modules shared by every function, see src/shared
+    this.sharedLayer = new PythonLayerVersion(this, 'SharedLayer', {
+      entry: path.join(__dirname, '../../src/shared'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_11],
+    });
+
+    // Only used when the orchestrator runs with RESPONSE_CACHE=dynamodb
+    const responseCacheTable = new dynamodb.Table(this, 'ResponseCacheTable', {
+      partitionKey: { name: 'cacheKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: 'expiresAt',
+    });
+
     this.orchestrationEventBus = new cdk.aws_events.EventBus(this, 'OrchestrationEventBus', {
       eventBusName: 'orchestration-bus',
     });
 
+    // Idempotency claims block duplicates a little longer than the invocation holding them can run
+    const inProgressTimeout = (timeout: cdk.Duration) => String(timeout.toSeconds() + 10);
+
+    const orchestratorTimeout = cdk.Duration.seconds(30);
     const orchestrationLambda = new PythonFunction(this, 'OrchestrationAgent', {
       runtime: lambda.Runtime.PYTHON_3_11,
       entry: path.join(__dirname, '../../src/orchestrator'),
+      layers: [this.sharedLayer],
       handler: 'handler',
-      timeout: cdk.Duration.seconds(30),
+      timeout: orchestratorTimeout,
       memorySize: 1024,
       environment: {
+        IDEMPOTENCY_TABLE: this.idempotencyTable.tableName,
+        IDEMPOTENCY_IN_PROGRESS_TIMEOUT: inProgressTimeout(orchestratorTimeout),
         ORCHESTRATION_TABLE: this.orchestrationTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
         COMPLETION_BUS_NAME: this.orchestrationEventBus.eventBusName,
+        COMPLETION_PAYLOAD_BUCKET: this.completionPayloadBucket.bucketName,
         WORKFLOW_STATE_TABLE: workflowStateTable.tableName,
         TOOL_CONFIG_TABLE: toolConfigTable.tableName,
+        RESPONSE_CACHE_TABLE: responseCacheTable.tableName,
+        BEDROCK_GOVERNOR: 'dynamodb',
+        BEDROCK_GOVERNOR_TABLE: this.bedrockGovernorTable.tableName,
       },
       initialPolicy: [
         new PolicyStatement({
           effect: Effect.ALLOW,
-          actions: ['bedrock:InvokeModel'],
+          actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
           resources: ['*'],
         }),
         // Crazy high permissions. Might need to split the stacks for specific permission, or maybe some sort of sqs name/domain scoping
@@ -70,10 +134,18 @@ export class OrchestratorStack extends cdk.Stack {
       ],
     });
 
+    // functions used as lambda tool actions grant invoke to this role, see src/orchestrator/tool_actions.py
+    this.orchestratorRole = orchestrationLambda.role!;
     this.orchestrationTable.grantReadWriteData(orchestrationLambda);
+    conversationTable.grantReadWriteData(orchestrationLambda);
+    responseCacheTable.grantReadWriteData(orchestrationLambda);
+    this.idempotencyTable.grantReadWriteData(orchestrationLambda);
     this.orchestrationEventBus.grantPutEventsTo(orchestrationLambda);
+    // past MAX_INLINE_TURNS it publishes synchronous results as completions, large ones through the bucket
+    this.completionPayloadBucket.grantReadWrite(orchestrationLambda);
     workflowStateTable.grantReadWriteData(orchestrationLambda);
     toolConfigTable.grantReadData(orchestrationLambda);
+    this.bedrockGovernorTable.grantReadWriteData(orchestrationLambda);
 
     const genericQueue = new Queue(this, `genericQueue`, {
       queueName: 'generic-queue',
@@ -84,12 +156,17 @@ export class OrchestratorStack extends cdk.Stack {
     const genericLambda = new PythonFunction(this, 'GenericAgentWrapper', {
       runtime: lambda.Runtime.PYTHON_3_11,
       entry: path.join(__dirname, '../../src/generic-agent-wrapper'),
+      layers: [this.sharedLayer],
       handler: 'lambda_handler',
       timeout: cdk.Duration.minutes(15),
       memorySize: 1024,
       environment: {
+        IDEMPOTENCY_TABLE: this.idempotencyTable.tableName,
+        IDEMPOTENCY_IN_PROGRESS_TIMEOUT: inProgressTimeout(cdk.Duration.minutes(15)),
         COMPLETION_BUS_NAME: this.orchestrationEventBus.eventBusName,
+        COMPLETION_PAYLOAD_BUCKET: this.completionPayloadBucket.bucketName,
         TOOL_CONFIG_TABLE: toolConfigTable.tableName,
+        CAPABILITY_TABLE: capabilityTable.tableName,
         AGENT_BUCKET_NAME: code_bucket.bucketName,
       },
       initialPolicy: [
@@ -102,10 +179,12 @@ export class OrchestratorStack extends cdk.Stack {
     });
 
     this.orchestrationEventBus.grantPutEventsTo(genericLambda);
+    this.completionPayloadBucket.grantPut(genericLambda);
     toolConfigTable.grantReadData(genericLambda);
     code_bucket.grantRead(genericLambda);
+    this.idempotencyTable.grantReadWriteData(genericLambda);
 
-    genericLambda.addEventSource(new SqsEventSource(genericQueue));
+    genericLambda.addEventSource(new SqsEventSource(genericQueue, { reportBatchItemFailures: true }));
 
     const fabricatorQueue = new Queue(this, `fabricatorQueue`, {
       queueName: 'fabricator-queue',
@@ -116,15 +195,22 @@ export class OrchestratorStack extends cdk.Stack {
     const fabricatorLambda = new PythonFunction(this, 'FabricatorAgent', {
       runtime: lambda.Runtime.PYTHON_3_11,
       entry: path.join(__dirname, '../../src/fabricator'),
+      layers: [this.sharedLayer],
       handler: 'lambda_handler',
       timeout: cdk.Duration.minutes(15),
       memorySize: 1024,
       environment: {
+        IDEMPOTENCY_TABLE: this.idempotencyTable.tableName,
+        IDEMPOTENCY_IN_PROGRESS_TIMEOUT: inProgressTimeout(cdk.Duration.minutes(15)),
         COMPLETION_BUS_NAME: this.orchestrationEventBus.eventBusName,
+        COMPLETION_PAYLOAD_BUCKET: this.completionPayloadBucket.bucketName,
         WORKFLOW_STATE_TABLE: workflowStateTable.tableName,
         TOOL_CONFIG_TABLE: toolConfigTable.tableName,
+        CAPABILITY_TABLE: capabilityTable.tableName,
         AGENT_BUCKET_NAME: code_bucket.bucketName,
         GENERIC_QUEUE_URL: genericQueue.queueUrl,
+        BEDROCK_GOVERNOR: 'dynamodb',
+        BEDROCK_GOVERNOR_TABLE: this.bedrockGovernorTable.tableName,
       },
       initialPolicy: [
         new PolicyStatement({
@@ -136,11 +222,15 @@ export class OrchestratorStack extends cdk.Stack {
     });
 
     this.orchestrationEventBus.grantPutEventsTo(fabricatorLambda);
+    this.completionPayloadBucket.grantPut(fabricatorLambda);
     workflowStateTable.grantReadWriteData(fabricatorLambda);
     toolConfigTable.grantReadWriteData(fabricatorLambda);
+    capabilityTable.grantReadWriteData(fabricatorLambda);
+    this.bedrockGovernorTable.grantReadWriteData(fabricatorLambda);
     code_bucket.grantReadWrite(fabricatorLambda);
+    this.idempotencyTable.grantReadWriteData(fabricatorLambda);
 
-    fabricatorLambda.addEventSource(new SqsEventSource(fabricatorQueue));
+    fabricatorLambda.addEventSource(new SqsEventSource(fabricatorQueue, { reportBatchItemFailures: true }));
 
     const mealRequestRule = new events.Rule(this, 'MealRequestRule', {
       eventBus: this.orchestrationEventBus,
@@ -1,14 +1,22 @@
-import json
-import os
-import boto3
-from strands import Agent, tool, models
-
-
-bedrock_model = models.BedrockModel(
+import re
+from bootstrap import lazy, record_init, timed
+from botocore.config import Config
+from bedrock_governor import govern, GOVERNED_RETRIES, NORMAL
+with timed("strands"):
+    from strands import Agent, tool, models
+from idempotency import run_once, message_key
+from record_processor import process_records
+from completion import publish_completion
+from agent_pool import AgentPool, current_request, request_context
+from recipe_engine import Recipe, Step, run_recipe
+
+
+bedrock_model = lazy("bedrock_model", lambda: govern(models.BedrockModel(
     model="anthropic.claude-3-5-sonnet-20241022-v2:0",
     max_tokens=40000,
-    region_name="us-west-2"
-)
+    region_name="us-west-2",
+    boto_client_config=Config(retries=GOVERNED_RETRIES),
+), NORMAL))
 
 
 @tool
@@ -46,60 +54,127 @@ def assemble_burger(ingredients):
     return "burger: " + ", ".join(ingredients)
 
 
+@tool
+def deliver_meal(meal_contents):
+    request = current_request()
+    event_id = publish_completion(request["orchestration_id"], request["tool_use_id"], request["node"],
+                                  f"Burger cooking completed, delivered: {meal_contents}")
+    print(f"event posted: {event_id}")
+    return f"event posted: {event_id}"
+
+
+# Burgers cooked without the model, any order these don't cover goes to the agent
+INGREDIENT_TOOLS = {
+    "bun": get_burger_bun,
+    "patty": get_beef_patty,
+    "cheese": get_cheese,
+    "bacon": get_bacon,
+    "lettuce": get_lettuce,
+    "tomato": get_tomato,
+}
+INGREDIENT_WORDS = {
+    "bun": "bun", "buns": "bun", "patty": "patty", "beef": "patty",
+    "cheese": "cheese", "bacon": "bacon", "lettuce": "lettuce",
+    "tomato": "tomato", "tomatoes": "tomato",
+}
+BURGERS = {
+    "burger": ["bun", "patty"],
+    "hamburger": ["bun", "patty"],
+    "beef burger": ["bun", "patty"],
+    "cheeseburger": ["bun", "patty", "cheese"],
+    "cheese burger": ["bun", "patty", "cheese"],
+    "bacon burger": ["bun", "patty", "bacon"],
+    "bacon cheeseburger": ["bun", "patty", "cheese", "bacon"],
+}
+BURGER_ORDER = re.compile(
+    r"^(?:(?:a|an|one|1|single)\s+)?(?P<base>.+?)"
+    r"(?:\s+(?:with|plus|add)\s+(?P<add>.+?))?"
+    r"(?:\s+(?:no|without|hold the)\s+(?P<remove>.+))?$")
+
+
+def parse_ingredients(text):
+    ingredients = []
+    for word in re.split(r"\s+|\band\b", text):
+        if not word or word in ("and", "extra"):
+            continue
+        if word not in INGREDIENT_WORDS:
+            return None
+        ingredients.append(INGREDIENT_WORDS[word])
+    return ingredients
+
+
+def match_burger(burger_order):
+    """Returns the ingredients for an order like "cheeseburger with lettuce, no cheese", None if it is not a known burger."""
+    text = " ".join(re.sub(r"[^a-z0-9]+", " ", str(burger_order).lower()).split())
+    match = BURGER_ORDER.match(text)
+    if match is None or match.group("base") not in BURGERS:
+        return None
+    ingredients = list(BURGERS[match.group("base")])
+    for group, include in (("add", True), ("remove", False)):
+        if match.group(group) is None:
+            continue
+        changes = parse_ingredients(match.group(group))
+        if changes is None:
+            return None
+        for ingredient in changes:
+            if include and ingredient not in ingredients:
+                ingredients.append(ingredient)
+            elif not include and ingredient in ingredients:
+                ingredients.remove(ingredient)
+    return ingredients
+
+
+def burger_recipe(ingredients):
+    """Fetches every ingredient at once, then assembles and delivers the burger."""
+    fetches = [Step(f"get_{ingredient}", INGREDIENT_TOOLS[ingredient]) for ingredient in ingredients]
+    names = [step.name for step in fetches]
+    return Recipe("burger", fetches + [
+        Step("assemble_burger", assemble_burger, after=names,
+             args=lambda results: {"ingredients": [results[name] for name in names]}),
+        Step("deliver_meal", deliver_meal, after=["assemble_burger"],
+             args=lambda results: {"meal_contents": results["assemble_burger"]}),
+    ])
+
+
+# built once per container, the order is passed in through current_request()
+agents = AgentPool(lambda: Agent(
+    model=bedrock_model(),
+    tools=[
+        get_lettuce, get_tomato, get_bacon, get_cheese,
+        get_beef_patty, get_burger_bun,
+        assemble_burger, deliver_meal]
+))
+
+
 def process_event(event):
-    orchestration_id = event["orchestration_id"]
-    tool_use_id = event["tool_use_id"]
     request = event["tool_input"]
-    tool_name = event['node']
-
-    # since this needs variable injection, keep within handler method scope.
-    @tool
-    def deliver_meal(meal_contents):
-        client = boto3.client('events')
-        COMPLETION_BUS_NAME = os.environ.get('COMPLETION_BUS_NAME')
-        event = {
-            'Source': 'task.completion',
-            'DetailType': 'task.completion',
-            'EventBusName': COMPLETION_BUS_NAME,
-            'Detail': json.dumps({
-                'orchestration_id': orchestration_id,
-                'data': f"Burger cooking completed, delivered: {meal_contents}",
-                'tool_use_id': tool_use_id,
-                'node': tool_name
-            })
-        }
-
-        response = client.put_events(
-            Entries=[
-                event
-            ]
-        )
-        print(f"event posted: {response}")
-        return f"event posted: {event}"
-
-
-    agent = Agent(
-        model=bedrock_model,
-        tools=[
-            get_lettuce, get_tomato, get_bacon, get_cheese,
-            get_beef_patty, get_burger_bun,
-            assemble_burger, deliver_meal]
-    )
+
+    ingredients = match_burger(request.get("burgerOrder", ""))
+    if ingredients is not None:
+        print(f"cooking {request} from the recipe: {ingredients}")
+        with request_context(event):
+            run_recipe(burger_recipe(ingredients))
+        return
+    print(f"no recipe for {request}, handing it to the agent")
 
     instruction = f"""You are a burger cook. You call the tools aligned to the ingredients in the burger recipe to provision the ingredients.
     Finally you compile the burger with the ingredients together.
 
     The current order is: {request}
     """
-    agent(instruction)
+    agents.run(event, instruction)
+
+
+def handle_message(message_body):
+    run_once(message_key("burger-cook", message_body), process_event, message_body)
 
 
 def handler(event, context):
     print(f"processing event {event}")
-    for record in event['Records']:
-        message_body = json.loads(record['body'])
-        process_event(message_body)
+    return process_records(event, context, handle_message)
+
 
+record_init("burger-cook")
 
 if __name__ == "__main__":
     # Grab a record from your lambda and invoke, configuration will vary drastically
@@ -0,0 +1,136 @@
+"""Generates the meal image and delivers it next to the order.
+
+Nova Canvas is called with a fixed seed, so the same description and
+generation config always give the same image. Images are stored once under
+IMAGE_CACHE_PREFIX in the delivery bucket, keyed by a hash of the model,
+description and config, and each delivery is a server side copy of the cached
+object. A repeated meal costs a copy_object instead of a Canvas call.
+
+Generated images are decoded in memory and uploaded from a buffer, nothing is
+written to /tmp. Concurrent deliveries of the same image in one container
+share a single generation.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from botocore.exceptions import ClientError
+from bootstrap import client, lazy
+from bedrock_governor import GovernedClient, GOVERNED_RETRIES, LOW
+
+IMAGE_MODEL_ID = 'amazon.nova-canvas-v1:0'
+IMAGE_GENERATION_CONFIG = {
+    "numberOfImages": 1,
+    "height": 1024,
+    "width": 1024,
+    "cfgScale": 8.0,
+    "seed": 0
+}
+IMAGE_CACHE_PREFIX = os.environ.get('IMAGE_CACHE_PREFIX', 'image-cache/')
+# How many cached image keys a container remembers as present in S3
+IMAGE_CACHE_MAX_KEYS = int(os.environ.get('IMAGE_CACHE_MAX_KEYS', '256'))
+
+image_stats = {"generated": 0, "cache_hits": 0}
+
+
+def create_image_client():
+    from botocore.config import Config
+    # the image is the first thing to go when Bedrock is busy, see deliver_meal_to_customer
+    return GovernedClient(client(
+        service_name='bedrock-runtime',
+        config=Config(read_timeout=300, retries=GOVERNED_RETRIES),
+        region_name="us-east-1"
+    ), LOW)
+
+
+image_bedrock = lazy("image_bedrock", create_image_client)
+
+
+def image_cache_key(image_generation_description):
+    request = {"model": IMAGE_MODEL_ID, "text": image_generation_description, "config": IMAGE_GENERATION_CONFIG}
+    digest = hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{IMAGE_CACHE_PREFIX}{digest}.png"
+
+
+def generate_image(image_generation_description) -> bytes:
+    body = json.dumps({
+        "taskType": "TEXT_IMAGE",
+        "textToImageParams": {
+            "text": image_generation_description
+        },
+        "imageGenerationConfig": IMAGE_GENERATION_CONFIG
+    })
+    response = image_bedrock().invoke_model(
+        body=body, modelId=IMAGE_MODEL_ID, accept="application/json", contentType="application/json"
+    )
+    response_body = json.loads(response.get("body").read())
+    image_stats["generated"] += 1
+    return base64.b64decode(response_body.get("images")[0])
+
+
+def is_missing(error: ClientError) -> bool:
+    return error.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound')
+
+
+class ImageCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.known = OrderedDict()
+        self.in_flight = {}
+
+    def remember(self, cache_key):
+        with self.lock:
+            self.known[cache_key] = True
+            self.known.move_to_end(cache_key)
+            while len(self.known) > IMAGE_CACHE_MAX_KEYS:
+                self.known.popitem(last=False)
+
+    def fill(self, bucket, cache_key, image_generation_description):
+        s3 = client('s3')
+        try:
+            s3.head_object(Bucket=bucket, Key=cache_key)
+            image_stats["cache_hits"] += 1
+        except ClientError as e:
+            if not is_missing(e):
+                raise
+            image = generate_image(image_generation_description)
+            s3.upload_fileobj(io.BytesIO(image), bucket, cache_key, ExtraArgs={'ContentType': 'image/png'})
+        self.remember(cache_key)
+
+    def ensure(self, bucket, image_generation_description) -> str:
+        """Returns the cache key of the image, generating it only if no one has yet."""
+        cache_key = image_cache_key(image_generation_description)
+        with self.lock:
+            if cache_key in self.known:
+                self.known.move_to_end(cache_key)
+                image_stats["cache_hits"] += 1
+                return cache_key
+            future = self.in_flight.get(cache_key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[cache_key] = Future()
+
+        if leader:
+            try:
+                self.fill(bucket, cache_key, image_generation_description)
+                future.set_result(cache_key)
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.in_flight[cache_key]
+        return future.result()
+
+
+image_cache = ImageCache()
+
+
+def deliver_image(image_generation_description, bucket, key):
+    """Puts the image for the description at key, copying it from the cache when it was made before."""
+    cache_key = image_cache.ensure(bucket, image_generation_description)
+    client('s3').copy_object(Bucket=bucket, Key=key, CopySource={'Bucket': bucket, 'Key': cache_key})
+    print(f"image for {key} from {cache_key}: {image_stats}")
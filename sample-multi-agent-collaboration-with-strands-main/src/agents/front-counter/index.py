@@ -1,114 +1,69 @@
-import base64
 import json
 import os
-import boto3
-from strands import Agent, tool, models
-import time
+from concurrent.futures import ThreadPoolExecutor
+from bootstrap import client, lazy, record_init, timed
 from botocore.config import Config
-
-bedrock_model = models.BedrockModel(
+from bedrock_governor import govern, GOVERNED_RETRIES, NORMAL, ShedError
+with timed("strands"):
+    from strands import Agent, tool, models
+from idempotency import run_once, message_key
+from record_processor import process_records
+from completion import publish_completion
+from agent_pool import AgentPool, current_request
+from image_pipeline import deliver_image
+
+bedrock_model = lazy("bedrock_model", lambda: govern(models.BedrockModel(
     model="anthropic.claude-3-5-sonnet-20241022-v2:0",
     max_tokens=40000,
-    region_name="us-west-2"
-)
+    region_name="us-west-2",
+    boto_client_config=Config(retries=GOVERNED_RETRIES),
+), NORMAL))
 
 DELIVERY_BUCKET = os.environ.get("DELIVERY_BUCKET", None)
 
 
-def generate_image(image_generation_description):
-    model_id = 'amazon.nova-canvas-v1:0'
-
-    body = json.dumps({
-        "taskType": "TEXT_IMAGE",
-        "textToImageParams": {
-            "text": image_generation_description
-        },
-        "imageGenerationConfig": {
-            "numberOfImages": 1,
-            "height": 1024,
-            "width": 1024,
-            "cfgScale": 8.0,
-            "seed": 0
-        }
-    })
-
-    bedrock = boto3.client(
-        service_name='bedrock-runtime',
-        config=Config(read_timeout=300),
-        region_name="us-east-1"
-    )
-
-    accept = "application/json"
-    content_type = "application/json"
-
-    response = bedrock.invoke_model(
-        body=body, modelId=model_id, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response.get("body").read())
+# uploads the order while the image is generated
+uploads = ThreadPoolExecutor(max_workers=4)
 
-    base64_image = response_body.get("images")[0]
-    base64_bytes = base64_image.encode('ascii')
-    image_bytes = base64.b64decode(base64_bytes)
-    # save image to /tmp/
-    filename = '/tmp/txt_to_img.png'
-    with open(filename, 'wb') as f:
-        f.write(image_bytes)
-    return filename
 
 @tool
 def deliver_meal_to_customer(meal_contents, image_generation_description):
     """Creates a generated image of the food items and menu that have been ordered, delivers the meal_contents description as text and uses the image_generation_description to generate an image of it"""
-    timestamp = str(int(time.time()))
-    file_name = f"{timestamp}/ORDER.json"
-    s3 = boto3.client('s3')
-    s3.put_object(Bucket=DELIVERY_BUCKET, Key=file_name,
-                  Body=json.dumps(meal_contents))
-
-    file_name = generate_image(image_generation_description)
-    file = open(file_name, 'rb')
-    s3.put_object(Bucket=DELIVERY_BUCKET, Key=f"{timestamp}/" + file_name.split('/')[-1],
-                  Body=file)
+    # one prefix per tool call, so concurrent orders never write over each other
+    request = current_request()
+    prefix = f"{request['orchestration_id']}/{request['tool_use_id']}"
+    order_upload = uploads.submit(client('s3').put_object, Bucket=DELIVERY_BUCKET, Key=f"{prefix}/ORDER.json",
+                                  Body=json.dumps(meal_contents))
+    try:
+        deliver_image(image_generation_description, DELIVERY_BUCKET, f"{prefix}/txt_to_img.png")
+    except ShedError as e:
+        # Bedrock is too busy for the picture, the meal still goes out
+        print(f"Delivering without an image: {e}")
+    order_upload.result()
 
     print(f"Delivered meal to customer: {meal_contents}")
 
     return "Delivered to customer: " + meal_contents
 
 
+@tool
+def task_completion(meal_contents):
+    request = current_request()
+    event_id = publish_completion(request["orchestration_id"], request["tool_use_id"], request["node"],
+                                  f"Front counter completed, delivered: {meal_contents}")
+    print(f"event posted: {event_id}")
+    return f"event posted: {event_id}"
+
+
+# built once per container, the order is passed in through current_request()
+agents = AgentPool(lambda: Agent(
+    model=bedrock_model(),
+    tools=[deliver_meal_to_customer, task_completion]
+))
+
+
 def process_event(event):
-    orchestration_id = event["orchestration_id"]
-    tool_use_id = event["tool_use_id"]
     request = event["tool_input"]
-    tool_name = event['node']
-
-    # since this needs variable injection, keep within handler method scope.
-    @tool
-    def task_completion(meal_contents):
-        client = boto3.client('events')
-        COMPLETION_BUS_NAME = os.environ.get('COMPLETION_BUS_NAME')
-        event = {
-            'Source': 'task.completion',
-            'DetailType': 'task.completion',
-            'EventBusName': COMPLETION_BUS_NAME,
-            'Detail': json.dumps({
-                'orchestration_id': orchestration_id,
-                'data': f"Front counter completed, delivered: {meal_contents}",
-                'tool_use_id': tool_use_id,
-                'node': tool_name
-            })
-        }
-
-        response = client.put_events(
-            Entries=[
-                event
-            ]
-        )
-        print(f"event posted: {response}")
-        return f"event posted: {event}"
-
-    agent = Agent(
-        model=bedrock_model,
-        tools=[deliver_meal_to_customer, task_completion]
-    )
 
     instruction = f"""You work on the front counter and deliver food to the customer.
     When you get a meal ready notification, deliver the food to the customer.
@@ -116,15 +71,19 @@ def process_event(event):
 
     The current order is: {request}
     """
-    agent(instruction)
+    agents.run(event, instruction)
+
+
+def handle_message(message_body):
+    run_once(message_key("front-counter", message_body), process_event, message_body)
 
 
 def handler(event, context):
     print(f"processing event {event}")
-    for record in event['Records']:
-        message_body = json.loads(record['body'])
-        process_event(message_body)
+    return process_records(event, context, handle_message)
+
 
+record_init("front-counter")
 
 if __name__ == "__main__":
     # Grab a record from your lambda and invoke, configuration will vary drastically
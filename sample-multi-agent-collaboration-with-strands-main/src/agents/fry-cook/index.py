@@ -1,19 +1,30 @@
-import json
-import os
-import boto3
-from strands import Agent, tool, models
-from strands_tools import current_time
-
-bedrock_model = models.BedrockModel(
+import asyncio
+import re
+from bootstrap import lazy, record_init, timed, timed_import
+from botocore.config import Config
+from bedrock_governor import govern, GOVERNED_RETRIES, NORMAL
+with timed("strands"):
+    from strands import Agent, tool, models
+from idempotency import run_once, message_key
+from record_processor import process_records
+from completion import publish_completion
+from agent_pool import AgentPool, current_request, request_context
+from recipe_engine import Recipe, Step, run_recipe
+
+bedrock_model = lazy("bedrock_model", lambda: govern(models.BedrockModel(
     model="anthropic.claude-3-5-sonnet-20241022-v2:0",
     max_tokens=40000,
-    region_name="us-west-2"
-)
+    region_name="us-west-2",
+    boto_client_config=Config(retries=GOVERNED_RETRIES),
+), NORMAL))
+
+# Seconds the fries stay in the oil
+FRY_SECONDS = 5
+
 
 @tool
-def wait_time(seconds: int):
-    import time
-    time.sleep(seconds)
+async def wait_time(seconds: int):
+    await asyncio.sleep(seconds)
 
 
 @tool
@@ -34,43 +45,65 @@ def raise_fries():
     return "fries raised"
 
 
-def process_event(event):
-    orchestration_id = event["orchestration_id"]
-    tool_use_id = event["tool_use_id"]
-    request = event["tool_input"]
-    tool_name = event['node']
-
-    # since this needs variable injection, keep within handler method scope.
-    @tool
-    def deliver_meal(meal_contents):
-        client = boto3.client('events')
-        COMPLETION_BUS_NAME = os.environ.get('COMPLETION_BUS_NAME')
-        event = {
-            'Source': 'task.completion',
-            'DetailType': 'task.completion',
-            'EventBusName': COMPLETION_BUS_NAME,
-            'Detail': json.dumps({
-                'orchestration_id': orchestration_id,
-                'data': f"Fry cooking completed, delivered: {meal_contents}",
-                'tool_use_id': tool_use_id,
-                'node': tool_name
-            })
-        }
-
-        response = client.put_events(
-            Entries=[
-                event
-            ]
-        )
-        print(f"event posted: {response}")
-        return f"event posted: {event}"
-
-    agent = Agent(
-        model=bedrock_model,
+@tool
+def deliver_meal(meal_contents):
+    request = current_request()
+    event_id = publish_completion(request["orchestration_id"], request["tool_use_id"], request["node"],
+                                  f"Fry cooking completed, delivered: {meal_contents}")
+    print(f"event posted: {event_id}")
+    return f"event posted: {event_id}"
+
+
+FRIES_SIZES = {"s": "small", "small": "small", "m": "medium", "medium": "medium", "l": "large", "large": "large"}
+
+
+def match_fries(fries_size):
+    """Returns the size for an order like "L" or "large fries", None if it is not a size we know."""
+    words = re.sub(r"[^a-z]+", " ", str(fries_size).lower()).split()
+    words = [word for word in words if word not in ("fries", "fry", "order", "of", "a", "an", "one", "size")]
+    if not words:
+        # the tool spec makes M the default
+        return "medium"
+    if len(words) != 1:
+        return None
+    return FRIES_SIZES.get(words[0])
+
+
+def fries_recipe(size):
+    """Dips, raises the fries FRY_SECONDS later without holding a thread, boxes and delivers them."""
+    return Recipe("fries", [
+        Step("dip_fries", dip_fries),
+        Step("raise_fries", raise_fries, after=["dip_fries"], delay=FRY_SECONDS),
+        Step("box_fries", box_fries, after=["raise_fries"]),
+        Step("deliver_meal", deliver_meal, after=["box_fries"],
+             args=lambda results: {"meal_contents": f"{size} fries, boxed"}),
+    ])
+
+
+def create_agent():
+    current_time = timed_import("strands_tools.current_time")
+    return Agent(
+        model=bedrock_model(),
         tools=[current_time, wait_time, box_fries,
                dip_fries, raise_fries, deliver_meal]
     )
 
+
+# built once per container, the order is passed in through current_request()
+agents = AgentPool(create_agent)
+
+
+def process_event(event):
+    request = event["tool_input"]
+
+    size = match_fries(request.get("friesSize", ""))
+    if size is not None:
+        print(f"cooking {request} from the recipe: {size}")
+        with request_context(event):
+            run_recipe(fries_recipe(size))
+        return
+    print(f"no recipe for {request}, handing it to the agent")
+
     instruction = f"""You are a fry cook.
     You prepare the fries:
     You must first dip the fries and then 5 seconds later,
@@ -80,19 +113,23 @@ def process_event(event):
 
     The current order is: {request}
     """
-    agent(instruction)
+    agents.run(event, instruction)
+
+
+def handle_message(message_body):
+    run_once(message_key("fry-cook", message_body), process_event, message_body)
 
 
 def handler(event, context):
     print(f"processing event {event}")
-    for record in event['Records']:
-        message_body = json.loads(record['body'])
-        process_event(message_body)
+    return process_records(event, context, handle_message)
+
 
+record_init("fry-cook")
 
 if __name__ == "__main__":
     # Grab a record from your lambda and invoke, configuration will vary drastically
     process_event(
-        {'tool_input': {'friesOrder': 'fries'}, 'orchestration_id': 'ed3b70b6-37c6-47fa-8f50-4eac0908345e',
+        {'tool_input': {'friesSize': 'M'}, 'orchestration_id': 'ed3b70b6-37c6-47fa-8f50-4eac0908345e',
             'tool_use_id': 'tooluse_L9uWo8_KR4mT70-876lzSA'}
     )
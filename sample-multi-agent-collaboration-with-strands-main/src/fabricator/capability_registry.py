@@ -0,0 +1,233 @@
+"""Remembers what the fabricator has built so it only builds it once.
+
+Every fabrication request is reduced to its capability: the taskDetails text
+normalized to its sorted content words ("Create a capability to prepare and
+serve cheesecake desserts" and "make a cheesecake dessert" both become
+"cheesecake dessert"), plus a Titan embedding of that text. Category nouns
+like dessert or drink are content words, so "make a dessert" is not every
+other dessert request. A task that is nothing but filler keeps its whole
+lowercased text. A request matches an
+existing capability when the normalized text is equal or the embeddings'
+cosine similarity is at least CAPABILITY_SIMILARITY.
+
+The table holds one item per capability. While it is being built the item is
+FABRICATING and is a lock: the request that created it (the leader) runs the
+fabrication, requests that match it add themselves to its waiters (keyed by
+tool_use_id, so adding one again changes nothing) and don't start their own.
+When the leader is done it marks the item READY and publishes a completion for
+every waiter. A lock whose leader died expires after FABRICATION_TIMEOUT and
+the next matching request takes it over, waiters included. A waiter's own
+delivery is left on the queue (see process_event in index.py), so when no new
+request comes the waiter's redelivery is the one that takes over.
+
+The lock's expiry is lockExpiresAt, not a TTL attribute: TTL would delete a
+stale lock together with the waiters it still owes a completion.
+"""
+import json
+import math
+import os
+import re
+import time
+from botocore.exceptions import ClientError
+from bootstrap import lazy_client
+from bedrock_governor import governed_client, LOW
+from ddb_codec import serialize, deserialize, from_item, to_item
+
+CAPABILITY_TABLE = os.environ.get('CAPABILITY_TABLE')
+CAPABILITY_EMBEDDING_MODEL = os.environ.get('CAPABILITY_EMBEDDING_MODEL', 'amazon.titan-embed-text-v2:0')
+CAPABILITY_SIMILARITY = float(os.environ.get('CAPABILITY_SIMILARITY', '0.85'))
+# How long a fabrication holds its lock, should cover the fabricator Lambda timeout
+FABRICATION_TIMEOUT = int(os.environ.get('FABRICATION_TIMEOUT', '900'))
+EMBEDDING_DIMENSIONS = 256
+
+FABRICATING = "FABRICATING"
+READY = "READY"
+
+# Words that say how to phrase the request, not what to build
+FILLER_WORDS = {
+    "a", "an", "the", "and", "or", "of", "for", "to", "with", "that", "can", "which", "some", "new", "any",
+    "create", "build", "make", "add", "capability", "capabilities", "agent", "tool", "able", "ability",
+    "prepare", "serve", "cook", "handle", "process", "deliver", "order", "item",
+}
+
+dynamodb = lazy_client('dynamodb')
+# a shed embedding falls back to exact matches like any other failure
+bedrock = governed_client(LOW, region_name="us-west-2")
+
+
+def singular(word):
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize(task):
+    if not isinstance(task, str) or not task.strip():
+        raise ValueError(f"a capability needs a task description, got {task!r}")
+    words = {singular(word) for word in re.findall(r"[a-z0-9]+", task.lower())}
+    words = {word for word in words if word not in FILLER_WORDS}
+    # all filler, the request is still its own capability
+    return " ".join(sorted(words)) or " ".join(task.lower().split())
+
+
+def embed(text):
+    """Titan embedding of the text, None if it could not be computed (only exact matches are used then)."""
+    try:
+        response = bedrock.invoke_model(
+            modelId=CAPABILITY_EMBEDDING_MODEL,
+            body=json.dumps({"inputText": text, "dimensions": EMBEDDING_DIMENSIONS, "normalize": True}),
+            accept="application/json", contentType="application/json"
+        )
+        return json.loads(response["body"].read())["embedding"]
+    except Exception as e:
+        print(f"could not embed {text!r}: {e!r}")
+        return None
+
+
+def similarity(a, b):
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def is_condition_failure(error: ClientError) -> bool:
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+
+class Claim:
+    """Outcome of claiming a capability: READY with its tool, WAITING on another fabrication, or LEADER."""
+
+    def __init__(self, outcome, capability_key, tool_id=None):
+        self.outcome = outcome
+        self.capability_key = capability_key
+        self.tool_id = tool_id
+
+
+class CapabilityRegistry:
+    def __init__(self, table_name=None):
+        self.table_name = table_name or CAPABILITY_TABLE
+
+    def capabilities(self):
+        items = []
+        scan_kwargs = {'TableName': self.table_name, 'ConsistentRead': True}
+        while True:
+            response = dynamodb.scan(**scan_kwargs)
+            items.extend(from_item(item) for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def match(self, normalized, embedding):
+        """The closest capability to the request, None if none is close enough."""
+        best, best_score = None, CAPABILITY_SIMILARITY
+        for item in self.capabilities():
+            if item['normalized'] == normalized:
+                return item
+            score = similarity(embedding, item.get('embedding'))
+            if score >= best_score:
+                best, best_score = item, score
+        if best is not None:
+            print(f"{normalized!r} matched capability {best['normalized']!r} with similarity {best_score:.3f}")
+        return best
+
+    def claim(self, task, waiter):
+        """Finds or starts the fabrication for task, waiter is the request to notify if it has to wait."""
+        normalized = normalize(task)
+        embedding = embed(normalized)
+        # at most one retry: the item we matched or wanted to create changed under us
+        for _ in range(2):
+            existing = self.match(normalized, embedding)
+            if existing is None:
+                if self.create(normalized, embedding):
+                    return Claim("LEADER", normalized)
+                continue
+            key = existing['capabilityKey']
+            if existing['status'] == READY:
+                return Claim("READY", key, existing['toolId'])
+            if existing['lockExpiresAt'] < int(time.time()):
+                if self.take_over(key, waiter):
+                    return Claim("LEADER", key)
+                continue
+            if self.add_waiter(key, waiter):
+                return Claim("WAITING", key)
+        raise RuntimeError(f"could not claim capability {normalized!r}, it kept changing")
+
+    def create(self, normalized, embedding):
+        item = {
+            'capabilityKey': normalized,
+            'normalized': normalized,
+            'status': FABRICATING,
+            'lockExpiresAt': int(time.time()) + FABRICATION_TIMEOUT,
+            'waiters': {},
+        }
+        if embedding is not None:
+            item['embedding'] = embedding
+        try:
+            dynamodb.put_item(
+                TableName=self.table_name, Item=to_item(item),
+                ConditionExpression="attribute_not_exists(capabilityKey)"
+            )
+        except ClientError as e:
+            if is_condition_failure(e):
+                return False
+            raise
+        return True
+
+    def take_over(self, key, waiter):
+        now = int(time.time())
+        try:
+            # a waiter taking over answers itself as the leader, not as a waiter
+            dynamodb.update_item(
+                TableName=self.table_name, Key={'capabilityKey': serialize(key)},
+                UpdateExpression="SET lockExpiresAt = :expires_at REMOVE waiters.#waiter",
+                ConditionExpression="#status = :fabricating AND lockExpiresAt < :now",
+                ExpressionAttributeNames={"#status": "status", "#waiter": waiter["tool_use_id"]},
+                ExpressionAttributeValues={
+                    ":expires_at": serialize(now + FABRICATION_TIMEOUT),
+                    ":fabricating": serialize(FABRICATING),
+                    ":now": serialize(now),
+                }
+            )
+        except ClientError as e:
+            if is_condition_failure(e):
+                return False
+            raise
+        print(f"took over the expired fabrication of {key!r}")
+        return True
+
+    def add_waiter(self, key, waiter):
+        try:
+            dynamodb.update_item(
+                TableName=self.table_name, Key={'capabilityKey': serialize(key)},
+                UpdateExpression="SET waiters.#waiter = :waiter",
+                ConditionExpression="#status = :fabricating",
+                ExpressionAttributeNames={"#status": "status", "#waiter": waiter["tool_use_id"]},
+                ExpressionAttributeValues={":waiter": serialize(waiter), ":fabricating": serialize(FABRICATING)}
+            )
+        except ClientError as e:
+            if is_condition_failure(e):
+                return False
+            raise
+        print(f"waiting on the fabrication of {key!r}")
+        return True
+
+    def finish(self, key, tool_id):
+        """Marks the capability READY, returning the requests that waited on it."""
+        response = dynamodb.update_item(
+            TableName=self.table_name, Key={'capabilityKey': serialize(key)},
+            UpdateExpression="SET #status = :ready, toolId = :tool_id REMOVE waiters, lockExpiresAt",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":ready": serialize(READY), ":tool_id": serialize(tool_id)},
+            ReturnValues="ALL_OLD"
+        )
+        return list(deserialize(response['Attributes'].get('waiters', {'M': {}})).values())
+
+    def abandon(self, key):
+        """Drops a failed fabrication so the next request starts over, returning its waiters."""
+        response = dynamodb.delete_item(
+            TableName=self.table_name, Key={'capabilityKey': serialize(key)},
+            ReturnValues="ALL_OLD"
+        )
+        return list(deserialize(response.get('Attributes', {}).get('waiters', {'M': {}})).values())
@@ -1,10 +1,19 @@
 import json
 from typing import Any
-from strands import Agent, tool, models
-from strands_tools import file_write, http_request, shell
 import os
-import boto3
-from botocore.config import Config
+from bootstrap import client, record_init, timed, timed_import
+with timed("strands"):
+    from strands import Agent, tool, models
+from idempotency import run_once, message_key, ClaimInProgress
+from record_processor import process_records
+from completion import publish_completion
+from agent_pool import current_request, request_context
+from capability_registry import CapabilityRegistry
+from qualification import qualify
+from ddb_codec import to_item
+from agent_tracing import instrument
+from bedrock_governor import govern, GOVERNED_RETRIES, NORMAL
+from tool_config_version import bump_config_version
 
 os.environ.setdefault("BYPASS_TOOL_CONSENT", "true")
 
@@ -124,7 +133,7 @@ from strands import Agent, tool, models
 @tool
 def upload_file_to_s3(file_path):
     """Upload a file to S3"""
-    s3 = boto3.client('s3')
+    s3 = client('s3')
     bucket_name = os.environ.get("AGENT_BUCKET_NAME", None)
     if bucket_name is None:
         raise ValueError("AGENT_BUCKET_NAME environment variable is not set")
@@ -132,6 +141,16 @@ def upload_file_to_s3(file_path):
     s3.upload_file(file_path, bucket_name, file_path.split("/")[-1])
 
 
+def qualify_uploaded(filename, schema):
+    """Qualifies the module as uploaded to the agent bucket, which is what the generic wrapper will run."""
+    local_path = f"/tmp/qualify-{filename}"
+    client('s3').download_file(os.environ.get("AGENT_BUCKET_NAME"), filename, local_path)
+    try:
+        return qualify(local_path, schema)
+    finally:
+        os.remove(local_path)
+
+
 @tool
 def store_agent_config_dynamo(file_name: str, tool_id: str, llm_tool_schema: Any, agent_description: str):
     """Store agent configuration in DynamoDB.
@@ -139,6 +158,8 @@ def store_agent_config_dynamo(file_name: str, tool_id: str, llm_tool_schema: Any
     Requirements:
     - AGENT_CONFIG_TABLE_NAME environment variable must be set with the DynamoDB table name
     - DynamoDB table must use 'toolId' as the primary key
+    - The file must already be uploaded with upload_file_to_s3. It is run once against a stub model to
+      check that it imports, has a handler and stays within the time and memory budgets
     
     Args:
         file_name (str): The filename where the tool implementation is stored
@@ -161,9 +182,9 @@ def store_agent_config_dynamo(file_name: str, tool_id: str, llm_tool_schema: Any
         bool: True if configuration was successfully stored
         
     Raises:
-        ValueError: If AGENT_CONFIG_TABLE_NAME environment variable is not set
+        ValueError: If AGENT_CONFIG_TABLE_NAME environment variable is not set, or the file failed
+                    qualification (the message says why, fix the file and upload it again)
     """
-    dynamodb = boto3.resource('dynamodb')
     table_name = os.environ.get("TOOL_CONFIG_TABLE", None)
     if table_name is None:
         raise ValueError(
@@ -173,13 +194,20 @@ def store_agent_config_dynamo(file_name: str, tool_id: str, llm_tool_schema: Any
     if isinstance(llm_tool_schema, str):
         llm_tool_schema = json.loads(llm_tool_schema)
 
-    table = dynamodb.Table(table_name)
-    table.put_item(
-        Item={
+    filename = file_name.split('/')[-1]
+    profile = qualify_uploaded(filename, llm_tool_schema)
+    if not profile["qualified"]:
+        raise ValueError(f"{filename} failed qualification and was not registered, "
+                         f"fix it and upload it again: {profile['error']}")
+
+    dynamodb = client('dynamodb')
+    dynamodb.put_item(
+        TableName=table_name,
+        Item=to_item({
             'toolId': tool_id,
             'config': {
                 "name": tool_id,
-                "filename": file_name.split('/')[-1],
+                "filename": filename,
                 "schema": llm_tool_schema,
                 "version": '0',
                 "description": agent_description,
@@ -187,9 +215,14 @@ def store_agent_config_dynamo(file_name: str, tool_id: str, llm_tool_schema: Any
                     "type": "sqs",
                     "target": os.environ.get("GENERIC_QUEUE_URL", "MISSING")
                 },
+                "profile": profile,
             }
-        }
+        })
     )
+    # so warm orchestrators pick up the new tool
+    bump_config_version(table_name)
+    # the capability registry records which tool this fabrication produced
+    current_request().setdefault("fabricated_tools", []).append(tool_id)
     return True
 
 
@@ -200,13 +233,59 @@ def process_event(event, context):
     tool_name = event['node']
 
     TASK = request.get("taskDetails", None)
+    if not isinstance(TASK, str) or not TASK.strip():
+        # retrying can't fix the request, the model has to ask again
+        publish_completion(orchestration_id, tool_use_id, tool_name,
+                           "taskDetails is required, describe the capability to create.")
+        return
+
+    registry = CapabilityRegistry()
+    waiter = {"orchestration_id": orchestration_id, "tool_use_id": tool_use_id, "node": tool_name}
+    claim = registry.claim(TASK, waiter)
+    if claim.outcome == "READY":
+        print(f"{TASK!r} is already covered by {claim.tool_id}")
+        publish_completion(orchestration_id, tool_use_id, tool_name,
+                           f"Capability {claim.tool_id} has been created, try to invoke it again.")
+        return
+    if claim.outcome == "WAITING":
+        # the leader publishes our completion when its fabrication is done. The delivery stays on
+        # the queue until then, if the leader dies its lock expires and the redelivery takes over.
+        raise ClaimInProgress(f"{TASK!r} is being fabricated by another request")
+
+    try:
+        with request_context(event):
+            fabricate(event, TASK)
+        fabricated_tools = event.get("fabricated_tools", [])
+        if not fabricated_tools:
+            raise RuntimeError(f"fabricating {TASK!r} did not store a tool config")
+    except Exception:
+        for waiting in registry.abandon(claim.capability_key):
+            publish_completion(waiting["orchestration_id"], waiting["tool_use_id"], waiting["node"],
+                               "Capability could not be created, try to create it again.")
+        raise
+
+    for waiting in registry.finish(claim.capability_key, fabricated_tools[-1]):
+        publish_completion(waiting["orchestration_id"], waiting["tool_use_id"], waiting["node"],
+                           f"Capability {fabricated_tools[-1]} has been created, try to invoke it again.")
+
+
+def fabricate(event, TASK):
+    orchestration_id = event["orchestration_id"]
+    tool_use_id = event["tool_use_id"]
+    tool_name = event['node']
 
-    bedrock_model = models.BedrockModel(
+    # only the fabricator needs these, load them on its first event rather than at init
+    from botocore.config import Config
+    file_write = timed_import("strands_tools.file_write")
+    http_request = timed_import("strands_tools.http_request")
+    shell = timed_import("strands_tools.shell")
+
+    bedrock_model = govern(models.BedrockModel(
         model="anthropic.claude-3-5-sonnet-20241022-v2:0",
         max_tokens=40000,
         region_name="us-west-2",
-        boto_client_config=Config(read_timeout=3600),
-    )
+        boto_client_config=Config(read_timeout=3600, retries=GOVERNED_RETRIES),
+    ), NORMAL)
 
     # Put this in to make it self testing
     # make_it_run_code = "make sure you try to run the file and debug any issues it might have. You do not need to confirm the correct response, only that the file runs properly."
@@ -215,28 +294,11 @@ def process_event(event, context):
     @tool
     def complete_task():
         """Finally, call this to indicate the task has been completed"""
-        client = boto3.client('events')
-        COMPLETION_BUS_NAME = os.environ.get('COMPLETION_BUS_NAME')
-        event = {
-            'Source': 'task.completion',
-            'DetailType': 'task.completion',
-            'EventBusName': COMPLETION_BUS_NAME,
-            'Detail': json.dumps({
-                'orchestration_id': orchestration_id,
-                'data': f"Capability has been created, try to invoke it again.",
-                'tool_use_id': tool_use_id,
-                'node': tool_name
-            })
-        }
         print("Completed")
-
-        response = client.put_events(
-            Entries=[
-                event
-            ]
-        )
-        print(f"event posted: {response}")
-        return f"event posted: {event}"
+        event_id = publish_completion(orchestration_id, tool_use_id, tool_name,
+                                      f"Capability has been created, try to invoke it again.")
+        print(f"event posted: {event_id}")
+        return f"event posted: {event_id}"
 
     agent = Agent(
         model=bedrock_model,
@@ -244,15 +306,21 @@ def process_event(event, context):
             upload_file_to_s3, store_agent_config_dynamo, complete_task],
         system_prompt=SYSTEM_PROMPT
     )
+    instrument(agent)
 
     agent(TASK)
 
 
 def lambda_handler(event, context):
     print(f"processing event {event}")
-    for record in event['Records']:
-        message_body = json.loads(record['body'])
-        process_event(message_body, context)
+
+    def handle_message(message_body):
+        run_once(message_key("fabricator", message_body), process_event, message_body, context)
+
+    return process_records(event, context, handle_message)
+
+
+record_init("fabricator")
 
 if __name__ == "__main__":
     # Grab a record from your lambda and invoke, configuration will vary drastically
@@ -0,0 +1,152 @@
+"""Checks a fabricated module before it is registered as a tool.
+
+The module is run by qualify_runner.py in a child process: its own session
+and working directory under /tmp, no AWS credentials, CPU, address space and
+file size limits, and a stub in place of the Bedrock model. The handler is
+called once with an input made up from the tool's schema. The result is the
+module's profile:
+
+    qualified, import_ms, handler_ms, peak_rss_mb, model_calls, flags, error,
+    source_sha256, budgets
+
+A module that cannot be imported, has no handler, crashes the process or runs
+past QUALIFY_TIMEOUT is not qualified. Going over a budget adds a flag
+(slow_import, slow_handler, memory), and flags listed in QUALIFY_REJECT_FLAGS
+also fail the module. A handler that raises on the made up input is flagged
+handler_error.
+"""
+import hashlib
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+QUALIFY_IMPORT_BUDGET_MS = float(os.environ.get('QUALIFY_IMPORT_BUDGET_MS', '5000'))
+QUALIFY_HANDLER_BUDGET_MS = float(os.environ.get('QUALIFY_HANDLER_BUDGET_MS', '30000'))
+QUALIFY_MEMORY_BUDGET_MB = float(os.environ.get('QUALIFY_MEMORY_BUDGET_MB', '512'))
+QUALIFY_TIMEOUT = float(os.environ.get('QUALIFY_TIMEOUT', '60'))
+QUALIFY_REJECT_FLAGS = {flag for flag in os.environ.get(
+    'QUALIFY_REJECT_FLAGS', 'slow_import,slow_handler,memory').split(',') if flag}
+# Hard limits of the child process, above the budgets so overruns are measured rather than killed
+ADDRESS_SPACE_LIMIT_MB = int(os.environ.get('QUALIFY_ADDRESS_SPACE_MB', '4096'))
+FILE_SIZE_LIMIT_MB = 64
+# Output kept from a failed run for the fabricator agent to debug with
+OUTPUT_TAIL = 2000
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qualify_runner.py')
+CREDENTIAL_VARIABLES = ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN',
+                        'AWS_SECURITY_TOKEN', 'AWS_CONTAINER_CREDENTIALS_FULL_URI',
+                        'AWS_CONTAINER_CREDENTIALS_RELATIVE_URI', 'AWS_CONTAINER_AUTHORIZATION_TOKEN',
+                        'AWS_PROFILE', 'AWS_WEB_IDENTITY_TOKEN_FILE')
+
+SAMPLE_VALUES = {"string": "test", "integer": 1, "number": 1.0, "boolean": True, "array": [], "object": {}}
+
+
+def sample_input(schema):
+    """Handler kwargs for the schema's required properties, all of them if it lists none."""
+    properties = (schema or {}).get('properties', {})
+    names = (schema or {}).get('required') or list(properties)
+    sample = {}
+    for name in names:
+        prop = properties.get(name, {})
+        if prop.get('enum'):
+            sample[name] = prop['enum'][0]
+        else:
+            sample[name] = SAMPLE_VALUES.get(prop.get('type'), "test")
+    return sample
+
+
+def sandbox_environment():
+    env = {k: v for k, v in os.environ.items() if k not in CREDENTIAL_VARIABLES}
+    # no instance metadata either, the module must not reach real AWS resources
+    env['AWS_EC2_METADATA_DISABLED'] = 'true'
+    env['BYPASS_TOOL_CONSENT'] = 'true'
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    return env
+
+
+def limit_resources():
+    mb = 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (ADDRESS_SPACE_LIMIT_MB * mb, ADDRESS_SPACE_LIMIT_MB * mb))
+    cpu_seconds = int(QUALIFY_TIMEOUT) + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (FILE_SIZE_LIMIT_MB * mb, FILE_SIZE_LIMIT_MB * mb))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def run_sandboxed(module_path, handler_input, workdir):
+    """Runs the module in the child process, returning (measurements or None, output tail)."""
+    result_path = os.path.join(workdir, 'result.json')
+    process = subprocess.Popen(
+        [sys.executable, RUNNER, module_path, json.dumps(handler_input), result_path],
+        cwd=workdir, env=sandbox_environment(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        preexec_fn=limit_resources, start_new_session=True
+    )
+    try:
+        output, _ = process.communicate(timeout=QUALIFY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        # the module may have started processes of its own
+        os.killpg(process.pid, signal.SIGKILL)
+        output, _ = process.communicate()
+        return None, f"timed out after {QUALIFY_TIMEOUT}s\n" + output.decode('utf-8', 'replace')[-OUTPUT_TAIL:]
+
+    tail = output.decode('utf-8', 'replace')[-OUTPUT_TAIL:]
+    if not os.path.exists(result_path):
+        return None, f"exited with code {process.returncode}\n{tail}"
+    with open(result_path) as f:
+        return json.load(f), tail
+
+
+def qualify(module_path, schema):
+    """Runs the module once against the stub model and returns its profile."""
+    with open(module_path, 'rb') as f:
+        source = f.read()
+    profile = {
+        "qualified": False,
+        "flags": [],
+        "error": None,
+        "source_sha256": hashlib.sha256(source).hexdigest(),
+        "qualified_at": int(time.time()),
+        "budgets": {
+            "import_ms": QUALIFY_IMPORT_BUDGET_MS,
+            "handler_ms": QUALIFY_HANDLER_BUDGET_MS,
+            "peak_rss_mb": QUALIFY_MEMORY_BUDGET_MB,
+        },
+    }
+
+    workdir = tempfile.mkdtemp(prefix='qualify-', dir='/tmp')
+    try:
+        candidate = os.path.join(workdir, os.path.basename(module_path))
+        shutil.copyfile(module_path, candidate)
+        measurements, output = run_sandboxed(candidate, sample_input(schema), workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if measurements is None or measurements.get("error"):
+        profile["error"] = (measurements or {}).get("error") or output
+        print(f"{module_path} did not qualify: {profile['error']}")
+        return profile
+
+    for key in ("import_ms", "handler_ms", "peak_rss_mb", "model_calls"):
+        profile[key] = measurements[key]
+    if measurements["import_ms"] > QUALIFY_IMPORT_BUDGET_MS:
+        profile["flags"].append("slow_import")
+    if measurements["handler_ms"] > QUALIFY_HANDLER_BUDGET_MS:
+        profile["flags"].append("slow_handler")
+    if measurements["peak_rss_mb"] > QUALIFY_MEMORY_BUDGET_MB:
+        profile["flags"].append("memory")
+    if measurements["handler_error"]:
+        profile["flags"].append("handler_error")
+        profile["handler_error"] = measurements["handler_error"]
+
+    rejected = QUALIFY_REJECT_FLAGS.intersection(profile["flags"])
+    profile["qualified"] = not rejected
+    if rejected:
+        profile["error"] = f"over budget: {', '.join(sorted(rejected))}"
+    print(f"qualification of {module_path}: {profile}")
+    return profile
@@ -0,0 +1,100 @@
+"""Runs one fabricated module for qualification.py, in its own process.
+
+    python qualify_runner.py <module path> <handler input json> <result path>
+
+Bedrock models are replaced with a stub that answers every request at once
+with a short text reply, so the handler's own cost is measured without model
+latency. Strands is imported before the timer starts, import_ms is the time
+of the module's own code.
+"""
+import importlib.util
+import json
+import resource
+import sys
+import time
+import traceback
+
+model_calls = 0
+
+
+def install_stub_model():
+    from strands.models import Model
+    import strands.models
+    import strands.models.bedrock
+    import strands.agent.agent
+
+    class StubModel(Model):
+        def __init__(self, *args, **kwargs):
+            self.config = kwargs
+
+        def update_config(self, **model_config):
+            self.config.update(model_config)
+
+        def get_config(self):
+            return self.config
+
+        async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+            raise NotImplementedError("structured output is not available during qualification")
+            yield
+
+        async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+            global model_calls
+            model_calls += 1
+            yield {"messageStart": {"role": "assistant"}}
+            yield {"contentBlockDelta": {"delta": {"text": "Done."}}}
+            yield {"contentBlockStop": {}}
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            yield {"metadata": {"usage": {"inputTokens": 0, "outputTokens": 0, "totalTokens": 0},
+                                "metrics": {"latencyMs": 0}}}
+
+    strands.models.BedrockModel = StubModel
+    strands.models.bedrock.BedrockModel = StubModel
+    if hasattr(strands.agent.agent, 'BedrockModel'):
+        # Agent() without a model builds the default BedrockModel
+        strands.agent.agent.BedrockModel = StubModel
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(module_path, handler_input):
+    result = {"import_ms": None, "handler_ms": None, "handler_error": None}
+    install_stub_model()
+
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("fabricated_candidate", module_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    result["import_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    if not callable(getattr(module, 'handler', None)):
+        raise AttributeError("the module has no handler function")
+
+    start = time.perf_counter()
+    try:
+        module.handler(**handler_input)
+    except Exception as e:
+        # the input is made up from the schema, a failure here is reported but not fatal
+        result["handler_error"] = f"{type(e).__name__}: {e}"
+    result["handler_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def main():
+    module_path, handler_input, result_path = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3]
+    try:
+        result = run(module_path, handler_input)
+        result["error"] = None
+    except BaseException:
+        result = {"error": traceback.format_exc(limit=5)}
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["model_calls"] = model_calls
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,41 @@
 
 import json
 import os
-import boto3
-import importlib.util
-import sys
+from bootstrap import client, lazy_client, record_init
+from idempotency import run_once, message_key
+from record_processor import process_records
+from completion import publish_completion
+from ddb_codec import from_item
+import module_cache
+import tracing
 
 CONFIG_TABLE = os.environ.get('TOOL_CONFIG_TABLE')
-dynamodb = boto3.resource('dynamodb')
-
-def load_file_from_s3_into_tmp(bucket_name, file_name):
-    import boto3
-    s3 = boto3.client('s3')
-    s3.download_file(bucket_name, file_name, "/tmp/loaded_module.py")
-
-
+dynamodb = lazy_client('dynamodb')
 
 def load_config_from_dynamodb(tool_name: str):
     print(CONFIG_TABLE)
-    table = dynamodb.Table(CONFIG_TABLE)
-    response = table.get_item(
+    response = dynamodb.get_item(
+        TableName=CONFIG_TABLE,
         Key={
-            'toolId': tool_name
+            'toolId': {'S': tool_name}
         }
     )
     print(response)
-    return response['Item']
+    return from_item(response['Item'])
+
+
+def load_tool_config(tool_name: str):
+    config = load_config_from_dynamodb(tool_name)['config']
+    if isinstance(config, str):
+        config = json.loads(config)
+    return config
 
 def post_task_complete(response, tool_use_id, tool_name, orchestration_id):
-    client = boto3.client('events')
-    
-    COMPLETION_BUS_NAME = os.environ.get('COMPLETION_BUS_NAME')
-    event = {
-        'Source': 'task.completion',
-        'DetailType': 'task.completion',
-        'EventBusName': COMPLETION_BUS_NAME,
-        'Detail': json.dumps({
-            'orchestration_id': orchestration_id,
-            'data': f"Task completed, details: {response}",
-            'tool_use_id': tool_use_id,
-            'node': tool_name
-        })
-    }
-    print(f"posting event, {json.dumps(event)}")
-    response = client.put_events(
-        Entries=[
-            event
-        ]
-    )
-    print(f"event posted: {response}")
-    return f"event posted: {event}"
+    print(f"posting completion for {tool_use_id}")
+    event_id = publish_completion(orchestration_id, tool_use_id, tool_name,
+                                  f"Task completed, details: {response}")
+    print(f"event posted: {event_id}")
+    return f"event posted: {event_id}"
 
 
 def process_event(event, context):
@@ -58,24 +45,13 @@ def process_event(event, context):
     request = event["tool_input"]
     tool_name = event['node']
 
-    tool = load_config_from_dynamodb(tool_name)
-    config = tool['config']
-
-    if isinstance(config, str):
-        config = json.loads(config)
-
-    fileName = config['filename']
-    print("loading file from s3...")
-    load_file_from_s3_into_tmp(os.environ["AGENT_BUCKET_NAME"], fileName)
-
-    print("importing module...")
-    spec = importlib.util.spec_from_file_location("module.name", "/tmp/loaded_module.py")
-    foo = importlib.util.module_from_spec(spec)
-    sys.modules["module.name"] = foo
-    spec.loader.exec_module(foo)
+    print("loading module...")
+    config, foo = module_cache.load_tool(
+        tool_name, load_tool_config, client('s3'), os.environ["AGENT_BUCKET_NAME"])
     try:
         print("attempting to use module")
-        response = foo.handler(**request)
+        with tracing.span("fabricated.handler", tool=tool_name):
+            response = foo.handler(**request)
         print(f"response: {response}")
     except Exception as e:
         print(f"error running module: {e}")
@@ -86,9 +62,14 @@ def process_event(event, context):
 
 def lambda_handler(event, context):
     print(f"processing event {event}")
-    for record in event['Records']:
-        message_body = json.loads(record['body'])
-        process_event(message_body, context)
+
+    def handle_message(message_body):
+        run_once(message_key("generic-agent-wrapper", message_body), process_event, message_body, context)
+
+    return process_records(event, context, handle_message)
+
+
+record_init("generic-agent-wrapper")
 
 if __name__ == "__main__":
     lambda_handler(
@@ -0,0 +1,162 @@
+"""Keeps fabricated tool modules loaded in the warm container.
+
+Each tool gets its own entry holding its config, the S3 ETag / version id of
+its source, the compiled code object and the imported module. On every use
+the source is fetched with IfNoneMatch on the cached ETag, so unchanged code
+costs a 304 and no download, compile or import. Modules are registered under
+a name and /tmp path derived from the tool name and the source digest, so two
+tools (or two versions of one tool) never overwrite each other. Identical
+sources share one compiled code object. The least recently used tools are
+evicted past MODULE_CACHE_MAX_ENTRIES.
+"""
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+MODULE_CACHE_MAX_ENTRIES = int(os.environ.get('MODULE_CACHE_MAX_ENTRIES', '32'))
+# How long a tool config is trusted before it is read from DynamoDB again
+MODULE_CACHE_CONFIG_TTL = int(os.environ.get('MODULE_CACHE_CONFIG_TTL', '60'))
+MODULE_DIR = os.environ.get('MODULE_CACHE_DIR', '/tmp/fabricated')
+
+cache_stats = {"config_hits": 0, "config_loads": 0, "not_modified": 0, "downloads": 0, "compiles": 0, "evictions": 0}
+
+
+class CachedTool:
+    def __init__(self, config, config_expires_at):
+        self.config = config
+        self.config_expires_at = config_expires_at
+        self.filename = None
+        self.etag = None
+        self.version_id = None
+        self.digest = None
+        self.code = None
+        self.module = None
+        self.lock = threading.Lock()
+
+
+_tools = OrderedDict()
+_lock = threading.Lock()
+
+
+def module_name_for(tool_name, digest):
+    safe_name = re.sub(r'\W', '_', tool_name)
+    return f"fabricated_{safe_name}_{digest[:16]}"
+
+
+def is_not_modified(error: ClientError) -> bool:
+    return error.response['Error']['Code'] in ('304', 'NotModified')
+
+
+def _entry(tool_name, load_config):
+    """Returns the tool's cache entry, reading its config again once it has expired."""
+    now = time.time()
+    with _lock:
+        entry = _tools.get(tool_name)
+        if entry is not None:
+            _tools.move_to_end(tool_name)
+            if entry.config_expires_at > now:
+                cache_stats["config_hits"] += 1
+                return entry
+
+    config = load_config(tool_name)
+    cache_stats["config_loads"] += 1
+    with _lock:
+        entry = _tools.get(tool_name)
+        if entry is None:
+            entry = CachedTool(config, now + MODULE_CACHE_CONFIG_TTL)
+            _tools[tool_name] = entry
+            while len(_tools) > MODULE_CACHE_MAX_ENTRIES:
+                _, evicted = _tools.popitem(last=False)
+                _unload(evicted)
+                cache_stats["evictions"] += 1
+        else:
+            entry.config = config
+            entry.config_expires_at = now + MODULE_CACHE_CONFIG_TTL
+    return entry
+
+
+def _code_for(digest, source, path):
+    # tools fabricated from the same source share the code object
+    with _lock:
+        for other in _tools.values():
+            if other.digest == digest and other.code is not None:
+                return other.code
+    cache_stats["compiles"] += 1
+    return compile(source, path, 'exec')
+
+
+def _unload(entry):
+    if entry.module is None:
+        return
+    sys.modules.pop(entry.module.__name__, None)
+    try:
+        os.remove(entry.module.__file__)
+    except OSError:
+        pass
+    entry.module = None
+
+
+def _import(tool_name, entry, source):
+    digest = hashlib.sha256(source).hexdigest()
+    if digest == entry.digest and entry.module is not None:
+        return
+
+    name = module_name_for(tool_name, digest)
+    os.makedirs(MODULE_DIR, exist_ok=True)
+    path = os.path.join(MODULE_DIR, f"{name}.py")
+    # kept on disk so tracebacks, inspect and __file__ work inside the tool
+    with open(path, 'wb') as f:
+        f.write(source)
+
+    code = _code_for(digest, source, path)
+    module = types.ModuleType(name)
+    module.__file__ = path
+    sys.modules[name] = module
+    try:
+        exec(code, module.__dict__)
+    except BaseException:
+        sys.modules.pop(name, None)
+        raise
+
+    if entry.module is not None and entry.module.__name__ != name:
+        _unload(entry)
+    entry.module, entry.code, entry.digest = module, code, digest
+
+
+def load_tool(tool_name, load_config, s3, bucket_name):
+    """Returns (config, module) for the tool, only downloading and importing its source when it changed."""
+    entry = _entry(tool_name, load_config)
+    with entry.lock:
+        filename = entry.config['filename']
+        request = {'Bucket': bucket_name, 'Key': filename}
+        if entry.module is not None and entry.filename == filename and entry.etag is not None:
+            request['IfNoneMatch'] = entry.etag
+        try:
+            response = s3.get_object(**request)
+        except ClientError as e:
+            if 'IfNoneMatch' in request and is_not_modified(e):
+                cache_stats["not_modified"] += 1
+                return entry.config, entry.module
+            raise
+
+        cache_stats["downloads"] += 1
+        _import(tool_name, entry, response['Body'].read())
+        entry.filename = filename
+        entry.etag = response.get('ETag')
+        entry.version_id = response.get('VersionId')
+        print(f"loaded {tool_name} from s3://{bucket_name}/{filename} "
+              f"etag {entry.etag} version {entry.version_id}: {cache_stats}")
+        return entry.config, entry.module
+
+
+def clear():
+    with _lock:
+        for entry in _tools.values():
+            _unload(entry)
+        _tools.clear()
@@ -1,7 +1,13 @@
 """A file to load data into the tools config for DynamoDB, replace the sqs queues with your ones that have been deployed"""
 import os
+import sys
+from pathlib import Path
 import boto3
 from dotenv import load_dotenv
+
+# the config version helper lives in the shared layer, which a standalone run doesn't have on its path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "shared"))
+from tool_config_version import bump_config_version  # noqa: E402
 load_dotenv()
 
 ACCOUNT_ID = boto3.client('sts').get_caller_identity().get('Account')
@@ -93,3 +99,5 @@ for tool in TOOL_EXAMPLES:
         'config': tool
     })
 
+# Tell warm orchestrators the tool set has changed.
+bump_config_version(TOOL_CONFIG_TABLE)
@@ -0,0 +1,159 @@
+"""Keeps the conversation sent to the model within a token budget.
+
+The stored conversation is never changed, compact() returns the copy that is
+sent with each converse call. When its estimated size is over
+COMPACTION_TOKEN_BUDGET, finished stages (an assistant message with toolUse
+blocks and the user message holding their toolResults) are made smaller,
+oldest first, in two steps:
+
+1. The stage's tool results are cut to a short summary. Every toolUse keeps
+   its toolResult.
+2. If that is not enough, whole stages are collapsed in place: the assistant
+   message becomes a text summary of the calls and the user message a text
+   summary of their results. The roles keep alternating and no toolResult is
+   left without its toolUse. Past that, collapsed stages lose their results,
+   oldest first.
+
+Each stage is compacted on its own from the stored conversation and the order
+message is never touched, so a turn's request differs from the previous one
+only from the first stage whose level changed. The prompt cache (see
+prompt_cache.py) still serves everything before that stage. How much that is
+depends on the step:
+
+- the turn the conversation first goes over budget, every finished stage is
+  shrunk at once and only the order is still cached
+- each further stage collapsed (oldest first) keeps the stages before it
+  cached, which is most of the conversation
+- the first collapsed stage to lose its results is the oldest one, so that
+  turn again keeps only the order cached, later ones keep the stages before
+  them
+
+Between those steps the compacted stages are sent byte for byte the same.
+
+The newest COMPACTION_KEEP_STAGES stages and the order itself are always sent
+in full. The model needs them to decide the next step.
+"""
+import json
+import os
+import tracing
+
+COMPACTION_TOKEN_BUDGET = int(os.environ.get('COMPACTION_TOKEN_BUDGET', '3000'))
+COMPACTION_KEEP_STAGES = int(os.environ.get('COMPACTION_KEEP_STAGES', '1'))
+# Rough size of a token in JSON text, close enough to budget with
+CHARS_PER_TOKEN = 4
+RESULT_SUMMARY_CHARS = 200
+COLLAPSED_RESULT_CHARS = 120
+
+CALLS_PREFIX = "Tools called in this step, summarised (tool, input):\n"
+RESULTS_PREFIX = "Their results, summarised (tool, result):\n"
+RESULTS_OMITTED = "Their results are no longer shown."
+
+
+def estimate_tokens(conversation):
+    return len(json.dumps(conversation, default=str, separators=(',', ':'))) // CHARS_PER_TOKEN
+
+
+def result_text(tool_result):
+    parts = []
+    for block in tool_result.get('content', []):
+        if 'text' in block:
+            parts.append(block['text'])
+        elif 'json' in block:
+            data = block['json'].get('data', block['json']) if isinstance(block['json'], dict) else block['json']
+            parts.append(data if isinstance(data, str) else json.dumps(data, default=str))
+    return " ".join(parts)
+
+
+def shorten(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"... ({len(text) - limit} more characters)"
+
+
+def finished_stages(conversation):
+    """Indexes of the assistant messages of the stages that may be compacted, oldest first."""
+    stages = []
+    for index in range(1, len(conversation) - 1):
+        message, reply = conversation[index], conversation[index + 1]
+        if (message['role'] == 'assistant' and reply['role'] == 'user'
+                and any('toolResult' in block for block in reply['content'])):
+            stages.append(index)
+    return stages[:max(0, len(stages) - COMPACTION_KEEP_STAGES)]
+
+
+def shrink_results(message):
+    content = []
+    for block in message['content']:
+        if 'toolResult' not in block:
+            content.append(block)
+            continue
+        text = result_text(block['toolResult'])
+        if len(text) <= RESULT_SUMMARY_CHARS:
+            content.append(block)
+            continue
+        tool_result = {key: value for key, value in block['toolResult'].items() if key != 'content'}
+        tool_result['content'] = [{"json": {"summary": shorten(text, RESULT_SUMMARY_CHARS)}}]
+        content.append({"toolResult": tool_result})
+    return {**message, 'content': content}
+
+
+def stage_summary(assistant_message, results_message):
+    results = {block['toolResult']['toolUseId']: result_text(block['toolResult'])
+               for block in results_message['content'] if 'toolResult' in block}
+    return [{
+        "tool": block['toolUse']['name'],
+        "input": block['toolUse'].get('input'),
+        "result": shorten(results.get(block['toolUse']['toolUseId'], ""), COLLAPSED_RESULT_CHARS),
+    } for block in assistant_message['content'] if 'toolUse' in block]
+
+
+def collapse_stage(assistant_message, results_message, with_results=True):
+    """The stage as a plain text exchange, the same for the same stage on every turn."""
+    summary = stage_summary(assistant_message, results_message)
+    calls = [{"tool": entry["tool"], "input": entry["input"]} for entry in summary]
+    if with_results:
+        results = RESULTS_PREFIX + json.dumps([{"tool": entry["tool"], "result": entry["result"]} for entry in summary])
+    else:
+        results = RESULTS_OMITTED
+    return ({**assistant_message, 'content': [{"text": CALLS_PREFIX + json.dumps(calls)}]},
+            {**results_message, 'content': [{"text": results}]})
+
+
+def compact(conversation, budget=None):
+    """The conversation to send, within budget tokens when the stages that may be compacted allow it."""
+    budget = budget or COMPACTION_TOKEN_BUDGET
+    before = estimate_tokens(conversation)
+    if before <= budget:
+        tracing.annotate(conversation_tokens=before)
+        return conversation
+
+    stages = finished_stages(conversation)
+    compacted = list(conversation)
+    for index in stages:
+        compacted[index + 1] = shrink_results(conversation[index + 1])
+
+    collapsed = 0
+    for index in stages:
+        if estimate_tokens(compacted) <= budget:
+            break
+        compacted[index], compacted[index + 1] = collapse_stage(conversation[index], conversation[index + 1])
+        collapsed += 1
+    # still over with every stage collapsed, the oldest results go first
+    for index in stages:
+        if estimate_tokens(compacted) <= budget:
+            break
+        compacted[index], compacted[index + 1] = collapse_stage(conversation[index], conversation[index + 1],
+                                                                with_results=False)
+
+    after = estimate_tokens(compacted)
+    tracing.annotate(conversation_tokens=after, compacted_from=before)
+    print(json.dumps({
+        "event": "compaction",
+        "tokens_before": before,
+        "tokens_after": after,
+        "budget": budget,
+        "stages_shrunk": len(stages),
+        "stages_collapsed": collapsed,
+        "over_budget": after > budget,
+    }))
+    return compacted
@@ -0,0 +1,111 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from botocore.exceptions import ClientError
+
+# SQS limit on entries per send_message_batch call
+MAX_BATCH_SIZE = 10
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.1
+
+
+class DispatchError(Exception):
+    """Some messages were still not sent after MAX_ATTEMPTS, messages holds them."""
+
+    def __init__(self, messages, failures):
+        codes = sorted({failure.get("Code", "unknown") for failure in failures})
+        super().__init__(f"{len(messages)} messages not sent ({', '.join(codes)})")
+        self.messages = messages
+        self.failures = failures
+
+
+def chunked(items, size):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def send_batch(sqs, queue_url, pending):
+    """One send_message_batch call, returning its Failed entries. A call that fails as a whole fails every entry."""
+    try:
+        response = sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": entry_id, "MessageBody": json.dumps(message)}
+                for entry_id, message in pending.items()
+            ]
+        )
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        print(f"send_message_batch to {queue_url} failed: {e!r}")
+        return [{"Id": entry_id, "Code": error.get("Code", "unknown"), "Message": error.get("Message"),
+                 "SenderFault": error.get("Type") == "Sender"} for entry_id in pending]
+    return response.get("Failed", [])
+
+
+def send_batch_with_retries(sqs, queue_url, messages):
+    """Sends up to MAX_BATCH_SIZE messages to one queue, resending only the entries that failed.
+
+    Returns (message, failed entry) pairs for the sender faults of every attempt
+    and the entries still failing after the last one."""
+    pending = {str(i): message for i, message in enumerate(messages)}
+    given_up = []
+
+    for attempt in range(MAX_ATTEMPTS):
+        failed = send_batch(sqs, queue_url, pending)
+        # sender faults (bad payload etc) won't succeed on retry
+        given_up.extend((pending[entry["Id"]], entry) for entry in failed if entry.get("SenderFault"))
+        retryable = [entry for entry in failed if not entry.get("SenderFault")]
+        if not retryable:
+            break
+        if attempt == MAX_ATTEMPTS - 1:
+            given_up.extend((pending[entry["Id"]], entry) for entry in retryable)
+            break
+        pending = {entry["Id"]: pending[entry["Id"]] for entry in retryable}
+        time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+
+    return given_up
+
+
+def dispatch_to_queue(sqs, queue_url, messages):
+    start = time.perf_counter()
+    failed = []
+    for batch in chunked(messages, MAX_BATCH_SIZE):
+        failed.extend(send_batch_with_retries(sqs, queue_url, batch))
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    stats = {
+        "queue_url": queue_url,
+        "messages": len(messages),
+        "failed": len(failed),
+        "latency_ms": round(latency_ms, 2),
+    }
+    print(f"sqs dispatch: {json.dumps(stats)}")
+    if failed:
+        print(f"failed to send messages to {queue_url}: {[entry for _, entry in failed]}")
+    return stats, failed
+
+
+def dispatch_messages(sqs, messages_by_queue: dict[str, list]):
+    """Sends each queue's messages with send_message_batch, all queues concurrently.
+
+    Returns the per-queue dispatch stats. Raises DispatchError, once every queue
+    has been tried, if any message could not be sent."""
+    if not messages_by_queue:
+        return []
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(messages_by_queue)) as executor:
+        futures = [
+            executor.submit(dispatch_to_queue, sqs, queue_url, messages)
+            for queue_url, messages in messages_by_queue.items()
+        ]
+        results = [future.result() for future in futures]
+
+    total_ms = (time.perf_counter() - start) * 1000
+    print(f"dispatched {sum(r['messages'] for r, _ in results)} messages to {len(results)} queues in {total_ms:.2f}ms")
+    failed = [pair for _, queue_failed in results for pair in queue_failed]
+    if failed:
+        raise DispatchError([message for message, _ in failed], [entry for _, entry in failed])
+    return [stats for stats, _ in results]
@@ -4,171 +4,154 @@ if __name__ == "__main__":
     load_dotenv()
 
 import json
-from typing import Any
-import boto3
 import os
-from tool_config import load_config_from_dynamodb, create_tool_specs, parse_decimals
-import uuid
-import time
-
-MODEL_ID = "anthropic.claude-3-5-sonnet-20241022-v2:0"
-
-sqs = boto3.client('sqs')
-dynamodb = boto3.resource('dynamodb')
-bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
-
-
-ORCHESTRATION_TABLE = os.environ.get('ORCHESTRATION_TABLE')
-WORKFLOW_STATE_TABLE = os.environ.get('WORKFLOW_STATE_TABLE')
+from bootstrap import record_init
+from bedrock_governor import governed_client, invocation_deadline, HIGH
+from tool_config import load_tool_registry
+from dispatcher import dispatch_messages, DispatchError
+from prompt_cache import build_converse_request, converse_with_cache, converse_stream_with_cache
+from streaming import stream_message
+import response_cache
+from compaction import compact
+from model_router import choose_route, converse_routed, LARGE, LARGE_MODEL_ID
+import tracing
+from idempotency import run_once, message_key
+from transport import queue_client
+from completion import load_completion_data, publish_completion
+from workflow_barrier import (create_barrier, add_barrier_node, seal_barrier, complete_barrier_node,
+                              complete_barrier_nodes, consume_barrier, delete_barrier)
+from tool_actions import is_queued, run_sync_calls, sync_result
+import inline_tools  # noqa: F401 registers the inline actions
+from orchestration_store import create_orchestration, save_orchestration, load_orchestration, load_conversation
+from concurrent.futures import ThreadPoolExecutor
+
+# The model for turns that need the most judgement, see model_router for the others
+MODEL_ID = LARGE_MODEL_ID
+
+# orders in flight wait on these turns, they are the last Bedrock work to be shed
+bedrock = governed_client(HIGH, region_name='us-west-2')
+
+
+# Dispatch tools while the model is still generating, see orchestrate_streaming
+STREAMING = os.environ.get('ORCHESTRATOR_STREAMING', 'false').lower() == 'true'
+
+# Turns one invocation may run after tool calls it answered itself. Past that the
+# synchronous results are sent back as completion events and a new invocation goes on.
+MAX_INLINE_TURNS = int(os.environ.get('MAX_INLINE_TURNS', '3'))
 
 SYSTEM_PROMPT = [{
     "text": "You are the manager for a universal fast food restaurant, you need to take in an order and delegate tasks until the order has been delivered. When calling tools, call as many as you can at once, if tasks can be parallelised then they should be. Once you get the initial order you may not ask the user more questions and must make up requirements if your tools request them."
 }]
 
 
-def create_workflow_tracking_record(nodes: list[str]):
-    request_id = str(uuid.uuid4())
-    if len(nodes) == 0:
-        return
-
-    item = {
-        "requestId": request_id,
-    }
-
-    data = {}
-
-    for node in nodes:
-        item[node] = False
-        data[node] = None
-
-    item['data'] = data
-
-    table = dynamodb.Table(WORKFLOW_STATE_TABLE)
-    table.put_item(
-        TableName=WORKFLOW_STATE_TABLE,
-        Item=item
-    )
-
-    return request_id
-
-
-def update_workflow_tracking(node: str, request_id: str, data: Any) -> bool:
-    table = dynamodb.Table(WORKFLOW_STATE_TABLE)
-
-    response = table.update_item(
-        Key={
-            "requestId": request_id
-        },
-        UpdateExpression="SET #node = :completed, #data.#node = :node_data",
-        ExpressionAttributeNames={
-            "#node": node,
-            "#data": "data"
-        },
-        ExpressionAttributeValues={
-            ":completed": True,
-            ":node_data": data
-        },
-        ReturnValues="ALL_NEW"
-    )
-
-    updated_item = response.get("Attributes", {})
-    all_completed = True
-
-    for key, value in updated_item.items():
-        if key not in ["requestId", "data"] and value is False:
-            all_completed = False
-            break
-
-    return all_completed, response
-
-
-def create_orchestration(conversation):
-    instance = int(time.time())
+def process_tool_call(tool_registry, orchestration, tool_name, tool_input, tool_use_id, messages_by_queue, sync_calls):
+    """Queues the tool call up under its target to be sent by dispatch_messages, or adds it to sync_calls
+    when it is answered in this invocation (see tool_actions)."""
+    action = tool_registry.get_action(tool_name)
 
-    item = {
-        'orchestrationId': str(uuid.uuid4()),
-        'instance': instance,
-        'conversation': conversation,
+    payload = {
+        "tool_input": tool_input,
+        "orchestration_id": orchestration["orchestrationId"],
+        "tool_use_id": tool_use_id,
+        "node": tool_name
     }
-    return item
-
-
-def save_orchestration(orchestration):
-    table = dynamodb.Table(ORCHESTRATION_TABLE)
-    table.put_item(
-        TableName=ORCHESTRATION_TABLE,
-        Item=orchestration
-    )
-
+    trace = tracing.inject()
+    if trace is not None:
+        payload["trace"] = trace
 
-def load_orchestration(orchestration_id=None):
-    if orchestration_id is None:
-        return None
+    if is_queued(action):
+        messages_by_queue.setdefault(action["target"], []).append(payload)
     else:
-        table = dynamodb.Table(ORCHESTRATION_TABLE)
-        response = table.get_item(Key={'orchestrationId': orchestration_id})
-        return response['Item']
+        # unknown tools and action types end up here too, they get an error result
+        sync_calls.append((action, payload))
 
 
-def process_tool_call(tools_config, orchestration, tool_name, tool_input, tool_use_id):
-    tool_config = next(
-        (tool for tool in tools_config['tools'] if tool['name'] == tool_name), None)
+def dispatch_queued_calls(messages_by_queue):
+    """Sends the queued tool calls, returning error results for the ones SQS would not take.
 
-    if tool_config is None:
-        print(f"Tool {tool_name} not found in configuration.")
-        return
+    They fail their tool calls rather than the turn, so the barrier still closes and the model sees it."""
+    try:
+        dispatch_messages(queue_client(), messages_by_queue)
+    except DispatchError as e:
+        print(f"failing {len(e.messages)} tool calls: {e}")
+        return {payload["tool_use_id"]: sync_result(payload, f"Tool {payload['node']} could not be sent: {e}", error=True)
+                for payload in e.messages}
+    return {}
 
-    action = tool_config["action"]
-    action_type = action["type"]
-    target = action["target"]
-    payload = {
-        "tool_input": tool_input,
-        "orchestration_id": orchestration["orchestrationId"],
-        "tool_use_id": tool_use_id,
-        "node": tool_name
-    }
 
-    if action_type == "sqs":
-        response = sqs.send_message(
-            QueueUrl=target,
-            MessageBody=json.dumps(payload)
-        )
-        return response
+def publish_sync_results(orchestration, results):
+    """Hands synchronous results to the next invocation, through the barrier like an agent's completion."""
+    for result in results.values():
+        publish_completion(orchestration["orchestrationId"], result["tool_use_id"], result["node"], result["data"],
+                           status=result.get("status"))
 
 
-def invoke_tools_from_conversation(orchestration, tools_config):
-    tool_ids = []
+def invoke_tools_from_conversation(orchestration, tool_registry, inline_turns=0):
+    tool_use_ids = []
+    messages_by_queue = {}
+    sync_calls = []
     output_message = orchestration["conversation"][-1]
 
     for content in output_message.get('content', []):
         if 'toolUse' in content:
             tool_use = content['toolUse']
-            tool_ids.append(tool_use['name'])
+            tool_use_ids.append(tool_use['toolUseId'])
             process_tool_call(
-                tools_config,
+                tool_registry,
                 orchestration,
                 tool_use['name'],
                 tool_use['input'],
-                tool_use['toolUseId']
+                tool_use['toolUseId'],
+                messages_by_queue,
+                sync_calls
             )
         elif 'text' in content:
             print("Text response from model: %s", content['text'])
 
-    if len(tool_ids) > 0:
-        request_id = create_workflow_tracking_record(tool_ids)
-        orchestration["request_id"] = request_id
+    queued = len(tool_use_ids) > len(sync_calls)
+    deferred = bool(sync_calls) and inline_turns >= MAX_INLINE_TURNS
+    if queued or deferred:
+        # the synchronous results are recorded in it too, so the last result in closes it either way
+        orchestration["request_id"] = create_barrier(tool_use_ids)
+    else:
+        orchestration.pop("request_id", None)
+
+    # completions look the request_id up from the saved orchestration, so save before anything is sent.
+    # A turn answered in here is saved too before the next one starts.
+    save_orchestration(orchestration=orchestration)
+    unsent = {}
+    if queued:
+        with tracing.span("sqs.dispatch", messages=sum(len(m) for m in messages_by_queue.values())):
+            unsent = dispatch_queued_calls(messages_by_queue)
+
+    if not sync_calls and not unsent:
+        return
+    results = {**run_sync_calls(sync_calls), **unsent}
+    if deferred:
+        print(f"{inline_turns} inline turns in this invocation, the next turn runs on their completion events")
+        publish_sync_results(orchestration, results)
+        return
+    if queued:
+        results = complete_barrier_nodes(orchestration["request_id"], results)
+        if results is None:
+            # the last agent completion picks the turn up
+            return
+    # every result is in, the next turn runs in this invocation
+    update_orchestration_with_results(results=results, orchestration=orchestration)
+    orchestrate(orchestration=orchestration, inline_turns=inline_turns + 1)
 
 
 def update_orchestration_with_results(results, orchestration):
     tool_results = []
-    data_to_save = results['Attributes']['data']
 
-    for key in data_to_save:
-        data = data_to_save[key]
+    for key in results:
+        data = results[key]
         tool_result = {"toolResult": {
             "toolUseId": data['tool_use_id'],
-            "content": [{"json": {'data': data['data']}}],
+            "content": [{"json": {'data': load_completion_data(data)}}],
         }}
+        if data.get('status') == 'error':
+            tool_result["toolResult"]["status"] = "error"
         tool_results.append(tool_result)
 
     orchestration["conversation"].append({
@@ -177,63 +160,198 @@ def update_orchestration_with_results(results, orchestration):
     })
 
 
-def orchestrate(initial_message=None, orchestration=None):
+def orchestrate(initial_message=None, orchestration=None, inline_turns=0):
+    """Runs the next turn. inline_turns counts the turns this invocation already ran on results it answered itself."""
+    with tracing.span("orchestrator.turn", inline_turns=inline_turns):
+        return orchestrate_turn(initial_message, orchestration, inline_turns)
+
+
+def orchestrate_turn(initial_message=None, orchestration=None, inline_turns=0):
     if orchestration is None:
         orchestration = create_orchestration(conversation=[{
                 "role": "user",
                 "content": [{"text": initial_message}],
             }])
+    tracing.annotate(orchestration_id=orchestration["orchestrationId"], messages=len(orchestration["conversation"]))
+
+    tool_registry = load_tool_registry()
+    inference_config = {
+        "maxTokens": 2048,
+        "temperature": 0,
+    }
 
-    tool_configs = load_config_from_dynamodb()
-
-    response = bedrock.converse(
-        modelId=MODEL_ID,
-        messages=orchestration["conversation"],
-        system=SYSTEM_PROMPT,
-        inferenceConfig={
-            "maxTokens": 2048,
-            "temperature": 0,
-        },
-        toolConfig={
-            "tools": create_tool_specs(tool_configs),
+    route = choose_route(orchestration["conversation"], tool_registry)
+    tracing.annotate(route=route.route)
+
+    # what the model is sent, the stored conversation keeps every result in full
+    conversation = compact(orchestration["conversation"])
+
+    cached_response = None
+    cache_entry = None
+    if response_cache.is_enabled(inference_config):
+        cache_entry = response_cache.cache_key(
+            route.model_id, SYSTEM_PROMPT, tool_registry.version, conversation, inference_config)
+        cached_response = response_cache.lookup(*cache_entry)
+        tracing.annotate(response_cache="hit" if cached_response is not None else "miss")
+
+    def build_request(model_id):
+        return build_converse_request(
+            model_id=model_id,
+            system_prompt=SYSTEM_PROMPT,
+            tool_specs=tool_registry.tool_specs,
+            conversation=conversation,
+            inference_config=inference_config,
             # Allow model to automatically select tools
-            "toolChoice": {"auto": {}}
-        }
-    )
+            tool_choice={"auto": {}}
+        )
+
+    # tool calls streamed from the small model can't be checked before they are dispatched
+    if STREAMING and cached_response is None and route.route == LARGE:
+        return orchestrate_streaming(orchestration, tool_registry, build_request(route.model_id), cache_entry,
+                                     inline_turns)
+
+    response = cached_response
+    if response is None:
+        with tracing.span("bedrock.converse", model=route.model_id):
+            response, answered_by = converse_routed(route, lambda request: converse_with_cache(bedrock, request),
+                                                    build_request, orchestration["conversation"], tool_registry)
+        if cache_entry is not None:
+            if answered_by != route.model_id:
+                # the small model's answer was rejected, the large model's is only valid under its own key
+                cache_entry = response_cache.cache_key(
+                    answered_by, SYSTEM_PROMPT, tool_registry.version, conversation, inference_config)
+            response_cache.store(*cache_entry, response)
 
     orchestration["conversation"].append(response['output']['message'])
 
     invoke_tools_from_conversation(
-        orchestration, tool_configs
+        orchestration, tool_registry, inline_turns
     )
 
+
+def orchestrate_streaming(orchestration, tool_registry, request, cache_entry=None, inline_turns=0):
+    """Runs the turn with converse_stream, sending each tool call off as soon as the model has finished writing it."""
+    # the barrier and the request_id lookup have to exist before any agent can complete
+    request_id = create_barrier([], sealed=False)
+    orchestration["request_id"] = request_id
+    save_orchestration(orchestration=orchestration)
+
+    tool_ids = []
+
+    def dispatch_tool_use(tool_use):
+        add_barrier_node(request_id, tool_use['toolUseId'])
+        messages_by_queue = {}
+        sync_calls = []
+        process_tool_call(
+            tool_registry,
+            orchestration,
+            tool_use['name'],
+            tool_use['input'],
+            tool_use['toolUseId'],
+            messages_by_queue,
+            sync_calls
+        )
+        unsent = dispatch_queued_calls(messages_by_queue)
+        if unsent:
+            complete_barrier_nodes(request_id, unsent)
+        if not sync_calls:
+            return
+        results = run_sync_calls(sync_calls)
+        if inline_turns >= MAX_INLINE_TURNS:
+            # seal_barrier below can't close the barrier on these, their completions will
+            publish_sync_results(orchestration, results)
+        else:
+            # the barrier is not sealed yet, seal_barrier below collects these
+            complete_barrier_nodes(request_id, results)
+
+    with tracing.span("bedrock.converse_stream", model=MODEL_ID), ThreadPoolExecutor() as executor:
+        response = converse_stream_with_cache(bedrock, request)
+        futures = []
+
+        def on_tool_use(tool_use):
+            tool_ids.append(tool_use['name'])
+            futures.append(executor.submit(tracing.copy_context_run(dispatch_tool_use), tool_use))
+
+        message, stop_reason = stream_message(response['stream'], on_tool_use)
+        for future in futures:
+            future.result()
+
+    print(f"streamed turn finished with {stop_reason}, dispatched {tool_ids}")
+    if cache_entry is not None:
+        response_cache.store(*cache_entry, {"output": {"message": message}, "stopReason": stop_reason})
+    orchestration["conversation"].append(message)
+
+    if len(tool_ids) == 0:
+        delete_barrier(request_id)
+        orchestration.pop("request_id")
+        save_orchestration(orchestration=orchestration)
+        return
+
     save_orchestration(orchestration=orchestration)
 
+    results = seal_barrier(request_id)
+    if results is not None:
+        # every agent finished before the stream did, nobody else will pick this up
+        update_orchestration_with_results(
+            results=results, orchestration=orchestration)
+        orchestrate(orchestration=orchestration, inline_turns=inline_turns + 1)
+
+
+def handle_completion(detail):
+    orchestration_id = detail['orchestration_id']
+    try:
+        orchestration = load_orchestration(
+            orchestration_id, include_conversation=False)
+    except Exception as e:
+        print(f"Error loading orchestration: {e}")
+        return
+    request_id = orchestration.get('request_id')
+    if request_id is None:
+        print(f"ignoring completion for {detail['tool_use_id']}, {orchestration_id} is not waiting on any tools")
+        return
+    print(f"request id: {request_id}")
+    results = complete_barrier_node(
+        request_id, detail['tool_use_id'], detail)
+
+    if results is not None:
+        load_conversation(orchestration)
+        update_orchestration_with_results(
+            results=results, orchestration=orchestration)
+        orchestrate(orchestration=orchestration)
+        # until here a redelivery of this completion picks the results up again
+        consume_barrier(request_id)
 
 
 def handler(event, lambda_context):
-    if 'source' in event and event['source'] == 'task.completion':
-        orchestration_id = event['detail']['orchestration_id']
-        try:
-            orchestration = load_orchestration(orchestration_id)
-        except Exception as e:
-            print(f"Error loading orchestration: {e}")
-            return
-        request_id = orchestration['request_id']
-        print(f"request id: {request_id}")
-        node = event['detail']['node']
-        all_completed, results = update_workflow_tracking(
-            node, request_id, event['detail'])
+    # Bedrock waits end in time for a shed turn to be retried
+    with invocation_deadline(lambda_context):
+        handle_event(event)
 
-        if (all_completed):
-            update_orchestration_with_results(
-                results=results, orchestration=orchestration)
-            orchestrate(orchestration=parse_decimals(orchestration))
 
-    elif 'detail' in event:
-        # Handle new order
-        orchestrate(json.dumps(event["detail"]))
+def handle_event(event):
+    if 'source' in event and event['source'] == 'task.completion':
+        detail = event['detail']
+        with tracing.continue_trace(detail.get('trace'), "orchestrator.completion", function_name="orchestrator",
+                                    node=detail.get('node'), tool_use_id=detail.get('tool_use_id')):
+            # duplicate completions are dropped before they can reach the barrier or the model
+            run_once(message_key("orchestrator", detail),
+                     handle_completion, detail)
 
+    elif 'detail' in event:
+        order = event["detail"]
+        # a new order starts its trace
+        with tracing.continue_trace(None, "orchestrator.order", function_name="orchestrator",
+                                    order_id=order.get("orderId") if isinstance(order, dict) else None):
+            # Handle new order
+            if 'id' in event:
+                # EventBridge keeps the event id when it retries a delivery
+                run_once(f"orchestrator#order#{event['id']}",
+                         orchestrate, json.dumps(event["detail"]))
+            else:
+                orchestrate(json.dumps(event["detail"]))
+
+
+record_init("orchestrator")
 
 if __name__ == "__main__":
     handler({
@@ -0,0 +1,15 @@
+"""Tools the orchestrator runs in its own process, see tool_actions.py.
+
+Register a function here with @inline_action and give the tool the action
+{"type": "inline", "target": "<name>"} in the tool config table. It is called
+with the tool input as keyword arguments and its return value is the
+toolResult. Keep these quick and deterministic, anything slow or model driven
+belongs on an agent's queue.
+"""
+from datetime import datetime, timezone
+from tool_actions import inline_action
+
+
+@inline_action("current_time")
+def current_time(**tool_input):
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,164 @@
+"""Picks the model for each orchestrator turn.
+
+Most turns are routine: fan the order out to the cooks, or send the cooked
+meal to the front counter. Those go to ORCHESTRATOR_SMALL_MODEL. A turn goes
+to ORCHESTRATOR_LARGE_MODEL when its features say it needs more judgement:
+
+- more than ROUTING_MAX_TOOLS tools to choose from
+- a conversation past ROUTING_MAX_MESSAGES messages (retries, long orders)
+- a tool result in the previous turn that reports an error
+- a capability that was just fabricated and has to be called for the first time
+
+The small model's answer is checked before it is used. Every tool call must
+name a known tool and carry the schema's required fields with the right JSON
+types, the first turn must call at least one tool, and the answer must not be
+cut off at max_tokens. Otherwise the turn is run again on the large model.
+
+Each turn logs one {"event": "routing", ...} line with the route, the
+features that decided it, whether it fell back and the model latency.
+routing_stats keeps the per-route counts and latency for the container.
+"""
+import json
+import os
+import time
+import tracing
+
+LARGE_MODEL_ID = os.environ.get('ORCHESTRATOR_LARGE_MODEL', "anthropic.claude-3-5-sonnet-20241022-v2:0")
+SMALL_MODEL_ID = os.environ.get('ORCHESTRATOR_SMALL_MODEL', "anthropic.claude-3-5-haiku-20241022-v1:0")
+ROUTING_ENABLED = os.environ.get('ORCHESTRATOR_ROUTING', 'true').lower() == 'true'
+ROUTING_MAX_TOOLS = int(os.environ.get('ROUTING_MAX_TOOLS', '8'))
+ROUTING_MAX_MESSAGES = int(os.environ.get('ROUTING_MAX_MESSAGES', '12'))
+
+SMALL = "small"
+LARGE = "large"
+
+# Phrases the agents and the generic wrapper use when a task did not work out
+ERROR_MARKERS = ("could not", "error", "failed", "has issues", "exception")
+NEW_CAPABILITY_MARKER = "capability has been created"
+
+JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+routing_stats = {
+    route: {"turns": 0, "fallbacks": 0, "latency_ms": 0.0}
+    for route in (SMALL, LARGE)
+}
+
+
+class Route:
+    def __init__(self, route, model_id, features):
+        self.route = route
+        self.model_id = model_id
+        self.features = features
+
+
+def last_tool_results(conversation):
+    """Text of the tool results in the newest user message, empty on the first turn."""
+    if len(conversation) < 2 or conversation[-1]['role'] != 'user':
+        return []
+    results = []
+    for block in conversation[-1]['content']:
+        if 'toolResult' in block:
+            tool_result = block['toolResult']
+            text = json.dumps(tool_result.get('content', []), default=str).lower()
+            results.append((tool_result.get('status'), text))
+    return results
+
+
+def turn_features(conversation, tool_registry):
+    results = last_tool_results(conversation)
+    return {
+        "stage": "order" if len(conversation) == 1 else "results",
+        "tools": len(tool_registry.tools),
+        "messages": len(conversation),
+        "tool_errors": sum(1 for status, text in results
+                           if status == 'error' or any(marker in text for marker in ERROR_MARKERS)),
+        "new_capability": any(NEW_CAPABILITY_MARKER in text for _, text in results),
+    }
+
+
+def choose_route(conversation, tool_registry) -> Route:
+    features = turn_features(conversation, tool_registry)
+    simple = (ROUTING_ENABLED
+              and features["tools"] <= ROUTING_MAX_TOOLS
+              and features["messages"] <= ROUTING_MAX_MESSAGES
+              and features["tool_errors"] == 0
+              and not features["new_capability"])
+    if simple:
+        return Route(SMALL, SMALL_MODEL_ID, features)
+    return Route(LARGE, LARGE_MODEL_ID, features)
+
+
+def matches_type(value, json_type):
+    expected = JSON_TYPES.get(json_type)
+    if expected is None:
+        return True
+    if json_type in ("integer", "number") and isinstance(value, bool):
+        return False
+    return isinstance(value, expected)
+
+
+def invalid_reason(response, conversation, tool_registry):
+    """Why the response can't be used as is, None if it can."""
+    if response.get('stopReason') == 'max_tokens':
+        return "cut off at max_tokens"
+    tool_uses = [block['toolUse'] for block in response['output']['message'].get('content', [])
+                 if 'toolUse' in block]
+    if len(conversation) == 1 and not tool_uses:
+        return "first turn called no tools"
+    for tool_use in tool_uses:
+        schema = tool_registry.get_schema(tool_use['name'])
+        if schema is None:
+            return f"unknown tool {tool_use['name']}"
+        tool_input = tool_use.get('input')
+        if not isinstance(tool_input, dict):
+            return f"{tool_use['name']} input is not an object"
+        for field in schema.get('required', []):
+            if field not in tool_input:
+                return f"{tool_use['name']} is missing {field}"
+        for field, value in tool_input.items():
+            json_type = schema.get('properties', {}).get(field, {}).get('type')
+            if not matches_type(value, json_type):
+                return f"{tool_use['name']} {field} is not a {json_type}"
+    return None
+
+
+def record(route, latency_ms, fallback=None):
+    stats = routing_stats[route.route]
+    stats["turns"] += 1
+    stats["latency_ms"] += latency_ms
+    if fallback is not None:
+        stats["fallbacks"] += 1
+    tracing.annotate(route=route.route, fallback=fallback)
+    print(json.dumps({
+        "event": "routing",
+        "route": route.route,
+        "model": route.model_id,
+        "fallback": fallback,
+        "latency_ms": round(latency_ms, 2),
+        **route.features,
+    }))
+
+
+def converse_routed(route, converse, build_request, conversation, tool_registry):
+    """Runs the turn on the routed model, again on the large one if the small model's answer is invalid.
+
+    build_request(model_id) returns the converse request, converse(request) sends it.
+    Returns the response and the id of the model that gave it."""
+    start = time.perf_counter()
+    response = converse(build_request(route.model_id))
+    if route.route == SMALL:
+        reason = invalid_reason(response, conversation, tool_registry)
+        if reason is not None:
+            print(f"{route.model_id} answer rejected ({reason}), asking {LARGE_MODEL_ID}")
+            response = converse(build_request(LARGE_MODEL_ID))
+            record(route, (time.perf_counter() - start) * 1000, fallback=reason)
+            return response, LARGE_MODEL_ID
+    record(route, (time.perf_counter() - start) * 1000)
+    return response, route.model_id
@@ -0,0 +1,117 @@
+"""Orchestration persistence.
+
+The orchestration table holds a small head item per order (ids, request_id and
+how many turns have been persisted). Every conversation message is stored as
+its own item in the conversation table, keyed by orchestrationId + turn, so a
+save only writes the messages appended since the last save and the head item
+never grows with the conversation.
+"""
+import os
+import time
+import uuid
+from bootstrap import lazy_client
+from ddb_codec import to_item, from_item, serialize, deserialize
+
+ORCHESTRATION_TABLE = os.environ.get('ORCHESTRATION_TABLE')
+CONVERSATION_TABLE = os.environ.get('CONVERSATION_TABLE')
+
+dynamodb = lazy_client('dynamodb')
+
+# BatchWriteItem takes at most 25 requests
+BATCH_WRITE_LIMIT = 25
+
+# Attributes that only live in memory, everything else is part of the head item.
+NON_HEAD_ATTRIBUTES = {'conversation'}
+
+
+def create_orchestration(conversation):
+    instance = int(time.time())
+
+    item = {
+        'orchestrationId': str(uuid.uuid4()),
+        'instance': instance,
+        'turnCount': 0,
+        'conversation': conversation,
+    }
+    return item
+
+
+def save_orchestration(orchestration):
+    """Appends the unsaved turns, then rewrites the head item to point past them."""
+    orchestration_id = orchestration['orchestrationId']
+    conversation = orchestration['conversation']
+    saved_turns = int(orchestration.get('turnCount', 0))
+
+    requests = [{'PutRequest': {'Item': {
+        'orchestrationId': {'S': orchestration_id},
+        'turn': {'N': str(turn)},
+        'message': serialize(message),
+    }}} for turn, message in enumerate(conversation[saved_turns:], start=saved_turns)]
+    for start in range(0, len(requests), BATCH_WRITE_LIMIT):
+        write_batch(requests[start:start + BATCH_WRITE_LIMIT])
+
+    orchestration['turnCount'] = len(conversation)
+    head = {k: v for k, v in orchestration.items() if k not in NON_HEAD_ATTRIBUTES}
+    dynamodb.put_item(TableName=ORCHESTRATION_TABLE, Item=to_item(head))
+
+
+def write_batch(requests, max_attempts=5):
+    """Writes one batch of conversation turns, resending whatever DynamoDB leaves unprocessed."""
+    pending = {CONVERSATION_TABLE: requests}
+    for attempt in range(max_attempts):
+        response = dynamodb.batch_write_item(RequestItems=pending)
+        pending = response.get('UnprocessedItems')
+        if not pending:
+            return
+        time.sleep(0.05 * 2 ** attempt)
+    raise RuntimeError(f"{len(pending[CONVERSATION_TABLE])} conversation turns left unprocessed")
+
+
+def load_orchestration(orchestration_id=None, include_conversation=True):
+    """Loads the head item, and the conversation too unless include_conversation is False.
+
+    Use load_conversation to fetch it later once it is actually needed."""
+    if orchestration_id is None:
+        return None
+
+    response = dynamodb.get_item(
+        TableName=ORCHESTRATION_TABLE,
+        Key={'orchestrationId': {'S': orchestration_id}}
+    )
+    orchestration = from_item(response['Item'])
+
+    if 'conversation' in orchestration:
+        # record written before turns were split out, resave every turn on the next save
+        orchestration['turnCount'] = 0
+    elif include_conversation:
+        load_conversation(orchestration)
+
+    return orchestration
+
+
+def load_conversation(orchestration, start_turn=0):
+    """Fills orchestration['conversation'] with the persisted turns from start_turn onwards."""
+    if 'conversation' in orchestration and start_turn == 0:
+        return orchestration['conversation']
+
+    query_kwargs = {
+        'TableName': CONVERSATION_TABLE,
+        'KeyConditionExpression': 'orchestrationId = :id AND #turn >= :start',
+        'ExpressionAttributeNames': {'#turn': 'turn'},
+        'ExpressionAttributeValues': to_item({
+            ':id': orchestration['orchestrationId'],
+            ':start': start_turn,
+        }),
+        'ConsistentRead': True,
+    }
+    messages = []
+    while True:
+        response = dynamodb.query(**query_kwargs)
+        messages.extend(deserialize(item['message']) for item in response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+        if last_key is None:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_key
+
+    orchestration['conversation'] = messages
+    return messages
@@ -0,0 +1,142 @@
+"""Builds converse requests with Bedrock prompt cache checkpoints and tracks cache usage.
+
+Checkpoints go after the system prompt, after the tool list and after the last
+message of the conversation. The conversation only ever grows, so everything up
+to the previous turn's checkpoint is read back from the cache on the next turn.
+"""
+import json
+import os
+import tracing
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+
+# Models that rejected cache points, left without them for the life of the container.
+# The router sends turns to more than one model, one of them not caching says nothing about the others.
+uncached_models = set()
+
+cache_metrics = {
+    "calls": 0,
+    "input_tokens": 0,
+    "cache_read_tokens": 0,
+    "cache_write_tokens": 0,
+    "cache_hits": 0,
+}
+
+
+def caching_enabled(model_id):
+    return PROMPT_CACHING and model_id not in uncached_models
+
+
+def with_cache_point(conversation):
+    """Copies the conversation with a cache point appended to the last message, the original is left untouched."""
+    if not conversation:
+        return conversation
+    last_message = conversation[-1]
+    return conversation[:-1] + [{
+        **last_message,
+        "content": last_message["content"] + [CACHE_POINT],
+    }]
+
+
+def build_converse_request(model_id, system_prompt, tool_specs, conversation, inference_config, tool_choice=None):
+    tool_config = {
+        "tools": list(tool_specs),
+        "toolChoice": tool_choice or {"auto": {}}
+    }
+    request = {
+        "modelId": model_id,
+        "messages": conversation,
+        "system": system_prompt,
+        "inferenceConfig": inference_config,
+        "toolConfig": tool_config,
+    }
+    if not caching_enabled(model_id):
+        return request
+
+    request["system"] = system_prompt + [CACHE_POINT]
+    tool_config["tools"].append(CACHE_POINT)
+    request["messages"] = with_cache_point(conversation)
+    return request
+
+
+def strip_cache_points(request):
+    return {
+        **request,
+        "system": [block for block in request["system"] if "cachePoint" not in block],
+        "toolConfig": {
+            **request["toolConfig"],
+            "tools": [tool for tool in request["toolConfig"]["tools"] if "cachePoint" not in tool],
+        },
+        "messages": [
+            {**message, "content": [block for block in message["content"] if "cachePoint" not in block]}
+            for message in request["messages"]
+        ],
+    }
+
+
+def call_with_cache_fallback(call, request):
+    """Calls converse or converse_stream, retrying once without cache points if the model does not support them."""
+    model_id = request['modelId']
+    try:
+        return call(**request)
+    except Exception as e:
+        if (not caching_enabled(model_id) or "ValidationException" not in type(e).__name__
+                or "cach" not in str(e).lower()):
+            raise
+        print(f"prompt caching not supported for {model_id}, disabling it for that model: {e}")
+        uncached_models.add(model_id)
+        return call(**strip_cache_points(request))
+
+
+def converse_with_cache(bedrock, request):
+    response = call_with_cache_fallback(bedrock.converse, request)
+    record_usage(response.get("usage", {}))
+    return response
+
+
+def converse_stream_with_cache(bedrock, request):
+    """Opens a converse_stream, usage is recorded by the stream consumer from the metadata event."""
+    return call_with_cache_fallback(bedrock.converse_stream, request)
+
+
+def hit_rate(read_tokens, write_tokens, input_tokens):
+    total = read_tokens + write_tokens + input_tokens
+    return read_tokens / total if total else 0.0
+
+
+def record_usage(usage):
+    """Adds one response's usage to the container totals and logs the turn's cache stats."""
+    tracing.annotate(input_tokens=usage.get("inputTokens"), output_tokens=usage.get("outputTokens"),
+                     cache_read_tokens=usage.get("cacheReadInputTokens"),
+                     cache_write_tokens=usage.get("cacheWriteInputTokens"))
+    read_tokens = usage.get("cacheReadInputTokens", 0)
+    write_tokens = usage.get("cacheWriteInputTokens", 0)
+    input_tokens = usage.get("inputTokens", 0)
+
+    cache_metrics["calls"] += 1
+    cache_metrics["input_tokens"] += input_tokens
+    cache_metrics["cache_read_tokens"] += read_tokens
+    cache_metrics["cache_write_tokens"] += write_tokens
+    if read_tokens > 0:
+        cache_metrics["cache_hits"] += 1
+
+    turn_metrics = {
+        "input_tokens": input_tokens,
+        "cache_read_tokens": read_tokens,
+        "cache_write_tokens": write_tokens,
+        "turn_hit_rate": round(hit_rate(read_tokens, write_tokens, input_tokens), 4),
+        "container_hit_rate": round(get_hit_rate(), 4),
+    }
+    print(f"prompt cache: {json.dumps(turn_metrics)}")
+    return turn_metrics
+
+
+def get_hit_rate():
+    """Share of input tokens served from the cache since the container started."""
+    return hit_rate(
+        cache_metrics["cache_read_tokens"],
+        cache_metrics["cache_write_tokens"],
+        cache_metrics["input_tokens"]
+    )
@@ -0,0 +1,179 @@
+"""Opt-in cache of orchestrator model turns.
+
+With temperature 0, a fixed system prompt and a fixed tool registry, the same
+conversation gives the same turn. The key is a hash of the model, system
+prompt, tool registry version, inference config and the conversation with
+per-order identifiers (order / customer / request ids, uuids and tool use ids)
+swapped for positional placeholders, so repeated order shapes share an entry.
+The same placeholders are applied to the stored response and filled back in
+with the current order's values on a hit.
+
+RESPONSE_CACHE=local keeps an LRU in the warm container, RESPONSE_CACHE=dynamodb
+adds a shared tier in RESPONSE_CACHE_TABLE behind it.
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from bootstrap import lazy_client
+from ddb_codec import to_item, from_item
+
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'off').lower()
+RESPONSE_CACHE_TABLE = os.environ.get('RESPONSE_CACHE_TABLE')
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '3600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+
+# Keys in JSON text blocks (the order detail) whose values identify one order rather than its shape
+ID_KEYS = {"orderId", "customerId", "requestId", "orchestrationId", "orchestration_id", "tool_use_id"}
+UUID_PATTERN = re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b")
+CACHEABLE_STOP_REASONS = {"tool_use", "end_turn"}
+
+dynamodb = lazy_client('dynamodb')
+
+cache_stats = {"hits": 0, "misses": 0, "stores": 0}
+
+
+class LocalCache:
+    """Bounded LRU with per-entry expiry."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at=None):
+        with self.lock:
+            self.entries[key] = (expires_at or time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+local_cache = LocalCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL)
+
+
+def collect_ids(value, found):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in ID_KEYS and isinstance(item, (str, int)) and not isinstance(item, bool):
+                found.append(str(item))
+            else:
+                collect_ids(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            collect_ids(item, found)
+
+
+def find_identifiers(conversation):
+    """Lists the per-order identifiers in the conversation, in the order they first appear."""
+    found = []
+    for message in conversation:
+        for block in message.get("content", []):
+            if "text" in block:
+                try:
+                    collect_ids(json.loads(block["text"]), found)
+                except (ValueError, TypeError):
+                    pass
+                found.extend(UUID_PATTERN.findall(block["text"]))
+            elif "toolUse" in block:
+                found.append(block["toolUse"]["toolUseId"])
+            elif "toolResult" in block:
+                found.append(block["toolResult"]["toolUseId"])
+    return list(dict.fromkeys(found))
+
+
+def substitute(text, replacements):
+    for old, new in replacements:
+        text = re.sub(rf"(?<![\w-]){re.escape(old)}(?![\w-])", lambda _: new, text)
+    return text
+
+
+def cache_key(model_id, system_prompt, tool_version, conversation, inference_config):
+    """Returns the cache key and the identifiers that were swapped for placeholders, in placeholder order."""
+    identifiers = find_identifiers(conversation)
+    placeholders = [(value, f"<id:{index}>") for index, value in enumerate(identifiers)]
+    canonical = json.dumps({
+        "model": model_id,
+        "system": system_prompt,
+        "tools": tool_version,
+        "inference": inference_config,
+        "conversation": conversation,
+    }, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha256(substitute(canonical, placeholders).encode()).hexdigest()
+    return digest, identifiers
+
+
+def new_tool_use_id():
+    return "tooluse_" + secrets.token_urlsafe(16)
+
+
+def lookup(key, identifiers):
+    """Returns the cached response for this conversation, with the current order's identifiers filled back in."""
+    stored = local_cache.get(key)
+    if stored is None and RESPONSE_CACHE == 'dynamodb':
+        stored = load_shared(key)
+    if stored is None:
+        cache_stats["misses"] += 1
+        return None
+
+    cache_stats["hits"] += 1
+    placeholders = [(f"<id:{index}>", value) for index, value in enumerate(identifiers)]
+    response = json.loads(substitute(stored, placeholders))
+    for block in response["output"]["message"]["content"]:
+        if "toolUse" in block:
+            block["toolUse"]["toolUseId"] = new_tool_use_id()
+    print(f"response cache hit: {json.dumps(cache_stats)}")
+    return response
+
+
+def store(key, identifiers, response):
+    if response.get("stopReason") not in CACHEABLE_STOP_REASONS:
+        return
+    placeholders = [(value, f"<id:{index}>") for index, value in enumerate(identifiers)]
+    stored = substitute(json.dumps({
+        "output": response["output"],
+        "stopReason": response["stopReason"],
+    }, default=str), placeholders)
+
+    expires_at = int(time.time()) + RESPONSE_CACHE_TTL
+    local_cache.put(key, stored, expires_at)
+    if RESPONSE_CACHE == 'dynamodb':
+        dynamodb.put_item(TableName=RESPONSE_CACHE_TABLE, Item=to_item({
+            "cacheKey": key,
+            "response": stored,
+            "expiresAt": expires_at,
+        }))
+    cache_stats["stores"] += 1
+
+
+def load_shared(key):
+    response = dynamodb.get_item(TableName=RESPONSE_CACHE_TABLE, Key={"cacheKey": {"S": key}})
+    if "Item" not in response:
+        return None
+    item = from_item(response["Item"])
+    # DynamoDB TTL deletes lazily, expired items can still be read
+    if item["expiresAt"] < time.time():
+        return None
+    local_cache.put(key, item["response"], item["expiresAt"])
+    return item["response"]
+
+
+def is_enabled(inference_config):
+    return RESPONSE_CACHE in ('local', 'dynamodb') and inference_config.get("temperature") == 0
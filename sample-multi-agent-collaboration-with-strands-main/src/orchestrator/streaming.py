@@ -0,0 +1,59 @@
+import json
+from prompt_cache import record_usage
+
+
+def parse_tool_input(raw_input: str):
+    if not raw_input:
+        return {}
+    return json.loads(raw_input)
+
+
+def stream_message(stream, on_tool_use):
+    """Assembles the assistant message from converse_stream events.
+
+    on_tool_use is called with each toolUse block as soon as its input JSON is
+    complete, while the model is still generating the rest of the message.
+    Returns the assembled message and the stop reason."""
+    message = {"role": "assistant", "content": []}
+    blocks = {}
+    raw_inputs = {}
+    stop_reason = None
+
+    for event in stream:
+        if 'messageStart' in event:
+            message['role'] = event['messageStart']['role']
+
+        elif 'contentBlockStart' in event:
+            index = event['contentBlockStart']['contentBlockIndex']
+            start = event['contentBlockStart']['start']
+            if 'toolUse' in start:
+                blocks[index] = {"toolUse": {
+                    "toolUseId": start['toolUse']['toolUseId'],
+                    "name": start['toolUse']['name'],
+                }}
+                raw_inputs[index] = ""
+
+        elif 'contentBlockDelta' in event:
+            index = event['contentBlockDelta']['contentBlockIndex']
+            delta = event['contentBlockDelta']['delta']
+            if 'text' in delta:
+                block = blocks.setdefault(index, {"text": ""})
+                block['text'] += delta['text']
+            elif 'toolUse' in delta:
+                raw_inputs[index] += delta['toolUse']['input']
+
+        elif 'contentBlockStop' in event:
+            index = event['contentBlockStop']['contentBlockIndex']
+            block = blocks.get(index)
+            if block is not None and 'toolUse' in block:
+                block['toolUse']['input'] = parse_tool_input(raw_inputs.pop(index))
+                on_tool_use(block['toolUse'])
+
+        elif 'messageStop' in event:
+            stop_reason = event['messageStop']['stopReason']
+
+        elif 'metadata' in event:
+            record_usage(event['metadata'].get('usage', {}))
+
+    message['content'] = [blocks[index] for index in sorted(blocks)]
+    return message, stop_reason
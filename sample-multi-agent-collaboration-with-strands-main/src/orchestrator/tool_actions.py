@@ -0,0 +1,131 @@
+"""Tool calls the orchestrator answers itself, inside the turn that made them.
+
+A tool's action in the tool config table says how its calls are run:
+
+    {"type": "sqs", "target": "<queue url>"}
+        sent to an agent's queue, the result comes back as a task.completion event
+    {"type": "inline", "target": "<name>"}
+        a Python function registered with @inline_action (see inline_tools.py),
+        called with the tool input as keyword arguments
+    {"type": "lambda", "target": "<function name or ARN>"}
+        invoked synchronously with the same payload an agent gets from SQS,
+        the JSON it returns is the result. The target is a function written
+        for this, the agent Lambdas only take SQS batches and answer with
+        completion events. The orchestrator's role needs lambda:InvokeFunction
+        on it.
+
+sqs calls are sent by dispatch_messages. Every other type is synchronous and
+is registered here with register_action_type. run_sync_calls runs them
+concurrently, each within SYNC_ACTION_TIMEOUT seconds. Their results are shaped
+like completion details, so update_orchestration_with_results can put them in
+the turn's toolResult with the agents' results. A call that fails, times out,
+names an unknown tool or uses an unknown action type gets a toolResult with
+status error. The model sees what went wrong instead of the turn waiting for
+a completion that never comes.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from transport import function_client
+import tracing
+
+SYNC_ACTION_TIMEOUT = float(os.environ.get('SYNC_ACTION_TIMEOUT', '10'))
+SYNC_ACTION_WORKERS = int(os.environ.get('SYNC_ACTION_WORKERS', '8'))
+
+# Action types sent to a queue, every other registered type is run here
+QUEUED_ACTION_TYPES = {"sqs"}
+
+INLINE_ACTIONS = {}
+ACTION_TYPES = {}
+
+executor = ThreadPoolExecutor(max_workers=SYNC_ACTION_WORKERS)
+
+
+class ActionError(Exception):
+    """The tool call could not be run, the message goes back to the model."""
+
+
+def inline_action(name):
+    """Registers fn as the inline action name, for tools configured with {"type": "inline", "target": name}."""
+    def register(fn):
+        INLINE_ACTIONS[name] = fn
+        return fn
+    return register
+
+
+def register_action_type(action_type, runner):
+    """runner(action, payload) returns the result of a call, or raises ActionError."""
+    ACTION_TYPES[action_type] = runner
+
+
+def is_queued(action):
+    return action is not None and action.get("type") in QUEUED_ACTION_TYPES
+
+
+def run_inline(action, payload):
+    fn = INLINE_ACTIONS.get(action["target"])
+    if fn is None:
+        raise ActionError(f"no inline action named {action['target']}")
+    return fn(**(payload["tool_input"] or {}))
+
+
+def run_lambda(action, payload):
+    response = function_client().invoke(
+        FunctionName=action["target"],
+        InvocationType="RequestResponse",
+        Payload=json.dumps(payload).encode("utf-8"),
+    )
+    body = response["Payload"].read()
+    result = json.loads(body) if body else None
+    if response.get("FunctionError"):
+        message = result.get("errorMessage") if isinstance(result, dict) else result
+        raise ActionError(f"{action['target']} raised {message}")
+    return result
+
+
+register_action_type("inline", run_inline)
+register_action_type("lambda", run_lambda)
+
+
+def sync_result(payload, data, error=False):
+    result = {
+        "orchestration_id": payload["orchestration_id"],
+        "tool_use_id": payload["tool_use_id"],
+        "node": payload["node"],
+        "data": data,
+    }
+    if error:
+        result["status"] = "error"
+    return result
+
+
+def run_sync_call(action, payload):
+    if action is None:
+        return sync_result(payload, f"Tool {payload['node']} not found in configuration.", error=True)
+    runner = ACTION_TYPES.get(action.get("type"))
+    if runner is None:
+        return sync_result(payload, f"Tool {payload['node']} has unknown action type {action.get('type')}.",
+                           error=True)
+    with tracing.span("tool.sync", tool=payload["node"], action_type=action["type"]) as span:
+        try:
+            return sync_result(payload, runner(action, payload))
+        except Exception as e:
+            span.set(error=repr(e))
+            print(f"{action['type']} action for {payload['node']} failed: {e!r}")
+            return sync_result(payload, f"Tool {payload['node']} failed: {e}", error=True)
+
+
+def run_sync_calls(calls):
+    """Runs (action, payload) pairs concurrently, returns their results by tool use id."""
+    futures = {payload["tool_use_id"]: (payload, executor.submit(tracing.copy_context_run(run_sync_call), action, payload))
+               for action, payload in calls}
+    deadline = time.monotonic() + SYNC_ACTION_TIMEOUT
+    results = {}
+    for tool_use_id, (payload, future) in futures.items():
+        try:
+            results[tool_use_id] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            results[tool_use_id] = sync_result(
+                payload, f"Tool {payload['node']} did not answer within {SYNC_ACTION_TIMEOUT}s.", error=True)
+    return results
@@ -1,32 +1,30 @@
-from decimal import Decimal
 import os
-from typing import Any
-import boto3
+from bootstrap import lazy_client
+from ddb_codec import from_item, deserialize
+from tool_config_version import CONFIG_VERSION_KEY
 
 CONFIG_TABLE = os.environ.get('TOOL_CONFIG_TABLE')
-dynamodb = boto3.resource('dynamodb')
-
-# Needed because DDB likes to throw decimals in
-def parse_decimals(data: Any) -> Any:
-    """Recursively converts Decimal instances to int (if whole) or float."""
-    if isinstance(data, Decimal):
-        return int(data) if data % 1 == 0 else float(data)
-    elif isinstance(data, dict):
-        return {k: parse_decimals(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [parse_decimals(item) for item in data]
-    else:
-        return data
+dynamodb = lazy_client('dynamodb')
 
+def scan_all_items(table_name):
+    """Scans every page of the table, following LastEvaluatedKey."""
+    items = []
+    scan_kwargs = {'TableName': table_name, 'ConsistentRead': True}
+    while True:
+        response = dynamodb.scan(**scan_kwargs)
+        items.extend(from_item(item) for item in response['Items'])
+        last_key = response.get('LastEvaluatedKey')
+        if last_key is None:
+            return items
+        scan_kwargs['ExclusiveStartKey'] = last_key
 
 
 def load_config_from_dynamodb():
     print(CONFIG_TABLE)
-    table = dynamodb.Table(CONFIG_TABLE)
-    response = table.scan()
-    items = response['Items']
     configs = []
-    for item in items:
+    for item in scan_all_items(CONFIG_TABLE):
+        if item['toolId'] == CONFIG_VERSION_KEY:
+            continue
         configs.append(item['config'])
     print(configs)
     return {'tools': configs}
@@ -37,6 +35,54 @@ def create_tool_specs(tools_config):
         "toolSpec": {
             "name": tool["name"],
             "description": tool["description"],
-            "inputSchema": {"json": parse_decimals(tool["schema"])}
+            "inputSchema": {"json": tool["schema"]}
         }
     } for tool in tools_config["tools"]]
+
+
+def load_config_version():
+    """Reads the tool config version counter, 0 if no tool has been registered through it yet."""
+    response = dynamodb.get_item(
+        TableName=CONFIG_TABLE,
+        Key={'toolId': {'S': CONFIG_VERSION_KEY}},
+        ConsistentRead=True
+    )
+    item = response.get('Item')
+    if item is None:
+        return 0
+    return deserialize(item['version'])
+
+
+class ToolRegistry:
+    """Tool configs for one config version, with the Bedrock toolSpecs prebuilt
+    and the tool actions indexed by name."""
+
+    def __init__(self, version: int, tools: list[dict]):
+        self.version = version
+        self.tools = tools
+        self.tool_specs = create_tool_specs({'tools': tools})
+        self.actions = {tool['name']: tool['action'] for tool in tools}
+        self.schemas = {tool['name']: tool['schema'] for tool in tools}
+
+    def get_action(self, tool_name: str):
+        return self.actions.get(tool_name)
+
+    def get_schema(self, tool_name: str):
+        return self.schemas.get(tool_name)
+
+
+# Kept at module level so it survives between invocations of a warm container.
+_registry = None
+
+
+def load_tool_registry() -> ToolRegistry:
+    """Returns the cached registry, only rescanning the table when the config version has moved."""
+    global _registry
+    version = load_config_version()
+    if _registry is not None and _registry.version == version:
+        return _registry
+
+    tools = load_config_from_dynamodb()['tools']
+    _registry = ToolRegistry(version, tools)
+    print(f"loaded tool registry version {version} with {len(tools)} tools")
+    return _registry
@@ -0,0 +1,191 @@
+"""Fan-in barrier for the tool calls of one orchestrator turn.
+
+The record keeps the set of tool use ids it expects and a pending counter.
+Each completion stores its result and decrements the counter in one
+conditional update, so duplicate or unknown completions are rejected by
+DynamoDB. Once the counter reaches zero on a sealed barrier, a second
+conditional update closes it; only one caller can win that update and it is
+the only one that gets the collected results back.
+
+The barrier remembers which completion closed it. If that caller fails before
+the next turn is saved, its redelivery finds its result already recorded and
+gets the collected results again, until consume_barrier marks them used. Any
+other duplicate is still ignored.
+"""
+import os
+import uuid
+from bootstrap import lazy_client
+from ddb_codec import to_item, from_item, deserialize
+from botocore.exceptions import ClientError
+
+WORKFLOW_STATE_TABLE = os.environ.get('WORKFLOW_STATE_TABLE')
+
+dynamodb = lazy_client('dynamodb')
+
+
+def is_conditional_check_failure(error: ClientError) -> bool:
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+
+def create_barrier(tool_use_ids: list[str], sealed: bool = True) -> str:
+    """Creates the barrier, must happen before any of the tool calls are dispatched.
+
+    Pass sealed=False when the tool calls are not all known yet and add them
+    with add_barrier_node, then call seal_barrier."""
+    request_id = str(uuid.uuid4())
+    item = {
+        "requestId": request_id,
+        "pending": len(tool_use_ids),
+        "sealed": sealed,
+        "closed": False,
+        "data": {},
+    }
+    if tool_use_ids:
+        item["expected"] = set(tool_use_ids)
+
+    dynamodb.put_item(TableName=WORKFLOW_STATE_TABLE, Item=to_item(item))
+    return request_id
+
+
+def add_barrier_node(request_id: str, tool_use_id: str):
+    dynamodb.update_item(
+        TableName=WORKFLOW_STATE_TABLE,
+        Key={"requestId": {"S": request_id}},
+        UpdateExpression="ADD pending :one, expected :ids",
+        ConditionExpression="sealed = :false",
+        ExpressionAttributeValues=to_item({
+            ":one": 1,
+            ":ids": {tool_use_id},
+            ":false": False
+        })
+    )
+
+
+def closer_of(tool_use_ids) -> str:
+    return ",".join(sorted(tool_use_ids))
+
+
+def close_barrier(request_id: str, closer: str = ""):
+    """Closes the barrier if every node is done, returning the collected results to the one caller that closed it.
+
+    closer names that caller, see resume_barrier."""
+    try:
+        response = dynamodb.update_item(
+            TableName=WORKFLOW_STATE_TABLE,
+            Key={"requestId": {"S": request_id}},
+            UpdateExpression="SET closed = :true, closedBy = :closer",
+            ConditionExpression="pending = :zero AND sealed = :true AND closed = :false",
+            ExpressionAttributeValues=to_item({
+                ":zero": 0,
+                ":true": True,
+                ":false": False,
+                ":closer": closer,
+            }),
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as e:
+        if is_conditional_check_failure(e):
+            return None
+        raise
+    return deserialize(response["Attributes"]["data"])
+
+
+def seal_barrier(request_id: str):
+    """Marks that every node has been added, then tries to close the barrier in case they have all completed already."""
+    dynamodb.update_item(
+        TableName=WORKFLOW_STATE_TABLE,
+        Key={"requestId": {"S": request_id}},
+        UpdateExpression="SET sealed = :true",
+        ExpressionAttributeValues=to_item({":true": True})
+    )
+    return close_barrier(request_id)
+
+
+def complete_barrier_node(request_id: str, tool_use_id: str, data):
+    """Records one tool call's result.
+
+    Returns the results of every tool call if this completion closed the
+    barrier, otherwise None. Duplicate deliveries and tool use ids the barrier
+    is not waiting on are ignored."""
+    return complete_barrier_nodes(request_id, {tool_use_id: data})
+
+
+def complete_barrier_nodes(request_id: str, results: dict):
+    """Records the results of several tool calls in one update, see complete_barrier_node.
+
+    The update is all or nothing, if any of them is already recorded or not
+    expected none of them are."""
+    names = {"#data": "data"}
+    values = {":minus_count": -len(results)}
+    assignments = []
+    conditions = []
+    for index, (tool_use_id, data) in enumerate(results.items()):
+        names[f"#id{index}"] = tool_use_id
+        values[f":data{index}"] = data
+        values[f":id_value{index}"] = tool_use_id
+        assignments.append(f"#data.#id{index} = :data{index}")
+        conditions.append(f"contains(expected, :id_value{index}) AND attribute_not_exists(#data.#id{index})")
+    try:
+        response = dynamodb.update_item(
+            TableName=WORKFLOW_STATE_TABLE,
+            Key={"requestId": {"S": request_id}},
+            UpdateExpression=f"SET {', '.join(assignments)} ADD pending :minus_count",
+            ConditionExpression=" AND ".join(conditions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=to_item(values),
+            ReturnValues="UPDATED_NEW"
+        )
+    except ClientError as e:
+        if is_conditional_check_failure(e):
+            return resume_barrier(request_id, results)
+        raise
+
+    pending = deserialize(response["Attributes"]["pending"])
+    print(f"barrier {request_id}: {pending} pending")
+    if pending > 0:
+        return None
+    return close_barrier(request_id, closer_of(results))
+
+
+def resume_barrier(request_id: str, results: dict):
+    """The collected results for a redelivery of the completion that closed the barrier (or should have),
+    while they have not been consumed. None for every other duplicate or unexpected completion."""
+    item = dynamodb.get_item(
+        TableName=WORKFLOW_STATE_TABLE,
+        Key={"requestId": {"S": request_id}},
+        ConsistentRead=True
+    ).get("Item")
+    barrier = from_item(item) if item is not None else {}
+    recorded = barrier.get("data", {})
+    if not barrier or not all(tool_use_id in recorded for tool_use_id in results) or barrier.get("consumed"):
+        print(f"ignoring completion for {', '.join(results)}, already handled or not expected by {request_id}")
+        return None
+
+    closer = closer_of(results)
+    if not barrier["closed"]:
+        if barrier["pending"] == 0 and barrier["sealed"]:
+            # recorded, but the caller failed before it could close the barrier
+            return close_barrier(request_id, closer)
+        return None
+    if barrier.get("closedBy") != closer:
+        print(f"ignoring completion for {', '.join(results)}, {request_id} was closed by {barrier.get('closedBy')}")
+        return None
+    print(f"resuming barrier {request_id}, its results were not consumed")
+    return recorded
+
+
+def consume_barrier(request_id: str):
+    """Marks the closed barrier's results as used, once the turn they were sent with has been saved."""
+    dynamodb.update_item(
+        TableName=WORKFLOW_STATE_TABLE,
+        Key={"requestId": {"S": request_id}},
+        UpdateExpression="SET consumed = :true",
+        ExpressionAttributeValues=to_item({":true": True})
+    )
+
+
+def delete_barrier(request_id: str):
+    dynamodb.delete_item(
+        TableName=WORKFLOW_STATE_TABLE,
+        Key={"requestId": {"S": request_id}}
+    )
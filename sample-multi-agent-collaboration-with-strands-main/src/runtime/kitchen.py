@@ -0,0 +1,288 @@
+"""Runs the whole kitchen in one asyncio process.
+
+The orchestrator, burger-cook, fry-cook, front-counter, fabricator and
+generic-agent-wrapper handlers are imported from their Lambda directories and
+called unchanged. SQS and EventBridge are swapped for in-memory queues and a
+completion bus through shared/transport.py, so a stage starts as soon as the
+previous one posts its message, with no queue polling or cold starts in between.
+Tools with a lambda action are invoked on a function added with
+register_function. The Lambda handlers above take SQS and EventBridge events
+and answer through completion events, so they are not lambda action targets.
+Every delivery runs in a worker thread, so independent agents cook concurrently.
+Records reported in batchItemFailures, and events whose handler raised, are
+delivered again with a doubling delay, up to MAX_DELIVERIES times in all, as
+SQS and Lambda's async retries would.
+DynamoDB, S3 and Bedrock are still the real services.
+
+    PYTHONPATH=src/shared python src/runtime/kitchen.py test-event.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+from botocore.exceptions import ClientError
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SRC_DIR / "shared"))
+
+from transport import use_local_transport  # noqa: E402
+import tracing  # noqa: E402
+
+REDELIVERY_DELAY = 0.5
+MAX_DELIVERIES = 3
+
+# Lambda name -> (source directory, handler function)
+LAMBDAS = {
+    "orchestrator": ("orchestrator", "handler"),
+    "burger-cook": ("agents/burger-cook", "handler"),
+    "fry-cook": ("agents/fry-cook", "handler"),
+    "front-counter": ("agents/front-counter", "handler"),
+    "fabricator": ("fabricator", "lambda_handler"),
+    "generic-agent-wrapper": ("generic-agent-wrapper", "lambda_handler"),
+}
+
+# Queue name (last part of the queue url) -> Lambda it triggers
+QUEUES = {
+    "burger-cook": "burger-cook",
+    "fry-cook": "fry-cook",
+    "front-counter": "front-counter",
+    "fabricator-queue": "fabricator",
+    "generic-queue": "generic-agent-wrapper",
+}
+
+# EventBridge rules on the orchestration bus
+EVENT_RULES = {
+    "meal.request": "orchestrator",
+    "task.completion": "orchestrator",
+}
+
+
+def load_lambda(name, directory):
+    """Imports a Lambda's index.py under a unique module name, its sibling modules stay importable by bare name."""
+    path = SRC_DIR / directory / "index.py"
+    sys.path.insert(0, str(path.parent))
+    try:
+        spec = importlib.util.spec_from_file_location(f"lambda_{name.replace('-', '_')}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(path.parent))
+    return module
+
+
+def lambda_for_queue(queue_url):
+    return QUEUES[queue_url.rstrip("/").split("/")[-1]]
+
+
+class LocalQueueClient:
+    """send_message / send_message_batch onto the runtime's in-memory queues."""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        message_id = str(uuid.uuid4())
+        self.runtime.deliver(lambda_for_queue(QueueUrl), {"Records": [{
+            "messageId": message_id,
+            "body": MessageBody,
+            "eventSource": "local:queue",
+        }]})
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry["MessageBody"])
+            successful.append({"Id": entry["Id"], "MessageId": response["MessageId"]})
+        return {"Successful": successful, "Failed": []}
+
+
+class LocalEventsClient:
+    """put_events onto the runtime's in-memory completion bus."""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def put_events(self, Entries, **kwargs):
+        results = []
+        for entry in Entries:
+            event_id = str(uuid.uuid4())
+            target = EVENT_RULES.get(entry["Source"])
+            if target is not None:
+                self.runtime.deliver(target, {
+                    "id": event_id,
+                    "source": entry["Source"],
+                    "detail-type": entry["DetailType"],
+                    "detail": json.loads(entry["Detail"]),
+                })
+            results.append({"EventId": event_id})
+        return {"FailedEntryCount": 0, "Entries": results}
+
+
+class LocalFunctionClient:
+    """Synchronous invoke of a registered function, picked by the function name or the last part of its ARN."""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def invoke(self, FunctionName, Payload=b"", InvocationType="RequestResponse", **kwargs):
+        handler = self.runtime.functions.get(FunctionName.split(":")[-1])
+        if handler is None:
+            raise ClientError({"Error": {"Code": "ResourceNotFoundException",
+                                         "Message": f"Function not found: {FunctionName}"}}, "Invoke")
+        try:
+            result = handler(json.loads(Payload or b"{}"), None)
+        except Exception as e:
+            return {"StatusCode": 200, "FunctionError": "Unhandled",
+                    "Payload": io.BytesIO(json.dumps({"errorMessage": str(e), "errorType": type(e).__name__}).encode())}
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode())}
+
+
+class KitchenRuntime:
+    def __init__(self, concurrency=8):
+        self.concurrency = concurrency
+        self.loop = None
+        self.queues = {}
+        self.semaphores = {}
+        self.handlers = {}
+        self.functions = {}
+        self.in_flight = 0
+        self.idle = None
+        self.workers = []
+
+    def load(self):
+        # installed before the handlers are imported so module level clients are the local ones too
+        use_local_transport(LocalQueueClient(self), LocalEventsClient(self), LocalFunctionClient(self))
+        for name, (directory, handler_name) in LAMBDAS.items():
+            module = load_lambda(name, directory)
+            self.handlers[name] = getattr(module, handler_name)
+
+    def register_function(self, name, handler):
+        """Makes handler(payload, context) the target of lambda actions naming this function."""
+        self.functions[name] = handler
+
+    def deliver(self, lambda_name, event):
+        """Queues an event for a handler. Safe to call from the worker threads the handlers run in."""
+        self.loop.call_soon_threadsafe(self.enqueue, lambda_name, event)
+
+    def enqueue(self, lambda_name, event, delivery=1):
+        self.in_flight += 1
+        self.idle.clear()
+        self.queues[lambda_name].put_nowait((event, delivery))
+
+    def redeliver(self, lambda_name, event, delivery):
+        if delivery >= MAX_DELIVERIES:
+            print(f"{lambda_name} gave up after {delivery} deliveries")
+            return
+        # counted as in flight while it waits, so drain doesn't return before it runs
+        self.in_flight += 1
+        delay = REDELIVERY_DELAY * 2 ** (delivery - 1)
+
+        def requeue():
+            self.queues[lambda_name].put_nowait((event, delivery + 1))
+
+        self.loop.call_later(delay, requeue)
+
+    async def invoke(self, lambda_name, event, delivery):
+        async with self.semaphores[lambda_name]:
+            start = time.perf_counter()
+            try:
+                result = await asyncio.to_thread(self.handlers[lambda_name], event, None)
+                failed = {failure["itemIdentifier"] for failure in (result or {}).get("batchItemFailures", [])}
+                if failed:
+                    print(f"{lambda_name} failed records {sorted(failed)} on delivery {delivery}")
+                    records = [record for record in event["Records"] if record["messageId"] in failed]
+                    self.redeliver(lambda_name, {**event, "Records": records}, delivery)
+            except Exception as e:
+                print(f"{lambda_name} failed on delivery {delivery}: {e!r}")
+                self.redeliver(lambda_name, event, delivery)
+            finally:
+                print(f"{lambda_name} finished in {(time.perf_counter() - start) * 1000:.0f}ms")
+                self.in_flight -= 1
+                if self.in_flight == 0:
+                    self.idle.set()
+
+    async def consume(self, lambda_name):
+        queue = self.queues[lambda_name]
+        while True:
+            event, delivery = await queue.get()
+            asyncio.create_task(self.invoke(lambda_name, event, delivery))
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        for name in LAMBDAS:
+            self.queues[name] = asyncio.Queue()
+            self.semaphores[name] = asyncio.Semaphore(self.concurrency)
+        self.load()
+        self.workers = [asyncio.create_task(self.consume(name)) for name in LAMBDAS]
+
+    def submit_order(self, detail):
+        self.enqueue("orchestrator", {
+            "id": str(uuid.uuid4()),
+            "source": "meal.request",
+            "detail-type": "Order-Placed",
+            "detail": detail,
+        })
+
+    async def drain(self):
+        """Waits until every delivery, including the ones they triggered, has been handled."""
+        await self.idle.wait()
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+
+def read_orders(path):
+    """Reads order details from a file shaped like test-event.json."""
+    with open(path) as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = [entries]
+    orders = []
+    for entry in entries:
+        detail = entry.get("Detail", entry)
+        orders.append(json.loads(detail) if isinstance(detail, str) else detail)
+    return orders
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("orders", help="file of order events, e.g. test-event.json")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent deliveries per handler")
+    parser.add_argument("--trace", action="store_true",
+                        help="print each order's trace timeline and the span latency histograms at the end")
+    args = parser.parse_args(argv)
+
+    traces = tracing.LocalExporter()
+    if args.trace:
+        tracing.set_exporter(traces)
+    runtime = KitchenRuntime(concurrency=args.concurrency)
+    await runtime.start()
+    start = time.perf_counter()
+    orders = read_orders(args.orders)
+    for order in orders:
+        runtime.submit_order(order)
+    await runtime.drain()
+    print(f"all orders handled in {time.perf_counter() - start:.1f}s")
+    await runtime.stop()
+
+    if args.trace:
+        for order in orders:
+            trace_id = traces.find_trace(order_id=order.get("orderId"))
+            print(f"\norder {order.get('orderId')}")
+            print(traces.timeline(trace_id) if trace_id else "not traced")
+        print("\nspan latency:")
+        print(traces.histograms())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Strands agents built once per container and reused across requests.
+
+An agent handler builds its Agent and tools in a factory and hands it to an
+AgentPool at module level. AgentPool.run checks out an idle agent (building
+one if fewer than AGENT_POOL_SIZE exist), invokes it, and restores it to the
+state it had right after construction before anyone else can use it, so no
+conversation leaks from one order to the next. Concurrent records each get
+their own agent; the pool grows to the number of requests that ran at once,
+or at most AGENT_POOL_SIZE when that is set.
+
+Tools read the request they are working for (orchestration_id, tool_use_id,
+node, tool_input) with current_request() instead of closing over it. It is a
+context variable, which Strands carries into the threads and tasks it runs
+tools on. Code that calls the same tools without an agent (the recipe fast
+path) wraps the calls in request_context.
+"""
+import contextvars
+import copy
+import os
+import threading
+from contextlib import contextmanager
+
+# 0 means no limit, in Lambda the record concurrency already bounds it
+AGENT_POOL_SIZE = int(os.environ.get('AGENT_POOL_SIZE', '0'))
+
+_request = contextvars.ContextVar('agent_request')
+
+
+def current_request() -> dict:
+    """The event of the request the calling tool is running for."""
+    return _request.get()
+
+
+@contextmanager
+def request_context(request: dict):
+    token = _request.set(request)
+    try:
+        yield request
+    finally:
+        _request.reset(token)
+
+
+class PooledAgent:
+    def __init__(self, agent):
+        self.agent = agent
+        if hasattr(agent, 'hooks'):
+            # only Strands agents have hooks, agent_tracing imports strands
+            from agent_tracing import instrument
+            instrument(agent)
+        # newer Strands versions can snapshot messages, state and conversation manager state
+        self.snapshot = agent.take_snapshot(preset="session") if hasattr(agent, 'take_snapshot') else None
+        self.messages = copy.deepcopy(getattr(agent, 'messages', None))
+
+    def reset(self):
+        if self.snapshot is not None:
+            self.agent.load_snapshot(self.snapshot)
+        elif self.messages is not None:
+            self.agent.messages = copy.deepcopy(self.messages)
+        metrics = getattr(self.agent, 'event_loop_metrics', None)
+        if metrics is not None:
+            self.agent.event_loop_metrics = type(metrics)()
+
+
+class AgentPool:
+    def __init__(self, factory, max_size=None):
+        self.factory = factory
+        self.max_size = max_size or AGENT_POOL_SIZE
+        self.idle = []
+        self.created = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> PooledAgent:
+        with self.condition:
+            while not self.idle and self.max_size and self.created >= self.max_size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return PooledAgent(self.factory())
+        except BaseException:
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, pooled: PooledAgent):
+        try:
+            pooled.reset()
+        except Exception as e:
+            # an agent that cannot be cleaned is dropped, the next acquire builds a fresh one
+            print(f"discarding agent that failed to reset: {e!r}")
+            with self.condition:
+                self.created -= 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.idle.append(pooled)
+            self.condition.notify()
+
+    def run(self, request: dict, prompt, **kwargs):
+        """Invokes a pooled agent with prompt, current_request() returns request inside its tools."""
+        with request_context(request):
+            pooled = self.acquire()
+            try:
+                return pooled.agent(prompt, **kwargs)
+            finally:
+                self.release(pooled)
@@ -0,0 +1,58 @@
+"""Spans for the model and tool calls of a Strands agent, see tracing.py.
+
+instrument(agent) registers hooks that open a bedrock span around every model
+call, with the token counts from its usage, and a tool span around every tool
+call. Both are children of the span the agent was invoked in.
+"""
+from strands.hooks import HookProvider, BeforeModelCallEvent, AfterModelCallEvent, BeforeToolCallEvent, AfterToolCallEvent
+import tracing
+
+
+def model_id_of(agent):
+    try:
+        return agent.model.get_config().get('model_id')
+    except Exception:
+        return None
+
+
+class TracingHooks(HookProvider):
+    def __init__(self):
+        # an agent makes one model call at a time, tool calls can overlap
+        self.model_spans = {}
+        self.tool_spans = {}
+
+    def register_hooks(self, registry, **kwargs):
+        registry.add_callback(BeforeModelCallEvent, self.before_model_call)
+        registry.add_callback(AfterModelCallEvent, self.after_model_call)
+        registry.add_callback(BeforeToolCallEvent, self.before_tool_call)
+        registry.add_callback(AfterToolCallEvent, self.after_tool_call)
+
+    def before_model_call(self, event):
+        self.model_spans[id(event.agent)] = tracing.start_span("bedrock.converse_stream", model=model_id_of(event.agent))
+
+    def after_model_call(self, event):
+        span = self.model_spans.pop(id(event.agent), None)
+        if span is None:
+            return
+        if event.stop_response is not None:
+            usage = event.stop_response.message.get('metadata', {}).get('usage', {})
+            span.set(stop_reason=event.stop_response.stop_reason,
+                     input_tokens=usage.get('inputTokens'), output_tokens=usage.get('outputTokens'),
+                     cache_read_tokens=usage.get('cacheReadInputTokens'),
+                     cache_write_tokens=usage.get('cacheWriteInputTokens'))
+        span.end(event.exception)
+
+    def before_tool_call(self, event):
+        self.tool_spans[event.tool_use['toolUseId']] = tracing.start_span("tool", tool=event.tool_use['name'])
+
+    def after_tool_call(self, event):
+        span = self.tool_spans.pop(event.tool_use['toolUseId'], None)
+        if span is None:
+            return
+        span.set(status=(event.result or {}).get('status'))
+        span.end(event.exception)
+
+
+def instrument(agent):
+    agent.hooks.add_hook(TracingHooks())
+    return agent
@@ -0,0 +1,350 @@
+"""Admission control for every Bedrock call, so peak load queues instead of throttling.
+
+Each model has a requests per minute and a tokens per minute limit,
+BEDROCK_RPM_LIMIT / BEDROCK_TPM_LIMIT or its entry in BEDROCK_MODEL_LIMITS
+({"model-id": {"rpm": 50, "tpm": 200000}}). A call is admitted when both
+buckets of its model have room. The tokens a call is charged are estimated
+up front, its input plus maxTokens, as Bedrock reserves them. The difference
+to the usage it reports is settled on the model's next admission.
+
+The buckets are shared in one of two ways, picked with BEDROCK_GOVERNOR:
+
+- dynamodb: one item per model and BEDROCK_GOVERNOR_WINDOW seconds in
+  BEDROCK_GOVERNOR_TABLE. A single conditional ADD admits the call for every
+  container at once.
+- local: an in-process token bucket refilling continuously, for local runs and
+  single containers.
+
+off leaves Bedrock calls alone, with botocore's own retries.
+
+A call that can't be admitted waits for the bucket to refill, up to its
+priority's MAX_WAIT_SECONDS, then it is shed with ShedError. Inside
+invocation_deadline(context) the wait also ends DEADLINE_MARGIN_SECONDS before
+the Lambda runs out of time, so the shed call fails the invocation cleanly and
+its message is retried instead of the Lambda timing out mid-wait. Throttling errors
+that still get through are retried with full jitter backoff. Each one halves
+the model's admitted rate, and every success wins some of it back. While a
+model is backing off, LOW priority calls are shed straight away. The
+orchestrator is HIGH, the agents NORMAL, and image generation and embeddings
+LOW.
+
+governor_stats() holds the per-model counts (admitted, queued, queue_ms,
+throttles, retries, shed, rate_factor). Throttles, sheds and waits also print
+one {"event": "governor", ...} line each.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from bootstrap import client, lazy_client, LazyClient
+from ddb_codec import to_item
+import tracing
+
+BEDROCK_GOVERNOR = os.environ.get('BEDROCK_GOVERNOR', 'local')
+BEDROCK_GOVERNOR_TABLE = os.environ.get('BEDROCK_GOVERNOR_TABLE')
+BEDROCK_RPM_LIMIT = int(os.environ.get('BEDROCK_RPM_LIMIT', '200'))
+BEDROCK_TPM_LIMIT = int(os.environ.get('BEDROCK_TPM_LIMIT', '1000000'))
+BEDROCK_MODEL_LIMITS = json.loads(os.environ.get('BEDROCK_MODEL_LIMITS', '{}'))
+# Length of a shared bucket's window, and the burst a local bucket allows
+BEDROCK_GOVERNOR_WINDOW = int(os.environ.get('BEDROCK_GOVERNOR_WINDOW', '10'))
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', '5'))
+BACKOFF_BASE = float(os.environ.get('BEDROCK_BACKOFF_BASE', '0.5'))
+BACKOFF_CAP = float(os.environ.get('BEDROCK_BACKOFF_CAP', '20'))
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+# How long a call of each priority may wait to be admitted before it is shed
+MAX_WAIT_SECONDS = {HIGH: 30.0, NORMAL: 15.0, LOW: 2.0}
+# Left of the invocation after a shed call, to release its claim and report the failure
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('BEDROCK_DEADLINE_MARGIN', '3'))
+
+MIN_RATE_FACTOR = 0.1
+RATE_RECOVERY = 0.05
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+                  "ModelNotReadyException"}
+GOVERNED_OPERATIONS = {"converse", "converse_stream", "invoke_model", "invoke_model_with_response_stream"}
+# Output tokens charged when a converse request doesn't set maxTokens
+DEFAULT_MAX_TOKENS = 4096
+
+# botocore retries would multiply every throttle, the governor does the retrying
+GOVERNED_RETRIES = None if BEDROCK_GOVERNOR == 'off' else {"total_max_attempts": 1, "mode": "standard"}
+
+
+class ShedError(Exception):
+    """The call was dropped to leave room for higher priority work."""
+
+
+# time.monotonic() past which calls in this context may not wait, see invocation_deadline
+_deadline = contextvars.ContextVar("bedrock_governor_deadline", default=None)
+
+
+@contextmanager
+def invocation_deadline(lambda_context):
+    """Calls made inside don't wait past the invocation's remaining time, less DEADLINE_MARGIN_SECONDS."""
+    if not hasattr(lambda_context, 'get_remaining_time_in_millis'):
+        yield
+        return
+    token = _deadline.set(time.monotonic() + lambda_context.get_remaining_time_in_millis() / 1000
+                          - DEADLINE_MARGIN_SECONDS)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def wait_limit(priority, started):
+    """The time.monotonic() a call started at started may wait until."""
+    limit = started + MAX_WAIT_SECONDS[priority]
+    deadline = _deadline.get()
+    return limit if deadline is None else min(limit, deadline)
+
+
+def limits(model_id):
+    model_limits = BEDROCK_MODEL_LIMITS.get(model_id, {})
+    return model_limits.get("rpm", BEDROCK_RPM_LIMIT), model_limits.get("tpm", BEDROCK_TPM_LIMIT)
+
+
+class LocalBuckets:
+    """Token buckets in this process, each holding up to a window's worth of its per-minute limit."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def refill(self, key, per_minute, now):
+        capacity = max(1.0, per_minute * BEDROCK_GOVERNOR_WINDOW / 60)
+        level, updated = self.buckets.get(key, (capacity, now))
+        return min(capacity, level + (now - updated) * per_minute / 60), capacity
+
+    def admit(self, model_id, tokens, rpm, tpm):
+        """0 if the call is admitted, otherwise how many seconds until it might be."""
+        now = time.monotonic()
+        with self.lock:
+            requests_level, _ = self.refill((model_id, "requests"), rpm, now)
+            tokens_level, tokens_capacity = self.refill((model_id, "tokens"), tpm, now)
+            # a call bigger than the bucket waits for a full one
+            tokens = min(tokens, tokens_capacity)
+            if requests_level >= 1 and tokens_level >= tokens:
+                self.buckets[(model_id, "requests")] = (requests_level - 1, now)
+                self.buckets[(model_id, "tokens")] = (tokens_level - tokens, now)
+                return 0.0
+            self.buckets[(model_id, "requests")] = (requests_level, now)
+            self.buckets[(model_id, "tokens")] = (tokens_level, now)
+            return max((1 - requests_level) * 60 / rpm, (tokens - tokens_level) * 60 / tpm)
+
+
+class DynamoBuckets:
+    """Request and token counters per model and window, shared by every container."""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = lazy_client('dynamodb')
+
+    def admit(self, model_id, tokens, rpm, tpm):
+        now = time.time()
+        window = int(now // BEDROCK_GOVERNOR_WINDOW)
+        window_requests = max(1, int(rpm * BEDROCK_GOVERNOR_WINDOW / 60))
+        window_tokens = max(1, int(tpm * BEDROCK_GOVERNOR_WINDOW / 60))
+        tokens = min(int(tokens), window_tokens)
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={"bucketKey": {"S": f"{model_id}#{window}"}},
+                UpdateExpression="ADD requests :one, tokens :tokens SET expiresAt = :expires_at",
+                ConditionExpression="(attribute_not_exists(requests) OR requests < :max_requests) "
+                                    "AND (attribute_not_exists(tokens) OR tokens <= :max_tokens)",
+                ExpressionAttributeValues=to_item({
+                    ":one": 1,
+                    ":tokens": tokens,
+                    ":max_requests": window_requests,
+                    ":max_tokens": window_tokens - tokens,
+                    ":expires_at": (window + 2) * BEDROCK_GOVERNOR_WINDOW,
+                }),
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return (window + 1) * BEDROCK_GOVERNOR_WINDOW - now
+            raise
+        return 0.0
+
+
+def is_throttle(error):
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in THROTTLE_CODES
+
+
+def estimate_tokens(operation, request):
+    if operation in ("converse", "converse_stream"):
+        sent = {key: request.get(key) for key in ("messages", "system", "toolConfig")}
+        max_tokens = (request.get('inferenceConfig') or {}).get('maxTokens', DEFAULT_MAX_TOKENS)
+        return len(json.dumps(sent, default=str)) // 4 + max_tokens
+    return len(str(request.get('body', ''))) // 4
+
+
+def used_tokens(response):
+    usage = response.get('usage') if isinstance(response, dict) else None
+    if not usage:
+        return None
+    return usage.get('inputTokens', 0) + usage.get('outputTokens', 0)
+
+
+def log(model_id, priority, outcome, **details):
+    print(json.dumps({"event": "governor", "model": model_id, "priority": priority, "outcome": outcome,
+                      **details}))
+
+
+class Governor:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def model(self, model_id):
+        with self.lock:
+            if model_id not in self.models:
+                self.models[model_id] = {
+                    "rate_factor": 1.0, "backoff_until": 0.0, "debt": 0,
+                    "admitted": 0, "queued": 0, "queue_ms": 0.0, "max_queue_ms": 0.0,
+                    "throttles": 0, "retries": 0, "shed": 0,
+                }
+            return self.models[model_id]
+
+    def shed(self, model_id, priority, reason):
+        state = self.model(model_id)
+        with self.lock:
+            state["shed"] += 1
+        log(model_id, priority, "shed", reason=reason)
+        raise ShedError(f"{priority} priority call to {model_id} shed: {reason}")
+
+    def admit(self, model_id, tokens, priority):
+        state = self.model(model_id)
+        started = time.monotonic()
+        limit = wait_limit(priority, started)
+        while True:
+            if priority == LOW and time.monotonic() < state["backoff_until"]:
+                self.shed(model_id, priority, "model is backing off")
+            rpm, tpm = limits(model_id)
+            with self.lock:
+                factor = state["rate_factor"]
+                charge = tokens + state["debt"]
+            wait = self.buckets.admit(model_id, max(0, charge), rpm * factor, tpm * factor)
+            if wait == 0:
+                break
+            if time.monotonic() + wait > limit:
+                self.shed(model_id, priority, f"no room within {round(limit - started, 1)}s")
+            time.sleep(wait + random.uniform(0, wait / 10))
+
+        queue_ms = round((time.monotonic() - started) * 1000, 2)
+        with self.lock:
+            state["admitted"] += 1
+            # settles the debt this call was charged for, leaving what succeeded() added since.
+            # A refund bigger than this call's charge is carried to the next one
+            state["debt"] -= max(0, charge) - tokens
+            if queue_ms >= 1:
+                state["queued"] += 1
+                state["queue_ms"] += queue_ms
+                state["max_queue_ms"] = max(state["max_queue_ms"], queue_ms)
+        if queue_ms >= 1:
+            tracing.annotate(governor_queue_ms=queue_ms)
+            log(model_id, priority, "queued", queue_ms=queue_ms)
+
+    def throttled(self, model_id, priority, attempt):
+        """Slows the model down and returns how long to back off before the next attempt."""
+        ceiling = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+        state = self.model(model_id)
+        with self.lock:
+            state["throttles"] += 1
+            state["rate_factor"] = max(MIN_RATE_FACTOR, state["rate_factor"] / 2)
+            state["backoff_until"] = max(state["backoff_until"], time.monotonic() + ceiling)
+            factor = state["rate_factor"]
+        delay = random.uniform(0, ceiling)
+        tracing.annotate(governor_throttles=state["throttles"])
+        log(model_id, priority, "throttled", attempt=attempt, backoff_s=round(delay, 3), rate_factor=factor)
+        return delay
+
+    def succeeded(self, model_id, estimated, used):
+        state = self.model(model_id)
+        with self.lock:
+            state["rate_factor"] = min(1.0, state["rate_factor"] + RATE_RECOVERY)
+            if used is not None:
+                state["debt"] += used - estimated
+
+    def call(self, model_id, priority, tokens, fn):
+        for attempt in range(1, BEDROCK_MAX_ATTEMPTS + 1):
+            self.admit(model_id, tokens, priority)
+            try:
+                response = fn()
+            except ClientError as e:
+                if not is_throttle(e) or attempt == BEDROCK_MAX_ATTEMPTS:
+                    raise
+                delay = self.throttled(model_id, priority, attempt)
+                if time.monotonic() + delay > wait_limit(priority, time.monotonic()):
+                    self.shed(model_id, priority, "no time left to retry")
+                state = self.model(model_id)
+                with self.lock:
+                    state["retries"] += 1
+                time.sleep(delay)
+                continue
+            self.succeeded(model_id, tokens, used_tokens(response))
+            return response
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                if BEDROCK_GOVERNOR == 'dynamodb' and BEDROCK_GOVERNOR_TABLE:
+                    _governor = Governor(DynamoBuckets(BEDROCK_GOVERNOR_TABLE))
+                else:
+                    _governor = Governor(LocalBuckets())
+    return _governor
+
+
+def governor_stats():
+    current = governor()
+    with current.lock:
+        return {model_id: {key: value for key, value in state.items() if key not in ("backoff_until", "debt")}
+                for model_id, state in current.models.items()}
+
+
+class GovernedClient:
+    """Bedrock runtime client whose model calls go through the governor at the given priority."""
+
+    def __init__(self, bedrock_client, priority):
+        self._client = bedrock_client
+        self._priority = priority
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in GOVERNED_OPERATIONS or BEDROCK_GOVERNOR == 'off':
+            return attribute
+
+        def governed(**request):
+            return governor().call(request.get('modelId'), self._priority, estimate_tokens(name, request),
+                                   lambda: attribute(**request))
+        return governed
+
+
+def governed_client(priority, **kwargs):
+    """A lazily created bedrock-runtime client governed at priority, kwargs as for boto3.client."""
+    kwargs.setdefault('config', Config(retries=GOVERNED_RETRIES))
+    return GovernedClient(LazyClient(lambda: client('bedrock-runtime', **kwargs)), priority)
+
+
+def govern(model, priority):
+    """Routes a Strands BedrockModel's calls through the governor, returns the model."""
+    if BEDROCK_GOVERNOR != 'off':
+        model.client = GovernedClient(model.client, priority)
+    return model
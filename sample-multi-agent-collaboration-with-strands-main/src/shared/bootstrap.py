@@ -0,0 +1,125 @@
+"""Cold start helpers shared by every handler.
+
+Handler modules import this first, time their heavy imports with timed(),
+and call record_init() as their last statement. That prints one structured
+log line per container with how long each heavy import and the whole module
+init took. AWS clients and Bedrock models are built on first use through
+lazy_client / lazy, so code paths that never touch them pay nothing.
+
+    {"event": "init", "function": "burger-cook", "init_ms": 812.4, "imports": {"strands": 640.2}, ...}
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.RLock()
+_clients = {}
+# start of the module init currently being measured, moved on by record_init
+_init_started = time.perf_counter()
+import_times = {}
+lazy_init_times = {}
+# init report of every function initialised in this process, by name
+init_reports = {}
+
+
+@contextmanager
+def timed(name):
+    """Records how long the block takes under name in this init's import times."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        import_times[name] = round(import_times.get(name, 0) + elapsed, 2)
+
+
+def timed_import(module_name):
+    """Imports a module, recording the time only the first time it is loaded."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with timed(module_name):
+        return importlib.import_module(module_name)
+
+
+def record_init(function_name):
+    """Logs this module's init duration and import times, then starts measuring the next one."""
+    global _init_started
+    now = time.perf_counter()
+    report = {
+        "event": "init",
+        "function": function_name,
+        "init_type": os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE", "local"),
+        "init_ms": round((now - _init_started) * 1000, 2),
+        "imports": dict(import_times),
+    }
+    init_reports[function_name] = report
+    print(json.dumps(report))
+    import_times.clear()
+    _init_started = now
+
+
+def _record_lazy_init(name, started):
+    elapsed = round((time.perf_counter() - started) * 1000, 2)
+    lazy_init_times[name] = elapsed
+    print(json.dumps({"event": "lazy_init", "name": name, "ms": elapsed}))
+
+
+def _cached(key, factory):
+    value = _clients.get(key)
+    if value is None:
+        with _lock:
+            value = _clients.get(key)
+            if value is None:
+                started = time.perf_counter()
+                value = factory()
+                _clients[key] = value
+                _record_lazy_init(key[1], started)
+    return value
+
+
+def client(service_name, **kwargs):
+    """boto3 client shared by everything in the container with the same arguments."""
+    def factory():
+        boto3 = timed_import("boto3")
+        return boto3.client(service_name, **kwargs)
+    return _cached(("client", service_name, tuple(sorted(kwargs.items()))), factory)
+
+
+def resource(service_name, **kwargs):
+    def factory():
+        boto3 = timed_import("boto3")
+        return boto3.resource(service_name, **kwargs)
+    return _cached(("resource", service_name, tuple(sorted(kwargs.items()))), factory)
+
+
+class LazyClient:
+    """Stands in for a client at module level, the real one is created on the first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def lazy_client(service_name, **kwargs):
+    return LazyClient(lambda: client(service_name, **kwargs))
+
+
+def lazy_resource(service_name, **kwargs):
+    return LazyClient(lambda: resource(service_name, **kwargs))
+
+
+def lazy(name, factory):
+    """Returns a function building factory() once on first call, e.g. a BedrockModel."""
+    return lambda: _cached(("lazy", name), factory)
+
+
+def reset():
+    """Drops every cached client, used when the AWS stand-ins change."""
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,181 @@
+"""Publishes task.completion events back to the orchestrator.
+
+Every agent, the fabricator and the generic wrapper call publish_completion
+when a tool call is done. Calls from concurrently processed records are
+grouped: the first caller sends, and whatever queued up while it was sending
+goes out together in the next put_events, up to 10 entries and 256KB per
+call. Only the entries EventBridge reports as failed are retried. Each caller
+still waits for its own entry, so a completion that could not be published
+fails its record and SQS redelivers it.
+
+Details over the EventBridge entry limit are written to
+COMPLETION_PAYLOAD_BUCKET and the event carries a data_ref instead of data;
+the orchestrator reads it back with load_completion_data.
+"""
+import json
+import os
+import threading
+import time
+from transport import events_client
+import bootstrap
+import tracing
+
+COMPLETION_PAYLOAD_BUCKET = os.environ.get('COMPLETION_PAYLOAD_BUCKET')
+
+MAX_ENTRIES_PER_CALL = 10
+# EventBridge limit for one entry and for a whole PutEvents request
+MAX_REQUEST_SIZE = 256 * 1024
+MAX_ATTEMPTS = 4
+BASE_DELAY_SECONDS = 0.1
+
+
+def entry_size(entry):
+    """Size as EventBridge counts it, the UTF-8 length of the entry's strings."""
+    return sum(len(entry[key].encode('utf-8')) for key in ('Source', 'DetailType', 'Detail', 'EventBusName') if key in entry)
+
+
+def offload(detail):
+    """Moves data to S3 and leaves a reference in the detail."""
+    if COMPLETION_PAYLOAD_BUCKET is None:
+        raise ValueError("completion detail is over the EventBridge limit and COMPLETION_PAYLOAD_BUCKET is not set")
+    key = f"completions/{detail['orchestration_id']}/{detail['tool_use_id']}.json"
+    bootstrap.client('s3').put_object(
+        Bucket=COMPLETION_PAYLOAD_BUCKET, Key=key, Body=json.dumps(detail['data']).encode('utf-8'))
+    reference = {k: v for k, v in detail.items() if k != 'data'}
+    reference['data_ref'] = {'bucket': COMPLETION_PAYLOAD_BUCKET, 'key': key}
+    return reference
+
+
+def build_completion(orchestration_id, tool_use_id, node, data, status=None):
+    detail = {
+        'orchestration_id': orchestration_id,
+        'data': data,
+        'tool_use_id': tool_use_id,
+        'node': node
+    }
+    if status is not None:
+        detail['status'] = status
+    trace = tracing.inject()
+    if trace is not None:
+        detail['trace'] = trace
+    entry = {
+        'Source': 'task.completion',
+        'DetailType': 'task.completion',
+        'EventBusName': os.environ.get('COMPLETION_BUS_NAME'),
+        'Detail': json.dumps(detail),
+    }
+    if entry_size(entry) > MAX_REQUEST_SIZE:
+        entry['Detail'] = json.dumps(offload(detail))
+    return entry
+
+
+def load_completion_data(detail):
+    """Returns the completion's data, reading it from S3 if it was offloaded."""
+    if 'data_ref' not in detail:
+        return detail['data']
+    reference = detail['data_ref']
+    response = bootstrap.client('s3').get_object(Bucket=reference['bucket'], Key=reference['key'])
+    return json.loads(response['Body'].read())
+
+
+class PendingEntry:
+    def __init__(self, entry):
+        self.entry = entry
+        self.size = entry_size(entry)
+        self.done = threading.Event()
+        self.event_id = None
+        self.error = None
+
+
+class CompletionPublisher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = []
+        self.sending = False
+
+    def publish(self, entry):
+        """Sends the entry, possibly together with other callers' entries, returning its event id."""
+        pending = PendingEntry(entry)
+        with self.lock:
+            self.queue.append(pending)
+            leader = not self.sending
+            self.sending = True
+        if leader:
+            self.drain()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.event_id
+
+    def next_batch(self):
+        batch, size = [], 0
+        while self.queue and len(batch) < MAX_ENTRIES_PER_CALL and (not batch or size + self.queue[0].size <= MAX_REQUEST_SIZE):
+            size += self.queue[0].size
+            batch.append(self.queue.pop(0))
+        return batch
+
+    def drain(self):
+        batch = []
+        try:
+            while True:
+                with self.lock:
+                    batch = self.next_batch()
+                    if not batch:
+                        self.sending = False
+                        return
+                self.send(batch)
+        finally:
+            if batch:
+                # send blew up: its callers and anyone queued behind them would wait forever,
+                # and with sending left set no later caller would lead
+                with self.lock:
+                    stranded = batch + self.queue
+                    self.queue = []
+                    self.sending = False
+                error = RuntimeError("completion publisher failed while sending")
+                for pending in stranded:
+                    if not pending.done.is_set():
+                        pending.error = pending.error or error
+                        pending.done.set()
+
+    def send(self, batch):
+        """Puts the batch, retrying only the failed entries, and settles every entry in it."""
+        remaining = batch
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+            try:
+                response = events_client().put_events(Entries=[pending.entry for pending in remaining])
+            except Exception as e:
+                print(f"put_events failed for {len(remaining)} entries: {e!r}")
+                for pending in remaining:
+                    pending.error = e
+                continue
+
+            failed = []
+            for pending, result in zip(remaining, response['Entries']):
+                if 'ErrorCode' in result:
+                    pending.error = RuntimeError(f"{result['ErrorCode']}: {result.get('ErrorMessage')}")
+                    failed.append(pending)
+                else:
+                    pending.event_id = result['EventId']
+                    pending.error = None
+                    pending.done.set()
+            print(f"completion events: {len(remaining) - len(failed)} posted, {len(failed)} failed")
+            remaining = failed
+            if not remaining:
+                return
+
+        for pending in remaining:
+            pending.done.set()
+
+
+publisher = CompletionPublisher()
+
+
+def publish_completion(orchestration_id, tool_use_id, node, data, status=None):
+    """Tells the orchestrator a tool call is done, returns the event id. status "error" marks a failed call."""
+    with tracing.span("eventbridge.publish", node=node, tool_use_id=tool_use_id) as current:
+        event_id = publisher.publish(build_completion(orchestration_id, tool_use_id, node, data, status))
+        current.set(event_id=event_id)
+        return event_id
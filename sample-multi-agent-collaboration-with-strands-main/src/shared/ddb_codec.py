@@ -0,0 +1,97 @@
+"""Converts between Python values and DynamoDB attribute values.
+
+Used with the low-level boto3 DynamoDB client in place of the resource layer.
+Reads go straight to native types: numbers come back as int when whole and
+float otherwise, so nothing has to walk the result again to strip Decimals.
+Writes accept floats, which the resource layer rejects, by sending their
+shortest round-trip repr as the number string.
+"""
+import math
+from decimal import Decimal
+
+
+def _number(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+
+def _number_text(value) -> str:
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"DynamoDB cannot store {value}")
+        return repr(value)
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            raise ValueError(f"DynamoDB cannot store {value}")
+        return str(value)
+    return str(value)
+
+
+def serialize(value) -> dict:
+    # bool has to be checked before int, it is a subclass
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, (int, float, Decimal)):
+        return {"N": _number_text(value)}
+    if isinstance(value, dict):
+        return {"M": {k: serialize(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [serialize(v) for v in value]}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, (bytes, bytearray)):
+        return {"B": bytes(value)}
+    if isinstance(value, (set, frozenset)):
+        return _serialize_set(value)
+    raise TypeError(f"Unsupported type {type(value).__name__} for DynamoDB")
+
+
+def _serialize_set(value) -> dict:
+    if not value:
+        raise ValueError("DynamoDB does not store empty sets")
+    if all(isinstance(v, str) for v in value):
+        return {"SS": list(value)}
+    if all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in value):
+        return {"NS": [_number_text(v) for v in value]}
+    if all(isinstance(v, (bytes, bytearray)) for v in value):
+        return {"BS": [bytes(v) for v in value]}
+    raise TypeError("DynamoDB sets must hold only strings, only numbers or only binary")
+
+
+def deserialize(value: dict):
+    (tag, inner), = value.items()
+    if tag == "S":
+        return inner
+    if tag == "M":
+        return {k: deserialize(v) for k, v in inner.items()}
+    if tag == "L":
+        return [deserialize(v) for v in inner]
+    if tag == "N":
+        return _number(inner)
+    if tag == "BOOL":
+        return inner
+    if tag == "NULL":
+        return None
+    if tag == "SS":
+        return set(inner)
+    if tag == "NS":
+        return {_number(v) for v in inner}
+    if tag == "B":
+        return inner
+    if tag == "BS":
+        return set(inner)
+    raise TypeError(f"Unknown DynamoDB type {tag}")
+
+
+def to_item(item: dict) -> dict:
+    """Serializes a whole item, also used for Key and ExpressionAttributeValues."""
+    return {k: serialize(v) for k, v in item.items()}
+
+
+def from_item(item: dict) -> dict:
+    return {k: deserialize(v) for k, v in item.items()}
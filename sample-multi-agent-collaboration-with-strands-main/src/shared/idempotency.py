@@ -0,0 +1,110 @@
+"""Drops duplicate deliveries of the same piece of work.
+
+SQS and EventBridge deliver at least once. Before doing any work a handler
+claims a key built from orchestration_id + tool_use_id with a conditional put.
+A duplicate of completed work finds the claim and is skipped. Claims are
+marked completed on success and released on failure so a retry can run. Both
+states expire through the table's TTL.
+
+A duplicate that arrives while another invocation still holds the claim raises
+ClaimInProgress instead of being skipped. That invocation may yet fail, so the
+duplicate is left for SQS or Lambda to retry. IDEMPOTENCY_IN_PROGRESS_TIMEOUT
+is set a little above each function's timeout, after which a claim whose
+invocation died can be taken over.
+
+Without IDEMPOTENCY_TABLE set (local runs) every call just runs.
+"""
+import os
+import time
+from bootstrap import lazy_client
+from botocore.exceptions import ClientError
+from ddb_codec import to_item, from_item
+
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE')
+# How long an in-progress claim blocks duplicates, set just above the Lambda timeout
+IN_PROGRESS_TIMEOUT = int(os.environ.get('IDEMPOTENCY_IN_PROGRESS_TIMEOUT', '900'))
+# How long a completed key is remembered
+COMPLETED_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+dynamodb = lazy_client('dynamodb')
+
+
+class ClaimInProgress(Exception):
+    """Another invocation is still working on the key, the delivery should be retried later."""
+
+
+def message_key(scope: str, message: dict) -> str:
+    """Key for a tool call delivered to an agent, or its completion delivered to the orchestrator."""
+    return f"{scope}#{message['orchestration_id']}#{message['tool_use_id']}"
+
+
+def claim(key: str) -> bool:
+    """Returns True if the caller now owns the key, False if it is completed.
+
+    Raises ClaimInProgress while another invocation's claim has not expired.
+    """
+    now = int(time.time())
+    try:
+        dynamodb.put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item=to_item({
+                "idempotencyKey": key,
+                "status": IN_PROGRESS,
+                "expiresAt": now + IN_PROGRESS_TIMEOUT,
+            }),
+            # expired items may not have been removed by TTL yet
+            ConditionExpression="attribute_not_exists(idempotencyKey) OR expiresAt < :now",
+            ExpressionAttributeValues=to_item({":now": now})
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        response = dynamodb.get_item(TableName=IDEMPOTENCY_TABLE, Key=to_item({"idempotencyKey": key}),
+                                     ConsistentRead=True)
+        existing = from_item(response["Item"]) if "Item" in response else None
+        if existing is not None and existing.get("status") == IN_PROGRESS:
+            raise ClaimInProgress(f"{key} is in progress elsewhere until {existing.get('expiresAt')}")
+        # completed, or released again since the put
+        return existing is None and claim(key)
+    return True
+
+
+def complete(key: str):
+    dynamodb.update_item(
+        TableName=IDEMPOTENCY_TABLE,
+        Key=to_item({"idempotencyKey": key}),
+        UpdateExpression="SET #status = :completed, expiresAt = :expires_at",
+        ExpressionAttributeNames={"#status": "status"},
+        ExpressionAttributeValues=to_item({
+            ":completed": COMPLETED,
+            ":expires_at": int(time.time()) + COMPLETED_TTL
+        })
+    )
+
+
+def release(key: str):
+    dynamodb.delete_item(TableName=IDEMPOTENCY_TABLE, Key=to_item({"idempotencyKey": key}))
+
+
+def run_once(key: str, fn, *args, **kwargs):
+    """Runs fn unless key has already been completed, releasing the claim if fn raises.
+
+    Raises ClaimInProgress, without running fn, while another invocation holds the claim.
+    """
+    if IDEMPOTENCY_TABLE is None:
+        return fn(*args, **kwargs)
+
+    if not claim(key):
+        print(f"skipping duplicate delivery {key}")
+        return None
+
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        release(key)
+        raise
+    complete(key)
+    return result
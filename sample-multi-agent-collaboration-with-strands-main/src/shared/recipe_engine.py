@@ -0,0 +1,100 @@
+"""Runs known recipes directly, without a model in the loop.
+
+A Recipe is a DAG of Steps. Each step calls an action (usually one of the
+agent's own tools) once the steps it comes after are done, optionally after a
+timer, with arguments built from the earlier steps' results. Steps without a
+dependency between them run at the same time and timers are asyncio sleeps, so
+a recipe waiting on the fryer holds no thread.
+
+Agents try to match an order to a recipe first and only fall back to their
+Strands agent for orders no recipe matches.
+"""
+import asyncio
+import inspect
+import time
+import tracing
+
+
+class Step:
+    def __init__(self, name, action, after=(), delay=0, args=None):
+        """args maps the results of earlier steps (by step name) to the action's keyword arguments."""
+        self.name = name
+        self.action = action
+        self.after = tuple(after)
+        self.delay = delay
+        self.args = args
+
+
+class Recipe:
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = {step.name: step for step in steps}
+        if len(self.steps) != len(steps):
+            raise ValueError(f"recipe {name} has duplicate step names")
+        for step in steps:
+            for dependency in step.after:
+                if dependency not in self.steps:
+                    raise ValueError(f"step {step.name} in recipe {name} comes after unknown step {dependency}")
+        self.check_acyclic()
+
+    def check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"recipe {self.name} has a cycle through {name}")
+            visiting.add(name)
+            for dependency in self.steps[name].after:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+
+async def run_step(step, tasks, results):
+    if step.after:
+        await asyncio.gather(*(tasks[dependency] for dependency in step.after))
+    if step.delay:
+        await asyncio.sleep(step.delay)
+    with tracing.span("recipe.step", step=step.name):
+        return await call_step(step, results)
+
+
+async def call_step(step, results):
+    kwargs = step.args(results) if step.args is not None else {}
+    if inspect.iscoroutinefunction(step.action):
+        result = await step.action(**kwargs)
+    else:
+        # tools may do I/O, keep the loop free for the other steps
+        result = await asyncio.to_thread(step.action, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+    results[step.name] = result
+    return result
+
+
+async def run_recipe_async(recipe):
+    results = {}
+    tasks = {}
+    for name, step in recipe.steps.items():
+        tasks[name] = asyncio.ensure_future(run_step(step, tasks, results))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return results
+
+
+def run_recipe(recipe):
+    """Runs every step of the recipe, returning each step's result by name."""
+    start = time.perf_counter()
+    with tracing.span("recipe", recipe=recipe.name):
+        results = asyncio.run(run_recipe_async(recipe))
+    print(f"recipe {recipe.name} finished in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return results
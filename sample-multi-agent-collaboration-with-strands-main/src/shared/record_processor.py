@@ -0,0 +1,105 @@
+"""Processes the records of one SQS batch concurrently.
+
+Every SQS triggered handler passes its event here with a function that
+handles one message body. Records run on up to RECORD_CONCURRENCY threads and
+the handler returns {"batchItemFailures": [...]}, so with
+ReportBatchItemFailures enabled on the event source SQS only redelivers the
+records that failed instead of the whole batch.
+
+A record that runs longer than RECORD_TIMEOUT seconds, or is still running
+when the Lambda is about to time out, is reported as failed so the rest of the
+batch is not lost. Python threads cannot be killed, so its work is not
+cancelled and it keeps its idempotency claim. A redelivery that finds the
+claim still in progress is reported as failed again rather than acked, so the
+message stays on the queue until the first attempt completes (the redelivery
+is then skipped as a duplicate) or fails and releases the claim (the
+redelivery runs it).
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import tracing
+from idempotency import ClaimInProgress
+from bedrock_governor import invocation_deadline
+
+RECORD_CONCURRENCY = int(os.environ.get('RECORD_CONCURRENCY', '4'))
+# 0 means records are only limited by the Lambda's remaining time
+RECORD_TIMEOUT = float(os.environ.get('RECORD_TIMEOUT', '0'))
+# Time kept back to return the failures before the Lambda itself times out
+RETURN_MARGIN_SECONDS = 2.0
+# Longest wait between deadline checks, a record can start at any time
+POLL_SECONDS = 1.0
+
+
+def batch_deadline(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - RETURN_MARGIN_SECONDS
+
+
+def process_records(event, context, handle_message, concurrency=None, timeout=None):
+    """Calls handle_message(body) for every record's JSON body, returning the partial batch response."""
+    concurrency = concurrency or RECORD_CONCURRENCY
+    timeout = RECORD_TIMEOUT if timeout is None else timeout
+    records = event.get('Records', [])
+    if not records:
+        return {"batchItemFailures": []}
+
+    deadline = batch_deadline(context)
+    started = {}
+
+    def run(record):
+        started[record['messageId']] = time.monotonic()
+        body = json.loads(record['body'])
+        # the queue is named after the function it feeds
+        queue = record.get('eventSourceARN', '').replace('/', ':').split(':')[-1] or None
+        with tracing.continue_trace(body.get('trace') if isinstance(body, dict) else None, "sqs.record",
+                                    function_name=queue, message_id=record['messageId']), \
+                invocation_deadline(context):
+            handle_message(body)
+
+    failures = []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(records))))
+    futures = {executor.submit(run, record): record for record in records}
+    pending = set(futures)
+    try:
+        while pending:
+            now = time.monotonic()
+            deadlines = [deadline] if deadline is not None else []
+            if timeout > 0:
+                deadlines += [started[futures[f]['messageId']] + timeout
+                              for f in pending if futures[f]['messageId'] in started]
+            wait_for = min([d - now for d in deadlines] + [POLL_SECONDS])
+            done, pending = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                record = futures[future]
+                error = future.exception()
+                if isinstance(error, ClaimInProgress):
+                    print(f"record {record['messageId']} is still in progress elsewhere, leaving it for redelivery")
+                    failures.append(record)
+                elif error is not None:
+                    print(f"record {record['messageId']} failed: {error!r}")
+                    failures.append(record)
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                for future in pending:
+                    print(f"record {futures[future]['messageId']} not finished before the Lambda timeout")
+                    failures.append(futures[future])
+                pending = set()
+            elif timeout > 0:
+                for future in list(pending):
+                    message_id = futures[future]['messageId']
+                    if message_id in started and now - started[message_id] >= timeout:
+                        print(f"record {message_id} timed out after {timeout}s")
+                        failures.append(futures[future])
+                        pending.discard(future)
+    finally:
+        # don't wait for timed out records, queued ones that never started are cancelled
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if failures:
+        print(f"{len(failures)} of {len(records)} records failed")
+    return {"batchItemFailures": [{"itemIdentifier": record['messageId']} for record in failures]}
@@ -0,0 +1,23 @@
+"""The version counter of the tool config table.
+
+The table holds one reserved item, CONFIG_VERSION_KEY, whose version is bumped
+whenever a tool is added or changed. The orchestrator keeps its parsed tool
+registry between invocations and only rescans the table when the version has
+moved (see orchestrator/tool_config.py), so every writer of tool configs calls
+bump_config_version after its write.
+"""
+from bootstrap import lazy_client
+
+CONFIG_VERSION_KEY = "__config_version__"
+
+dynamodb = lazy_client('dynamodb')
+
+
+def bump_config_version(table_name):
+    dynamodb.update_item(
+        TableName=table_name,
+        Key={'toolId': {'S': CONFIG_VERSION_KEY}},
+        UpdateExpression="ADD #version :one",
+        ExpressionAttributeNames={"#version": "version"},
+        ExpressionAttributeValues={":one": {"N": "1"}}
+    )
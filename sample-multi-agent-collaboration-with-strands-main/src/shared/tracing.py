@@ -0,0 +1,255 @@
+"""Traces an order across the orchestrator, the queues and the agents.
+
+One order is one trace. Each piece of work in it is a span: an orchestrator
+turn, a Bedrock call, a queued record, a tool call, a completion publish. The
+context of the current span travels with the work. process_tool_call puts
+inject() into the SQS payload as "trace", and publish_completion puts it in
+the completion Detail. The receiving side continues the trace with
+continue_trace. That span also records how long the message waited to be
+picked up (queue_ms), and whether it ran in a cold container (cold_start,
+init_ms).
+
+Finished spans go to the exporter. TRACE_EXPORTER=log (the default) prints
+one {"event": "span", ...} line per span. none drops them. Local runs install
+a LocalExporter instead, which keeps the spans and renders a per-order
+timeline and per-span latency histograms.
+"""
+import contextvars
+import json
+import os
+import secrets
+import statistics
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import bootstrap
+
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'log')
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+def new_id(size):
+    return secrets.token_hex(size)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def end(self, error=None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        exporter().export(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, parent=None, **attributes) -> Span:
+    """Starts a span under parent (a Span or an injected context), the current span if not given.
+
+    The span is not made current, end() it yourself. Use span() for a block."""
+    if parent is None:
+        parent = current_span()
+    if isinstance(parent, Span):
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    if parent:
+        return Span(name, parent['trace_id'], parent.get('span_id'), attributes)
+    return Span(name, new_id(16), None, attributes)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    current = start_span(name, parent, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def annotate(**attributes):
+    """Sets attributes on the current span, if there is one."""
+    current = current_span()
+    if current is not None:
+        current.set(**attributes)
+
+
+def inject():
+    """The current span's context for a message payload, None outside a trace."""
+    current = current_span()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "span_id": current.span_id, "sent_at": time.time()}
+
+
+_cold_functions = set()
+_cold_lock = threading.Lock()
+
+
+def cold_start(function_name):
+    """cold_start (and init_ms) attributes, True only for the first work a function does in this container."""
+    with _cold_lock:
+        if function_name in _cold_functions:
+            return {"cold_start": False}
+        _cold_functions.add(function_name)
+    report = bootstrap.init_reports.get(function_name)
+    if report is None and len(bootstrap.init_reports) == 1:
+        # a Lambda container only ever initialises one function
+        report = next(iter(bootstrap.init_reports.values()))
+    return {"cold_start": True, "init_ms": report["init_ms"] if report else None}
+
+
+def continue_trace(context, name, function_name=None, **attributes):
+    """Span for work received in a message, under the sender's span when the message carries one."""
+    if context and context.get('sent_at'):
+        attributes['queue_ms'] = round((time.time() - context['sent_at']) * 1000, 2)
+    if function_name is not None:
+        attributes.update(cold_start(function_name))
+        attributes['function'] = function_name
+    return span(name, parent=context or None, **attributes)
+
+
+def copy_context_run(fn):
+    """Wraps fn to run in the caller's trace context, for executor.submit."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+class LogExporter:
+    def export(self, span):
+        print(json.dumps({"event": "span", **span.to_dict()}, default=str))
+
+
+class NoopExporter:
+    def export(self, span):
+        pass
+
+
+# Upper bounds of the histogram buckets in ms
+HISTOGRAM_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+class LocalExporter:
+    """Keeps every span in memory for local runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def export(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def trace(self, trace_id):
+        with self.lock:
+            return [s for s in self.spans if s.trace_id == trace_id]
+
+    def find_trace(self, **attributes):
+        """The trace id of the first span with all of these attributes, None if there is none."""
+        with self.lock:
+            for s in self.spans:
+                if all(s.attributes.get(k) == v for k, v in attributes.items()):
+                    return s.trace_id
+        return None
+
+    def timeline(self, trace_id):
+        """The trace as an indented tree, each span with its start offset and duration in ms."""
+        spans = sorted(self.trace(trace_id), key=lambda s: s.start)
+        if not spans:
+            return f"no spans for trace {trace_id}"
+        origin = spans[0].start
+        ids = {s.span_id for s in spans}
+        children = defaultdict(list)
+        for s in spans:
+            children[s.parent_id if s.parent_id in ids else None].append(s)
+
+        lines = [f"trace {trace_id}: {len(spans)} spans, "
+                 f"{(max(s.start * 1000 + s.duration_ms for s in spans) - origin * 1000):.1f}ms"]
+
+        def render(s, depth):
+            details = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+            error = f" ERROR {s.error}" if s.error else ""
+            lines.append(f"{(s.start - origin) * 1000:9.1f}ms {s.duration_ms:9.1f}ms  "
+                         f"{'  ' * depth}{s.name} {details}{error}".rstrip())
+            for child in children[s.span_id]:
+                render(child, depth + 1)
+
+        for root in children[None]:
+            render(root, 0)
+        return "\n".join(lines)
+
+    def histograms(self):
+        """Latency distribution of every span name, and queue_ms of the spans that waited on a queue."""
+        series = defaultdict(list)
+        with self.lock:
+            for s in self.spans:
+                series[s.name].append(s.duration_ms)
+                if 'queue_ms' in s.attributes:
+                    series[f"{s.name} (queued)"].append(s.attributes['queue_ms'])
+
+        lines = []
+        for name in sorted(series):
+            values = sorted(series[name])
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(f"{name}: n={len(values)} p50={statistics.median(values):.1f}ms "
+                         f"p95={p95:.1f}ms max={values[-1]:.1f}ms")
+            counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+            for value in values:
+                counts[next((i for i, bound in enumerate(HISTOGRAM_BUCKETS) if value <= bound),
+                            len(HISTOGRAM_BUCKETS))] += 1
+            widest = max(counts)
+            for i, count in enumerate(counts):
+                if count == 0:
+                    continue
+                label = f"<= {HISTOGRAM_BUCKETS[i]}ms" if i < len(HISTOGRAM_BUCKETS) else f"> {HISTOGRAM_BUCKETS[-1]}ms"
+                lines.append(f"  {label:>10} {'#' * max(1, round(40 * count / widest))} {count}")
+        return "\n".join(lines)
+
+
+_exporter = None
+
+
+def exporter():
+    global _exporter
+    if _exporter is None:
+        _exporter = NoopExporter() if TRACE_EXPORTER == 'none' else LogExporter()
+    return _exporter
+
+
+def set_exporter(new_exporter):
+    global _exporter
+    _exporter = new_exporter
@@ -0,0 +1,48 @@
+"""Where handlers get their SQS, EventBridge and Lambda clients from.
+
+In Lambda these are the container's shared boto3 clients from bootstrap. The
+single-process runtime (src/runtime/kitchen.py) installs in-memory
+replacements with use_local_transport so the same handlers talk to local
+queues, a local completion bus and locally loaded functions instead.
+"""
+import threading
+import bootstrap
+
+_lock = threading.Lock()
+# local replacements installed by use_local_transport
+_clients = {}
+
+
+def _client(service_name):
+    client = _clients.get(service_name)
+    if client is None:
+        return bootstrap.client(service_name)
+    return client
+
+
+def queue_client():
+    """Client with send_message / send_message_batch."""
+    return _client('sqs')
+
+
+def events_client():
+    """Client with put_events."""
+    return _client('events')
+
+
+def function_client():
+    """Client with invoke, for tools answered by a synchronous Lambda call."""
+    return _client('lambda')
+
+
+def use_local_transport(queue_client, events_client, function_client=None):
+    with _lock:
+        _clients['sqs'] = queue_client
+        _clients['events'] = events_client
+        if function_client is not None:
+            _clients['lambda'] = function_client
+
+
+def reset_transport():
+    with _lock:
+        _clients.clear()